@@ -1,11 +1,15 @@
 """hepdata_lib main."""
+# pylint: disable=too-many-lines
 
+import copy
 import os
+import hashlib
 import shutil
-import tarfile
 import warnings
 from collections import defaultdict
+from contextlib import contextmanager
 from decimal import Decimal
+from itertools import count
 from re import match as rematch
 import numpy as np
 import yaml
@@ -17,28 +21,60 @@ except ImportError:
     from yaml import Loader, SafeDumper as Dumper
 from yaml.representer import SafeRepresenter
 
-from hepdata_validator.full_submission_validator import FullSubmissionValidator
-from hepdata_lib import helpers
+from hepdata_lib import archive, build, helpers, profiling, rasterizers
+from hepdata_lib.cache import BuildCache, ImageCache, DEFAULT_MAX_SIZE
+from hepdata_lib.columns import Column, ValueList
 from hepdata_lib.root_utils import RootFileReader
+from hepdata_lib.yaml_emitter import emit_table
 
 MAPPING_TAG = yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG
 
 
-def dict_representer(dumper, data):
-    """represent dict."""
-    return dumper.represent_dict(data.items())
-
-
 def dict_constructor(loader, node):
     """construct dict."""
     return defaultdict(loader.construct_pairs(node))
 
+
+def numpy_str_representer(dumper, data):
+    """represent numpy string scalar."""
+    return dumper.represent_str(str(data))
+
+
+def numpy_float_representer(dumper, data):
+    """represent numpy floating point scalar."""
+    return dumper.represent_float(float(data))
+
+
+def numpy_int_representer(dumper, data):
+    """represent numpy integer scalar."""
+    return dumper.represent_int(int(data))
+
+
+def numpy_bool_representer(dumper, data):
+    """represent numpy boolean scalar."""
+    return dumper.represent_bool(bool(data))
+
+
+def register_representers(dumper):
+    """
+    Register the representers needed to write hepdata_lib output on a YAML dumper class.
+
+    :param dumper: Dumper class to register the representers on.
+    :type dumper: yaml.SafeDumper or yaml.CSafeDumper
+    """
+    dumper.add_representer(defaultdict, SafeRepresenter.represent_dict)
+    dumper.add_representer(str, SafeRepresenter.represent_str)
+    dumper.add_representer(ValueList, SafeRepresenter.represent_list)
+    dumper.add_representer(np.str_, numpy_str_representer)
+    dumper.add_multi_representer(np.floating, numpy_float_representer)
+    dumper.add_multi_representer(np.integer, numpy_int_representer)
+    dumper.add_multi_representer(np.bool_, numpy_bool_representer)
+
 yaml.add_representer(defaultdict, SafeRepresenter.represent_dict)
-Dumper.add_representer(defaultdict, dict_representer)
+yaml.add_representer(ValueList, SafeRepresenter.represent_list)
+register_representers(Dumper)
 Loader.add_constructor(MAPPING_TAG, dict_constructor)
 
-Dumper.add_representer(str,
-                       SafeRepresenter.represent_str)
 yaml.add_representer(np.str_,
                        SafeRepresenter.represent_str)
 
@@ -47,6 +83,13 @@ warnings.filterwarnings("always", category=DeprecationWarning, module="hepdata_l
 
 __version__ = "0.21.0"
 
+# Source of the revision numbers of ChangeTrackingMixin, unique within a process
+_REVISIONS = count(1)
+
+# Size of the "dependent_variables:" and "independent_variables:" keys of a data file
+_TABLE_KEYS_SIZE = 45
+
+
 class AdditionalResourceMixin:
     """Functionality related to additional materials."""
 
@@ -137,7 +180,37 @@ class AdditionalResourceMixin:
             helpers.check_file_size(ifile, upper_limit=100)
             shutil.copy2(ifile, outdir)
 
-class Variable:
+class ChangeTrackingMixin:
+    """
+    Functionality related to tracking changes, used to invalidate cached output.
+
+    Each attribute assignment, including the assignment of new values via a property setter,
+    gives the object a new revision number. Methods that modify an attribute in place
+    must call touch.
+    """
+
+    _revision = 0
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        self.touch()
+
+    def touch(self):
+        """Mark the object as changed."""
+        object.__setattr__(self, "_revision", next(_REVISIONS))
+
+    @property
+    def revision(self):
+        """
+        Revision of the object. Changes whenever the object changes.
+
+        Revision numbers are never reused within a process, so that
+        two objects never share a revision.
+        """
+        return self._revision
+
+
+class Variable(ChangeTrackingMixin):
     """A Variable is a wrapper for a list of values + some meta data."""
 
     # pylint: disable=too-many-instance-attributes
@@ -154,14 +227,20 @@ class Variable:
         self.zero_uncertainties_warning = zero_uncertainties_warning
         # needed to make pylint happy, see https://github.com/PyCQA/pylint/issues/409
         self._values = None
-        self.values = values if values else []
+        self.values = values if values is not None else []
         self.uncertainties = []
         self.digits = 5
 
     @property
     def values(self):
-        """Value getter."""
-        return self._values
+        """
+        Value getter.
+
+        The values are stored as a Column and converted to a list on each access.
+        Changes made to the list in place are written back to the Variable
+        (see columns.ValueList).
+        """
+        return ValueList(self)
 
     @values.setter
     def values(self, value_list):
@@ -169,34 +248,29 @@ class Variable:
         if self.is_binned:
             # Check that the input is well-formed
             try:
-                assert all(len(x) == 2 for x in value_list)
+                if not isinstance(value_list, (np.ndarray, Column)):
+                    value_list = list(value_list)
+                    assert all(len(x) == 2 for x in value_list)
+                self._values = Column.from_values(value_list, pairs=True)
             except (AssertionError, TypeError, ValueError) as err:
                 msg = "For binned Variables, values should be tuples of length two: \
                                  (lower bin edge, upper bin edge)."
                 raise ValueError(msg) from err
-
-            # All good
-            self._values = [
-                            (
-                             helpers.sanitize_value(x[0]),
-                             helpers.sanitize_value(x[1])
-                            ) for x in value_list
-                            ]
         else:
             # Check that the input is well-formed
             try:
-                parsed_values = [helpers.sanitize_value(x) for x in value_list]
+                self._values = Column.from_values(value_list)
             except (TypeError, ValueError) as err:
                 raise ValueError("Malformed input for unbinned variable: ", value_list) from err
-            self._values = parsed_values
+
+    @property
+    def values_column(self):
+        """Column holding the values, without conversion to a list."""
+        return self._values
 
     def scale_values(self, factor):
         """Multiply each value by constant factor. Also applies to uncertainties."""
-        if not self.is_binned:
-            self.values = [factor * x for x in self.values]
-        else:
-            self.values = [(factor * x[0], factor * x[1])
-                           for x in self.values]
+        self._values = self._values.scaled(factor)
 
         for unc in self.uncertainties:
             unc.scale_values(factor)
@@ -211,6 +285,7 @@ class Variable:
         if units:
             qualifier["units"] = units
         self.qualifiers.append(qualifier)
+        self.touch()
 
     def add_uncertainty(self, uncertainty):
         """
@@ -226,28 +301,37 @@ class Variable:
         if not isinstance(uncertainty, Uncertainty):
             raise TypeError(f"Expected 'Uncertainty', instead got '{type(uncertainty)}'.")
 
-        lenvar = len(self.values)
-        lenunc = len(uncertainty.values)
+        lenvar = len(self._values)
+        lenunc = len(uncertainty.values_column)
         if lenvar and (lenvar != lenunc):
             raise ValueError(f"Length of uncertainty list ({lenunc})" \
                              "is not the same as length of Variable" \
                              f"values list ({lenvar})!.")
         self.uncertainties.append(uncertainty)
+        self.touch()
 
-    def make_dict(self):
-        # pylint: disable=too-many-branches
+    @property
+    def is_memory_mapped(self):
+        """True if the values or uncertainties are read from a memory-mapped file."""
+        return self._values.is_memory_mapped or any(
+            unc.values_column.is_memory_mapped for unc in self.uncertainties)
+
+    @property
+    def revision(self):
         """
-        Return all data in this Variable as a dictionary.
+        Revision of the Variable, including its qualifiers and uncertainties.
 
-        The dictionary structure follows the hepdata conventions,
-        so that dumping this dictionary to YAML will give a file
-        that hepdata can read.
+        Also changes if the qualifiers or the list of uncertainties are modified in place.
+        """
+        return (self._revision, repr(self.qualifiers),
+                tuple(unc.revision for unc in self.uncertainties))
 
-        Uncertainties associated to this Variable are also written into
-        the dictionary.
+    def make_header_dict(self):
+        """
+        Return the meta data of this Variable as a dictionary.
 
-        This function is intended to be called internally by the Submission object.
-        Except for debugging purposes, no user should have to call this function.
+        The dictionary holds the header and qualifiers of the Variable,
+        following the hepdata conventions. The values are added by make_dict.
         """
         tmp = {}
         tmp["header"] = {"name": self.name}
@@ -256,65 +340,255 @@ class Variable:
 
         if self.qualifiers:
             tmp["qualifiers"] = self.qualifiers
+        return tmp
 
-        tmp["values"] = []
+    def update_hash(self, hasher):
+        """
+        Feed everything that goes into the data file entry of this Variable into a hash object.
 
-        nonzero_uncs = helpers.any_uncertainties_nonzero(
-                                                        self.uncertainties,
-                                                        size=len(self._values)
-                                                        )
-        for i, value in enumerate(self._values):
-            valuedict = defaultdict(list)
+        :param hasher: Hash object, e.g. hashlib.sha256().
+        """
+        meta = [self.make_header_dict(), self.is_independent, self.is_binned, self.digits]
+        meta.extend((unc.label, unc.is_symmetric) for unc in self.uncertainties)
+        hasher.update(yaml.dump(meta, Dumper=Dumper).encode("utf-8"))
+        self._values.update_hash(hasher)
+        for unc in self.uncertainties:
+            unc.values_column.update_hash(hasher)
+
+    @property
+    def nbytes(self):
+        """Number of bytes used to store the values and uncertainties of this Variable."""
+        return self._values.nbytes + sum(unc.values_column.nbytes for unc in self.uncertainties)
+
+    def stats(self):
+        """
+        Return a report of the size of this Variable.
+
+        :returns: dict -- with the following keys:
+
+            * "name": name of the Variable.
+            * "independent": True for independent variables.
+            * "bins": number of bins.
+            * "uncertainties": number of uncertainties.
+            * "uncertainty_entries": number of bins times the number of uncertainties.
+            * "nbytes": memory used by the values and uncertainties (see nbytes).
+            * "memory_mapped": True if values are read from a memory-mapped file.
+            * "estimated_size": estimated number of bytes in the data file (see estimate_size).
+        """
+        nbins = len(self._values)
+        return {
+            "name": self.name,
+            "independent": self.is_independent,
+            "bins": nbins,
+            "uncertainties": len(self.uncertainties),
+            "uncertainty_entries": nbins * len(self.uncertainties),
+            "nbytes": self.nbytes,
+            "memory_mapped": self.is_memory_mapped,
+            "estimated_size": self.estimate_size(),
+        }
+
+    def select_bins(self, start, stop):
+        """
+        Return a copy of this Variable restricted to a range of bins.
+
+        The uncertainties and qualifiers are copied as well. The values are not copied,
+        but shared with this Variable.
+
+        :param start: Index of the first bin.
+        :type start: int
+
+        :param stop: Index after the last bin.
+        :type stop: int
+
+        :returns: Variable -- the selected bins.
+        """
+        part = Variable(self.name, is_independent=self.is_independent, is_binned=self.is_binned,
+                        units=self.units, values=self._values[start:stop],
+                        zero_uncertainties_warning=self.zero_uncertainties_warning)
+        part.qualifiers = copy.deepcopy(self.qualifiers)
+        part.digits = self.digits
+        for unc in self.uncertainties:
+            unc_part = Uncertainty(unc.label, is_symmetric=unc.is_symmetric)
+            unc_part.values = unc.values_column[start:stop]
+            part.add_uncertainty(unc_part)
+        return part
+
+    def estimate_bin_size(self):
+        """
+        Estimate the number of bytes written to the data file for each bin of this Variable.
+
+        The estimate assumes that the entries of all uncertainties are written for each bin,
+        and that each number takes as many characters as significant digits are kept
+        plus four for the sign, the decimal point and the exponent.
 
-            if self.is_binned:
-                valuedict["low"] = helpers.relative_round(value[0],
-                                                          self.digits)
-                valuedict["high"] = helpers.relative_round(value[1],
-                                                           self.digits)
+        :returns: int -- estimated number of bytes per bin.
+        """
+        number = self.digits + 4
+        if self.is_binned:
+            # "  - high: ...", "    low: ..."
+            size = 21 + 2 * number
+        else:
+            # "  - value: ..."
+            size = 11 + number
+        if self.uncertainties:
+            # "  - errors:", and the value is moved to the next line
+            size += 13
+        for unc in self.uncertainties:
+            # Labels may be quoted
+            label = len(unc.label) + 2
+            if unc.is_symmetric:
+                # "    - label: ...", "      symerror: ..."
+                size += 29 + label + number
             else:
-                valuedict["value"] = helpers.relative_round(value,
-                                                            self.digits)
-            # An uncertainty entry is only appended
-            # if at least one of the uncertainties is not zero.
-            if nonzero_uncs[i]:
-                for unc in self.uncertainties:
-                    if unc.values[i] is None:
-                        continue
-                    if unc.is_symmetric:
-                        valuedict['errors'].append({
-                            "symerror":
-                                helpers.relative_round(unc.values[i], self.digits),
-                            "label":
-                                unc.label
-                        })
-                    else:
-                        sum_unc = Decimal(float(unc.values[i][0]) + float(unc.values[i][1]))
-                        if sum_unc.is_zero():
-                            valuedict['errors'].append({
-                                "symerror":
-                                    helpers.relative_round(unc.values[i][1], self.digits),
-                                "label":
-                                    unc.label
-                            })
-                        else:
-                            valuedict['errors'].append({
-                                "asymerror": {
-                                    "minus":
-                                        helpers.relative_round(unc.values[i][0], self.digits),
-                                    "plus":
-                                        helpers.relative_round(unc.values[i][1], self.digits)
-                                },
-                                "label": unc.label
-                            })
-            elif self.uncertainties and self.zero_uncertainties_warning:
+                # "    - asymerror:", "        minus: ...", "        plus: ...", "      label: ..."
+                size += 62 + label + 2 * number
+        return size
+
+    def estimate_size(self):
+        """
+        Estimate the number of bytes taken by this Variable in the data file of a table.
+
+        The estimate is computed from the number of bins, the uncertainties and
+        the number of significant digits, without formatting the values
+        (see estimate_bin_size).
+
+        :returns: int -- estimated number of bytes.
+        """
+        header = yaml.dump(self.make_header_dict(), Dumper=Dumper, default_flow_style=False)
+        return len(header) + 10 + len(self._values) * self.estimate_bin_size()
+
+    def make_columns(self, start=0, stop=None):
+        """
+        Return the rounded values and uncertainties of a range of bins as columns.
+
+        The rounding, the classification of uncertainties into symmetric
+        and asymmetric entries and the detection of bins with nonzero
+        uncertainties are performed on whole arrays at once.
+        Columns are pairs of a float array and a dictionary of non-float entries,
+        as returned by Column.relative_round.
+
+        This function is intended to be called internally by make_dict and the
+        streaming YAML emitter.
+        Except for debugging purposes, no user should have to call this function.
+
+        :param start: Index of the first bin.
+        :type start: int
+
+        :param stop: Index after the last bin. All remaining bins if None.
+        :type stop: int
+
+        :returns: dict -- with the following keys:
+
+            * "fields": list of (key, column) pairs holding the bin edges
+              ("low", "high") or the central values ("value").
+            * "nonzero": boolean array marking the bins for which uncertainties are written.
+            * "errors": list of dictionaries, one per uncertainty, holding the "label",
+              the "kinds" of the entries (helpers.ERROR_NONE, helpers.ERROR_SYMMETRIC
+              or helpers.ERROR_ASYMMETRIC) and the "symerror", "minus" and "plus" columns.
+        """
+        # pylint: disable=too-many-locals
+        values = self._values[start:stop]
+        if self.is_binned:
+            fields = [
+                ("low", values.component(0).relative_round(self.digits)),
+                ("high", values.component(1).relative_round(self.digits))
+                ]
+        else:
+            fields = [("value", values.relative_round(self.digits))]
+
+        # An uncertainty entry is only written
+        # if at least one of the uncertainties is not zero.
+        nonzero = helpers.any_uncertainties_nonzero(
+                                                   self.uncertainties,
+                                                   size=len(values),
+                                                   start=start,
+                                                   stop=stop
+                                                   )
+        if self.uncertainties and self.zero_uncertainties_warning:
+            for i in np.flatnonzero(~nonzero):
                 print(
                     "Warning: omitting 'errors' since all uncertainties " \
-                    f"are zero for bin {i+1} of variable '{self.name}'."
+                    f"are zero for bin {start+i+1} of variable '{self.name}'."
                     )
                 print(
                     "Note that bins with zero content should preferably " \
                     "be omitted completely from the HEPData table."
                     )
+
+        errors = []
+        for unc in self.uncertainties:
+            unc_values = unc.values_column[start:stop]
+            if unc.is_symmetric:
+                # Entries that are None are skipped
+                written = nonzero if unc_values.valid is None else nonzero & unc_values.valid
+                errors.append({
+                    "label": unc.label,
+                    "kinds": np.where(written, helpers.ERROR_SYMMETRIC, helpers.ERROR_NONE),
+                    "symerror": unc_values.relative_round(self.digits)
+                })
+                continue
+
+            minus = unc_values.component(0)
+            plus = unc_values.component(1)
+            minus_numbers, minus_numeric = minus.numeric()
+            plus_numbers, plus_numeric = plus.numeric()
+            is_zero = minus_numbers + plus_numbers == 0
+            for i in np.flatnonzero(nonzero & ~(minus_numeric & plus_numeric)):
+                is_zero[i] = Decimal(float(minus.tolist_entry(i)) +
+                                     float(plus.tolist_entry(i))).is_zero()
+            kinds = np.where(nonzero, helpers.ERROR_SYMMETRIC, helpers.ERROR_NONE)
+            kinds[nonzero & ~is_zero] = helpers.ERROR_ASYMMETRIC
+            plus_column = plus.relative_round(self.digits)
+            errors.append({
+                "label": unc.label,
+                "kinds": kinds,
+                "symerror": plus_column,
+                "minus": minus.relative_round(self.digits),
+                "plus": plus_column
+            })
+        return {"fields": fields, "nonzero": nonzero, "errors": errors}
+
+    def make_dict(self):
+        """
+        Return all data in this Variable as a dictionary.
+
+        The dictionary structure follows the hepdata conventions,
+        so that dumping this dictionary to YAML will give a file
+        that hepdata can read.
+
+        Uncertainties associated to this Variable are also written into
+        the dictionary.
+
+        This function is intended to be called internally by the Submission object.
+        Except for debugging purposes, no user should have to call this function.
+        """
+        tmp = self.make_header_dict()
+        columns = self.make_columns()
+        fields = [(key, helpers.column_to_list(column)) for key, column in columns["fields"]]
+        errors = [
+            (
+                error["label"],
+                error["kinds"].tolist(),
+                helpers.column_to_list(error["symerror"]),
+                helpers.column_to_list(error["minus"]) if "minus" in error else None,
+                helpers.column_to_list(error["plus"]) if "plus" in error else None
+            ) for error in columns["errors"]
+            ]
+
+        tmp["values"] = []
+        for i, nonzero in enumerate(columns["nonzero"].tolist()):
+            valuedict = defaultdict(list)
+            for key, column in fields:
+                valuedict[key] = column[i]
+            if nonzero:
+                for label, kinds, symerror, minus, plus in errors:
+                    if kinds[i] == helpers.ERROR_SYMMETRIC:
+                        valuedict["errors"].append({"symerror": symerror[i], "label": label})
+                    elif kinds[i] == helpers.ERROR_ASYMMETRIC:
+                        valuedict["errors"].append({
+                            "asymerror": {"minus": minus[i], "plus": plus[i]},
+                            "label": label
+                        })
             tmp["values"].append(valuedict)
         return tmp
 
@@ -329,6 +603,11 @@ class Table(AdditionalResourceMixin):
 
     # pylint: disable=too-many-instance-attributes
 
+    #: Largest data file in characters that is kept in memory, so that it is written again
+    #: without emitting it while the variables do not change (see dump_yaml).
+    #: Set to zero to never keep the data file, or raise it to keep larger ones.
+    data_memo_limit = 1 << 18
+
     def __init__(self, name):
         super().__init__()
         self._name = None
@@ -340,6 +619,15 @@ class Table(AdditionalResourceMixin):
         self.keywords = {}
         self.image_files = set()
         self.data_license = {}
+        # Data file and fingerprint of the last revision of the variables
+        self._data_memo = None
+        self._fingerprint_memo = None
+
+    def __getstate__(self):
+        # The memoized data file is not sent to worker processes
+        state = self.__dict__.copy()
+        state["_data_memo"] = None
+        return state
 
     @property
     def name(self):
@@ -425,29 +713,44 @@ class Table(AdditionalResourceMixin):
 
         self.data_license = license_data
 
-    def write_output(self, outdir):
+    def write_output(self, outdir, streaming=False, reuse_data_file=False):
         """
         Write the table files into the output directory.
 
         :param outdir: Path to output directory.
                        Will be created if it doesn't exist.
         :type outdir: string
+
+        :param streaming: Use the streaming YAML emitter for the data file (see write_yaml).
+        :type streaming: bool
+
+        :param reuse_data_file: Keep the existing data file in the output directory
+                                instead of writing it again.
+        :type reuse_data_file: bool
+
+        :returns: dict -- entry of this table in the central submission file.
         """
         self.write_images(outdir)
-        self.write_yaml(outdir)
+        if reuse_data_file:
+            return self.make_submission_entry()
+        return self.write_yaml(outdir, streaming=streaming)
 
-    def write_images(self, outdir):
+    def image_conversions(self, outdir):
         """
-        Write image files and thumbnails into the output directory.
+        Return the conversions needed to write the image files and thumbnails of the table.
 
         :param outdir: Path to output directory.
-                       Will be created if it doesn't exist.
+                       Will be created if it doesn't exist and the table has images.
         :type outdir: string
+
+        :returns: list -- tuples with the path of the source image, of the full-size PNG
+                  file and of the thumbnail, in the order in which they are converted.
         """
         if not isinstance(outdir, str):
             raise TypeError(f"Expected string argument, instead got: '{type(outdir)}'.")
 
-        for image_file in self.image_files:
+        conversions = []
+        for image_file in sorted(self.image_files):
             if not os.path.isfile(image_file):
                 raise RuntimeError(f"File {image_file} does not exist!")
             if not os.path.exists(outdir):
@@ -461,24 +764,18 @@ class Table(AdditionalResourceMixin):
             # Absolute paths for further use
             png_output_path = os.path.join(outdir, png_output_base)
             thumbnail_output_path = os.path.join(outdir, thumbnail_output_base)
+            conversions.append((image_file, png_output_path, thumbnail_output_path))
+        return conversions
 
+    def add_image_resources(self, conversions):
+        """
+        Add the image files and thumbnails written by the given conversions
+        to the additional resources of the table.
 
-            # Convert to full-size PNG image
-            # Only executed if output is missing or out of date
-            if helpers.file_is_outdated(png_output_path, image_file):
-                helpers.convert_pdf_to_png(image_file, png_output_path)
-            else:
-                print(f"Full-size PNG file {png_output_path} is newer than its source file. \
-                       Remove the thumbnail file or use create_files(remove_old=True)\
-                           to force recreation.")
-
-            if helpers.file_is_outdated(thumbnail_output_path, png_output_path):
-                helpers.convert_png_to_thumbnail(png_output_path, thumbnail_output_path)
-            else:
-                print("Thumbnail PNG file {thumbnail_output_path} is newer than its source file. \
-                       Remove the thumbnail file or use create_files(remove_old=True)\
-                           to force recreation.")
-
+        :param conversions: Conversions as returned by image_conversions.
+        :type conversions: list
+        """
+        for _, png_output_path, thumbnail_output_path in conversions:
             image = {}
             image["description"] = "Image file"
             image["location"] = os.path.basename(png_output_path)
@@ -488,6 +785,44 @@ class Table(AdditionalResourceMixin):
             self.additional_resources.append(image)
             self.additional_resources.append(thumbnail)
 
+    def write_images(self, outdir, rasterizer=None, cache=None, staleness="time"):
+        """
+        Write image files and thumbnails into the output directory.
+
+        :param outdir: Path to output directory.
+                       Will be created if it doesn't exist.
+        :type outdir: string
+
+        :param rasterizer: Backend converting the images, or its name
+                           (see rasterizers.get_rasterizer). By default, ImageMagick is used
+                           unless another registered backend is available and not opt-in.
+        :type rasterizer: rasterizers.Rasterizer or str
+
+        :param cache: Cache of converted images. Images found in the cache are
+                      hard-linked or copied from it instead of being converted again.
+        :type cache: cache.ImageCache
+
+        :param staleness: How to decide whether existing output files are up to date
+                          (see helpers.file_is_outdated): "time" compares the file
+                          timestamps, "hash" compares the content hashes of the source
+                          images and of the conversion settings recorded in sidecar files.
+        :type staleness: str
+        """
+        rasterizer = rasterizers.get_rasterizer(rasterizer)
+        for conversion in self.image_conversions(outdir):
+            build.convert_image(conversion, rasterizer, cache, staleness)
+            self.add_image_resources([conversion])
+
+    @contextmanager
+    def materialized(self):
+        """
+        Context in which the variables of the table are available.
+
+        The variables of a regular table are always available.
+        See DeferredTable for tables that only read their variables in this context.
+        """
+        yield self
+
     def add_variable(self, variable):
         """
         Add a variable to the table
@@ -500,55 +835,368 @@ class Table(AdditionalResourceMixin):
         else:
             raise TypeError(f"Unknown object type: {str(type(variable))}")
 
-    def write_yaml(self, outdir="."):
+    def write_yaml(self, outdir=".", streaming=False):
         """
         Write the table (and all its variables) to a YAML file.
 
+        The entry describing the table in the central submission file is not written
+        by this function, but returned so that it can be collected by the Submission object.
+
         This function is intended to be called internally by the Submission object.
         Except for debugging purposes, no user should have to call this function.
+
+        :param outdir: Path to output directory.
+                       Will be created if it doesn't exist.
+        :type outdir: string
+
+        :param streaming: If True, the data file is written by the streaming emitter
+                          (see hepdata_lib.yaml_emitter), which formats the values directly
+                          instead of building and dumping a dictionary. The output is identical.
+        :type streaming: bool
+
+        :returns: dict -- entry of this table in the central submission file.
+        """
+        if not os.path.exists(outdir):
+            os.makedirs(outdir, exist_ok=True)
+
+        outfile_path = os.path.join(outdir, self.data_file_name)
+        with open(outfile_path, 'w', encoding='utf-8') as outfile:
+            self.dump_yaml(outfile, streaming=streaming)
+
+        return self.make_submission_entry()
+
+    def dump_yaml(self, stream, streaming=False):
+        """
+        Write the data file of the table (and all its variables) to a text stream.
+
+        The data file is always emitted straight to the stream. Data files of up to
+        data_memo_limit characters are also kept in memory, and only emitted again after
+        the variables of the table changed (see data_revision). Larger data files and
+        those of tables with memory-mapped variables are not kept.
+
+        :param stream: Text stream to write to.
+
+        :param streaming: Use the streaming YAML emitter (see write_yaml).
+        :type streaming: bool
+        """
+        revision = self.data_revision
+        if self._data_memo is not None and self._data_memo[0] == revision:
+            stream.write(self._data_memo[1])
+            return
+        self._data_memo = None
+        if any(var.is_memory_mapped for var in self.variables):
+            self._emit_yaml(stream, streaming)
+            return
+        memo_stream = _MemoStream(stream, self.data_memo_limit)
+        self._emit_yaml(memo_stream, streaming)
+        if memo_stream.text is not None:
+            self._data_memo = (revision, memo_stream.text)
+
+    def _emit_yaml(self, stream, streaming):
+        """Emit the data file of the table to a text stream."""
+        if streaming:
+            with profiling.stage("yaml_emission"):
+                emit_table(self, stream, Dumper)
+            return
+        with profiling.stage("make_dict"):
+            table = self.make_dict()
+        with profiling.stage("yaml_emission"):
+            yaml.dump(table, stream, Dumper=Dumper, default_flow_style=False)
+
+    @property
+    def data_revision(self):
+        """
+        Revision of the content of the data file of this table.
+
+        Changes whenever a variable or uncertainty of the table changes
+        (see ChangeTrackingMixin), but not when the meta data of the table change.
+        """
+        return tuple(var.revision for var in self.variables)
+
+    def make_dict(self):
         """
-        # Put all variables together into a table and write
+        Return all data in this Table as a dictionary.
+
+        Dumping this dictionary to YAML gives the data file of the table.
+        """
+        # Put all variables together into a table
         table = {}
         table["independent_variables"] = []
         table["dependent_variables"] = []
         for var in self.variables:
             table["independent_variables" if var.is_independent else
                   "dependent_variables"].append(var.make_dict())
+        return table
 
-        if not os.path.exists(outdir):
-            os.makedirs(outdir)
+    def fingerprint(self):
+        """
+        Return a fingerprint of the content of the data file of this table.
+
+        The fingerprint covers the name of the data file and all variables,
+        including their meta data and uncertainties, as well as the version of hepdata_lib.
+        It does not cover the meta data written to the central submission file.
+
+        :returns: str -- hexadecimal SHA-256 digest.
+        """
+        revision = (self.data_file_name, self.data_revision)
+        if self._fingerprint_memo is None or self._fingerprint_memo[0] != revision:
+            hasher = hashlib.sha256()
+            hasher.update(f"{__version__}\n{self.data_file_name}\n".encode("utf-8"))
+            for var in self.variables:
+                var.update_hash(hasher)
+            self._fingerprint_memo = (revision, hasher.hexdigest())
+        return self._fingerprint_memo[1]
+
+    def estimate_size(self):
+        """
+        Estimate the size of the data file of this table in bytes (see Variable.estimate_size).
+
+        Compare to helpers.DATA_FILE_SIZE_LIMIT to check whether the table
+        can be uploaded to HEPData, or use split to divide it into several tables.
+
+        :returns: int -- estimated number of bytes.
+        """
+        with self.materialized():
+            return _TABLE_KEYS_SIZE + sum(var.estimate_size() for var in self.variables)
+
+    def stats(self):
+        """
+        Return a report of the size of this table, without writing anything.
+
+        The report only contains numbers, strings and booleans,
+        so that it can be logged e.g. as JSON. Deferred tables read their variables.
+
+        :returns: dict -- with the following keys:
+
+            * "name" and "data_file": name of the table and of its data file.
+            * "bins": number of bins, i.e. the largest number of bins of its variables.
+            * "uncertainty_entries": total number of uncertainty entries of all variables.
+            * "nbytes": memory used by the values and uncertainties of all variables.
+            * "estimated_size": estimated size of the data file in bytes (see estimate_size).
+            * "oversized": True if the estimated size exceeds helpers.DATA_FILE_SIZE_LIMIT.
+            * "images": number of images to convert.
+            * "variables": list of reports of the variables (see Variable.stats).
+        """
+        with self.materialized():
+            variables = [var.stats() for var in self.variables]
+        estimated_size = _TABLE_KEYS_SIZE + sum(var["estimated_size"] for var in variables)
+        return {
+            "name": self.name,
+            "data_file": self.data_file_name,
+            "bins": max((var["bins"] for var in variables), default=0),
+            "uncertainty_entries": sum(var["uncertainty_entries"] for var in variables),
+            "nbytes": sum(var["nbytes"] for var in variables),
+            "estimated_size": estimated_size,
+            "oversized": estimated_size > helpers.DATA_FILE_SIZE_LIMIT,
+            "images": len(self.image_files),
+            "variables": variables,
+        }
+
+    def split(self, max_size=helpers.DATA_FILE_SIZE_LIMIT, along=None):
+        """
+        Split the table into several tables whose data files fit into a size limit.
+
+        The bins are divided into contiguous ranges along an independent variable,
+        based on the size estimate of the data file (see estimate_size). Bins with the
+        same value of this variable are kept in the same part, unless they do not fit into
+        a single part, e.g. all bins of the same x value of a two-dimensional map.
 
+        The parts are named "<name> part <i> of <n>", where the name is shortened if the
+        part names would exceed the limit of 64 characters. Their descriptions state the range
+        of the independent variable and refer to the other parts. All other meta data,
+        such as keywords, images and additional resources, are copied to each part.
+        The parts are regular tables, which share the values of this table.
+
+        :param max_size: Upper limit of the size of each data file in bytes.
+        :type max_size: int
+
+        :param along: Name of the independent variable along which the table is split.
+                      Defaults to the first independent variable.
+        :type along: str
+
+        :returns: list -- Tables that replace this table, or only this table if it fits.
+        """
+        # pylint: disable=too-many-locals
+        with self.materialized():
+            size = self.estimate_size()
+            if size <= max_size:
+                return [self]
+
+            candidates = [var for var in self.variables if var.is_independent
+                          and (along is None or var.name == along)]
+            if not candidates:
+                raise ValueError(f"Table '{self.name}' has no independent variable "
+                                 f"{repr(along) if along else ''} to split along.")
+            split_variable = candidates[0]
+            nbins = len(split_variable.values_column)
+            bin_size = sum(var.estimate_bin_size() for var in self.variables)
+            max_bins = (max_size - size + nbins * bin_size) // bin_size
+            if max_bins < 1:
+                raise ValueError(f"The bins of table '{self.name}' do not fit "
+                                 f"into data files of {max_size} bytes.")
+
+            ranges = helpers.split_ranges(split_variable.values_column, max_bins)
+            suffixes = [f" part {i} of {len(ranges)}" for i in range(1, len(ranges) + 1)]
+            # The name is shortened if needed, so that the names of all parts fit
+            # into the limit of 64 characters
+            base_name = self.name[:64 - len(suffixes[-1])].rstrip()
+            names = [base_name + suffix for suffix in suffixes]
+            parts = []
+            for name, (start, stop) in zip(names, ranges):
+                part = Table(name)
+                for attribute in ("location", "keywords", "related_tables", "data_license",
+                                  "image_files", "additional_resources", "files_to_copy"):
+                    setattr(part, attribute, copy.deepcopy(getattr(self, attribute)))
+                for var in self.variables:
+                    part.add_variable(var.select_bins(start, stop))
+
+                selected = split_variable.values_column[start:stop]
+                if split_variable.is_binned:
+                    low, high = selected[:1].tolist()[0][0], selected[-1:].tolist()[0][1]
+                else:
+                    low, high = selected[:1].tolist()[0], selected[-1:].tolist()[0]
+                units = f" {split_variable.units}" if split_variable.units else ""
+                others = ", ".join(f"'{other}'" for other in names if other != name)
+                part.description = (f"{self.description}\n\nPart {len(parts) + 1} of "
+                                    f"{len(names)}: {split_variable.name} from {low} to "
+                                    f"{high}{units}. The other parts are {others}.")
+                parts.append(part)
+            return parts
+
+    @property
+    def data_file_name(self):
+        """Name of the YAML data file of this table."""
         shortname = self.name.lower().replace(" ", "_")
-        outfile_path = os.path.join(
-            outdir, f'{shortname}.yaml')
-        with open(outfile_path, 'w', encoding='utf-8') as outfile:
-            yaml.dump(table, outfile, default_flow_style=False)
-
-        # Add entry to central submission file
-        submission_path = os.path.join(outdir, 'submission.yaml')
-        with open(submission_path, 'a+', encoding='utf-8') as submissionfile:
-            submission = {}
-            submission["name"] = self.name
-            submission["description"] = self.description
-            submission["location"] = self.location
-            if self.related_tables:
-                submission["related_to_table_dois"] = self.related_tables
-            submission["data_file"] = f'{shortname}.yaml'
-            submission["keywords"] = []
-            if self.additional_resources:
-                submission["additional_resources"] = self.additional_resources
-            if self.data_license:
-                submission["data_license"] = self.data_license
-
-            for name, values in list(self.keywords.items()):
-                submission["keywords"].append({"name": name, "values": values})
-
-            yaml.dump(
-                submission,
-                submissionfile,
-                default_flow_style=False,
-                explicit_start=True)
-        return os.path.basename(outfile_path)
+        return f'{shortname}.yaml'
+
+    def make_submission_entry(self):
+        """
+        Return the entry describing this table in the central submission file.
+
+        :returns: dict -- table meta data following the hepdata conventions.
+        """
+        submission = {}
+        submission["name"] = self.name
+        submission["description"] = self.description
+        submission["location"] = self.location
+        if self.related_tables:
+            submission["related_to_table_dois"] = self.related_tables
+        submission["data_file"] = self.data_file_name
+        submission["keywords"] = []
+        if self.additional_resources:
+            submission["additional_resources"] = self.additional_resources
+        if self.data_license:
+            submission["data_license"] = self.data_license
+
+        for name, values in list(self.keywords.items()):
+            submission["keywords"].append({"name": name, "values": values})
+        return submission
+
+
+class DeferredTable(Table):
+    """
+    A table whose variables are only read while the table is written.
+
+    Instead of variables, a deferred table holds a recipe to create them: a loader
+    function and its arguments, e.g. the path of a ROOT file, the path of a histogram
+    in the file and options for the conversion. The loader is called with these
+    arguments whenever the variables are needed, i.e. when the table is written or
+    its fingerprint is computed, and the variables are released afterwards.
+    A submission with many large tables then only holds the data of the tables
+    that are being written at a time.
+
+    The loader must return a list of Variable objects. It is called again for every
+    build, so it should always give the same variables for the same arguments.
+    With a process pool (see Submission.create_files), the loader and its arguments
+    are sent to the worker processes and must be picklable, e.g. a module-level function.
+    """
+
+    def __init__(self, name, loader, *args, **kwargs):
+        """
+        :param name: Name of the table.
+        :type name: str
+
+        :param loader: Function returning the variables of the table.
+        :type loader: callable
+
+        All other arguments are passed to the loader.
+        """
+        super().__init__(name)
+        self.loader = loader
+        self.loader_args = args
+        self.loader_kwargs = kwargs
+        self._materialized_depth = 0
+
+    @contextmanager
+    def materialized(self):
+        """
+        Context in which the variables of the table are available.
+
+        The loader is called when entering the outermost context,
+        and the variables are released when leaving it.
+        """
+        if not self._materialized_depth:
+            variables = list(self.loader(*self.loader_args, **self.loader_kwargs))
+            for variable in variables:
+                if not isinstance(variable, Variable):
+                    raise TypeError(f"Unknown object type: {str(type(variable))}")
+            self.variables = variables
+        self._materialized_depth += 1
+        try:
+            yield self
+        finally:
+            self._materialized_depth -= 1
+            if not self._materialized_depth:
+                # The memoized data file refers to variables that are not kept either
+                self.variables = []
+                self._data_memo = None
+                self._fingerprint_memo = None
+
+    def add_variable(self, variable):
+        """Variables of deferred tables can only be created by their loader."""
+        raise RuntimeError("The variables of a DeferredTable are created by its loader.")
+
+    def dump_yaml(self, stream, streaming=False):
+        """Read the variables and write the data file (see Table.dump_yaml)."""
+        with self.materialized():
+            super().dump_yaml(stream, streaming=streaming)
+
+    def make_dict(self):
+        """Read the variables and return all data as a dictionary (see Table.make_dict)."""
+        with self.materialized():
+            return super().make_dict()
+
+    def fingerprint(self):
+        """Read the variables and return the fingerprint (see Table.fingerprint)."""
+        with self.materialized():
+            return super().fingerprint()
+
+
+class _MemoStream:
+    """Text stream writing to another stream and keeping a copy of outputs up to a size limit."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        # Checked by the LibYAML emitter to write text instead of bytes
+        self.encoding = getattr(stream, "encoding", None)
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        """Write text to the stream and keep a copy unless the limit is exceeded."""
+        self.stream.write(text)
+        if self._parts is not None:
+            self._size += len(text)
+            if self._size > self.limit:
+                self._parts = None
+            else:
+                self._parts.append(text)
+
+    @property
+    def text(self):
+        """Text written so far, or None if it exceeds the limit."""
+        return None if self._parts is None else "".join(self._parts)
 
 
 class Submission(AdditionalResourceMixin):
@@ -564,6 +1212,8 @@ class Submission(AdditionalResourceMixin):
         self.comment = ""
         self.record_ids = []
         self.related_records = []
+        self.build_cache = None
+        self.image_cache = None
         self.add_additional_resource(
             "Created with hepdata_lib " + __version__,
             "https://doi.org/10.5281/zenodo.1217998")
@@ -579,6 +1229,44 @@ class Submission(AdditionalResourceMixin):
             "in any medium or format, with no conditions.")
         return data_license
 
+    def set_build_cache(self, path, max_size=DEFAULT_MAX_SIZE):
+        """
+        Cache the data files of the tables in a directory on disk.
+
+        Tables whose fingerprint (see Table.fingerprint) is found in the cache are not
+        emitted again by create_files, but their cached data file is copied instead.
+        The cache can be shared by several submissions and sessions.
+        The least recently used entries are deleted if the cache grows larger than `max_size`.
+
+        :param path: Path to the cache directory, or None to disable the cache.
+        :type path: string
+
+        :param max_size: Upper limit of the total size of the cache in bytes.
+        :type max_size: int
+        """
+        self.build_cache = BuildCache(path, max_size) if path is not None else None
+
+    def set_image_cache(self, path, max_size=DEFAULT_MAX_SIZE, link=True):
+        """
+        Cache the converted images and thumbnails of the tables in a directory on disk.
+
+        The entries are keyed by the hash of the source image and of the conversion
+        parameters (see cache.ImageCache). Images found in the cache are not converted
+        again by create_files, but hard-linked or copied from the cache instead.
+        The cache is shared and bounded in size as for set_build_cache.
+
+        :param path: Path to the cache directory, or None to disable the cache.
+        :type path: string
+
+        :param max_size: Upper limit of the total size of the cache in bytes.
+        :type max_size: int
+
+        :param link: Hard-link the cached files into the output directory
+                     instead of copying them.
+        :type link: bool
+        """
+        self.image_cache = ImageCache(path, max_size, link) if path is not None else None
+
     def add_table(self, table):
         """Append table to tables list.
 
@@ -590,6 +1278,46 @@ class Submission(AdditionalResourceMixin):
         else:
             raise TypeError(f"Unknown object type: {str(type(table))}")
 
+    def stats(self):
+        """
+        Return a report of the size of the submission, without writing anything.
+
+        Use it to check the size of a submission before running an expensive build.
+        The report only contains numbers, strings, booleans, lists and dictionaries,
+        so that it can be logged e.g. as JSON.
+
+        :returns: dict -- with the following keys:
+
+            * "tables": number of tables.
+            * "bins", "uncertainty_entries", "nbytes", "estimated_size" and "images":
+              totals of the reports of all tables (see Table.stats).
+            * "oversized_tables": names of the tables whose data files are estimated
+              to exceed helpers.DATA_FILE_SIZE_LIMIT.
+            * "table_stats": list of reports of the tables.
+        """
+        tables = [table.stats() for table in self.tables]
+        report = {"tables": len(tables)}
+        for key in ("bins", "uncertainty_entries", "nbytes", "estimated_size", "images"):
+            report[key] = sum(table[key] for table in tables)
+        report["oversized_tables"] = [table["name"] for table in tables if table["oversized"]]
+        report["table_stats"] = tables
+        return report
+
+    def split_oversized_tables(self, max_size=helpers.DATA_FILE_SIZE_LIMIT):
+        """
+        Replace each table whose data file would exceed a size limit by several parts.
+
+        The tables are split along their first independent variable, see Table.split.
+
+        :param max_size: Upper limit of the size of each data file in bytes.
+                         Defaults to the limit enforced by the HEPData validator.
+        :type max_size: int
+        """
+        tables = []
+        for table in self.tables:
+            tables.extend(table.split(max_size))
+        self.tables = tables
+
     def add_link(self, description, location):
         """
         Append link to additional_resources list.
@@ -653,7 +1381,26 @@ class Submission(AdditionalResourceMixin):
             files = files + table.files_to_copy
         return files
 
-    def create_files(self, outdir=".", validate=True, remove_old=False):
+    def make_header_dict(self):
+        """
+        Return the general information about the submission as a dictionary.
+
+        Dumping this dictionary gives the first document of the central submission file,
+        which is followed by one document per table.
+        """
+        submission = {}
+        submission["data_license"] = self.get_license()
+        submission["comment"] = self.comment
+        if self.related_records:
+            submission["related_to_hepdata_records"] = self.related_records
+
+        if self.additional_resources:
+            submission["additional_resources"] = self.additional_resources
+        if self.record_ids:
+            submission["record_ids"] = self.record_ids
+        return submission
+
+    def create_files(self, outdir=".", validate=True, remove_old=False, **options):
         """
         Create the output files.
 
@@ -664,70 +1411,129 @@ class Submission(AdditionalResourceMixin):
         output tar ball.
 
         If `remove_old` is True, the output directory will be deleted before recreation.
+
+        The other keyword arguments, e.g. `workers` or `incremental`, are the options
+        of the build (see build.BuildOptions).
+
+        :returns: profiling.BuildProfile -- report of the build if `profile` or
+                  `profile_memory` is True, otherwise None.
         """
-        if remove_old and os.path.exists(outdir):
-            shutil.rmtree(outdir)
+        options = build.BuildOptions(build_cache=self.build_cache,
+                                     image_cache=self.image_cache, **options)
+        return build.Build(self, outdir, options).run(remove_old, validate)
 
-        if not os.path.exists(outdir):
-            os.makedirs(outdir)
 
-        # Write general info about submission
-        submission = {}
-        submission["data_license"] = self.get_license()
-        submission["comment"] = self.comment
-        if self.related_records:
-            submission["related_to_hepdata_records"] = self.related_records
+class SubmissionWriter:
+    """
+    Write a submission table by table with bounded memory.
 
-        if self.additional_resources:
-            submission["additional_resources"] = self.additional_resources
-        if self.record_ids:
-            submission["record_ids"] = self.record_ids
+    Submission.create_files requires all tables to be held in Submission.tables.
+    Instead, the writer writes the images and the data file of each table as soon as it is
+    passed to write_table, and only keeps its entry in the central submission file.
+    The data of the table can then be garbage-collected.
 
-        with open(os.path.join(outdir, 'submission.yaml'), 'w', encoding='utf-8') as outfile:
-            yaml.dump(
-                submission,
-                outfile,
-                default_flow_style=False,
-                explicit_start=True)
+    The general information about the submission, e.g. the comment and the additional
+    resources, is taken from a Submission object. Tables already added to it are written
+    when the writer is created. The central submission file and the tar ball are written,
+    and the tar ball is validated, when the writer is closed.
 
-        # Write all the tables
-        for table in self.tables:
-            table.write_output(outdir)
-            table.copy_files(outdir)
-
-        # Copy additional resource files
-        self.copy_files(outdir)
-
-        # Put everything into a tarfile
-        files_to_add = []
-        files_to_add.extend(helpers.find_all_matching(outdir, "*.yaml"))
-        files_to_add.extend(helpers.find_all_matching(outdir, "*.png"))
-        files_to_add.extend(
-            [os.path.join(outdir, os.path.basename(x)) for x in  self.files_to_copy_nested()]
-        )
-        tarfile_path = "submission.tar.gz"
-        with tarfile.open(tarfile_path, "w:gz") as tar:
-            for filepath in files_to_add:
-                tar.add(
-                        filepath,
-                        arcname=os.path.basename(filepath)
-                        )
-
-        if validate:
-            full_submission_validator = FullSubmissionValidator()
-            is_archive_valid = full_submission_validator.validate(archive=tarfile_path)
-            if not is_archive_valid:
-                for filename in full_submission_validator.get_messages():
-                    full_submission_validator.print_errors(filename)
-            assert is_archive_valid, "The tar ball is not valid"
-
-class Uncertainty:
+    Use as a context manager:
+
+    ::
+
+        with SubmissionWriter(submission, "output") as writer:
+            for name in names:
+                writer.write_table(make_table(name))
+
+    If an exception is raised inside the context, the writer is closed without
+    writing the central submission file and the tar ball.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, submission, outdir=".", *, validate=True, remove_old=False,
+                 streaming=False, reproducible=False,
+                 compresslevel=archive.DEFAULT_COMPRESSLEVEL, compression_threads=None):
+        """
+        :param submission: Submission holding the general information.
+        :type submission: Submission
+
+        :param outdir: Path to the output directory. Will be created if it doesn't exist.
+        :type outdir: string
+
+        The other arguments have the same meaning as for Submission.create_files.
+        """
+        # pylint: disable=too-many-arguments
+        if not isinstance(submission, Submission):
+            raise TypeError(f"Unknown object type: {str(type(submission))}")
+        self.submission = submission
+        self.outdir = outdir
+        self.validate = validate
+        self.tarfile_path = build.TARFILE_PATH
+        self.options = build.BuildOptions(streaming=streaming, reproducible=reproducible,
+                                          compresslevel=compresslevel,
+                                          compression_threads=compression_threads,
+                                          build_cache=submission.build_cache,
+                                          image_cache=submission.image_cache)
+        self.closed = False
+        self._entries = []
+        self._files_to_copy = []
+
+        build.Build(submission, outdir, self.options).prepare_output_directory(remove_old)
+        for table in submission.tables:
+            self.write_table(table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+
+    def write_table(self, table):
+        """
+        Write the images and the data file of a table into the output directory.
+
+        The writer does not keep a reference to the table.
+
+        :param table: Table to write.
+        :type table: Table
+        """
+        if self.closed:
+            raise RuntimeError("Cannot write a table with a closed SubmissionWriter.")
+        if not isinstance(table, Table):
+            raise TypeError(f"Unknown object type: {str(type(table))}")
+        entry, _, _, _, _ = build.write_table_files(table, self.outdir, self.options)
+        table.copy_files(self.outdir)
+        self._files_to_copy.extend(table.files_to_copy)
+        self._entries.append(entry)
+
+    def close(self):
+        """Write the central submission file and the tar ball, and validate the tar ball."""
+        if self.closed:
+            return
+        self.closed = True
+        with open(os.path.join(self.outdir, 'submission.yaml'), 'w',
+                  encoding='utf-8') as outfile:
+            build.dump_submission_file(self.submission.make_header_dict(), self._entries, outfile)
+
+        self.submission.copy_files(self.outdir)
+        build.pack_directory(self.outdir, self.tarfile_path,
+                             self.submission.files_to_copy + self._files_to_copy,
+                             self.options.archive_options)
+        if self.validate:
+            build.validate_archive(self.tarfile_path)
+
+class Uncertainty(ChangeTrackingMixin):
     """
     Store information about an uncertainty on a variable
 
     Uncertainties can be symmetric or asymmetric.
-    The main information is stored as one (two) lists in the symmetric (asymmetric) case.
-    The list entries are the uncertainty for each of the list entries in the corresponding Variable.
+    The main information is stored as a Column of single values (pairs of values)
+    in the symmetric (asymmetric) case.
+    The entries are the uncertainty for each of the list entries in the corresponding Variable.
     """
 
     def __init__(self, label, is_symmetric=True):
@@ -742,10 +1548,14 @@ class Uncertainty:
         """
         Value getter.
 
+        The values are stored as a Column and converted to a list on each access.
+        Changes made to the list in place are written back to the Uncertainty
+        (see columns.ValueList).
+
         :returns: list -- values, either as a direct list of values if uncertainty is symmetric,
             or list of tuples if it is asymmetric.
         """
-        return self._values
+        return ValueList(self)
 
     @values.setter
     def values(self, values):
@@ -753,13 +1563,15 @@ class Uncertainty:
         Value setter.
 
         :param values: New values to set.
-        :type values: list
+        :type values: list or numpy.ndarray
 
         """
-        if self.is_symmetric:
-            self._values = list(map(helpers.sanitize_value,values))
-        else:
-            self._values = [tuple(map(helpers.sanitize_value, x)) for x in values]
+        self._values = Column.from_values(values, pairs=not self.is_symmetric)
+
+    @property
+    def values_column(self):
+        """Column holding the values, without conversion to a list."""
+        return self._values
 
     def set_values_from_intervals(self, intervals, nominal):
         """
@@ -773,6 +1585,10 @@ class Uncertainty:
         :param nominal: Interval centers
         :type nominal: List of floats
         """
+        if isinstance(intervals, np.ndarray) and isinstance(nominal, np.ndarray) \
+                and len(intervals) == len(nominal):
+            self.values = intervals - nominal.reshape(-1, 1)
+            return
         subtracted_values = [(x[0] - ref, x[1] - ref) for x, ref in zip(intervals, nominal)]
         self.values = subtracted_values
 
@@ -783,8 +1599,4 @@ class Uncertainty:
         :param factor: Value to multiply by.
         :type factor: float
         """
-        if self.is_symmetric:
-            self.values = [factor * x for x in self.values]
-        else:
-            self.values = [(factor * x[0], factor * x[1])
-                           for x in self.values]
+        self._values = self._values.scaled(factor)
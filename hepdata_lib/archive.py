@@ -0,0 +1,285 @@
+"""Writing of submission tar balls."""
+
+import gzip
+import io
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#: Default gzip compression level, as used by tarfile.
+DEFAULT_COMPRESSLEVEL = 9
+
+#: Size of the blocks of uncompressed data compressed independently by ParallelGzipFile.
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+# Size of the deflate window, i.e. of the dictionary shared between consecutive blocks
+_WINDOW_SIZE = 1 << 15
+
+
+def reproducible_timestamp():
+    """
+    Return the timestamp used for all members of reproducible archives.
+
+    Follows the SOURCE_DATE_EPOCH convention of reproducible builds
+    and defaults to zero if the environment variable is not set.
+    """
+    return int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+
+
+class ParallelGzipFile:
+    """
+    Write-only file object compressing data to the gzip format with multiple threads.
+
+    The data are split into blocks of fixed size, which are compressed concurrently.
+    Each block is primed with the last 32 kB of the previous block as dictionary,
+    so that the compression ratio is close to the one of a single deflate stream.
+    The result is a standard single-member gzip file that any gzip reader can decompress.
+    The output only depends on the data, the compression level and the block size,
+    not on the number of threads.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(self, fileobj, compresslevel=DEFAULT_COMPRESSLEVEL, threads=None, mtime=None,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        """
+        :param fileobj: Binary file object to write the compressed data to.
+
+        :param compresslevel: Compression level from 0 (no compression) to 9.
+        :type compresslevel: int
+
+        :param threads: Number of compression threads. Defaults to the number of CPUs.
+        :type threads: int
+
+        :param mtime: Timestamp written to the gzip header. Defaults to the current time.
+        :type mtime: int
+
+        :param block_size: Size of the blocks of uncompressed data.
+        :type block_size: int
+        """
+        if not 0 <= compresslevel <= 9:
+            raise ValueError(f"Invalid compression level: {compresslevel}.")
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self._threads = threads if threads else os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=self._threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._dictionary = b""
+        self._crc = 0
+        self._size = 0
+        self.closed = False
+
+        # Gzip header without file name: magic number, deflate, no flags, mtime,
+        # extra flags (2: best compression, 4: fastest) and unknown operating system
+        mtime = int(time.time()) if mtime is None else mtime
+        extra_flags = 2 if compresslevel == 9 else 4 if compresslevel == 1 else 0
+        self.fileobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<IBB", mtime, extra_flags, 255))
+
+    def _compress_block(self, block, dictionary):
+        """Compress a block to a byte-aligned raw deflate fragment."""
+        if dictionary:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                          zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, block):
+        """Schedule the compression of a block and write finished blocks in order."""
+        self._crc = zlib.crc32(block, self._crc)
+        self._size += len(block)
+        self._pending.append(self._pool.submit(self._compress_block, block, self._dictionary))
+        self._dictionary = block[-_WINDOW_SIZE:]
+        # Bound the number of blocks held in memory
+        while len(self._pending) > 2 * self._threads:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def write(self, data):
+        """
+        Compress and write data.
+
+        :param data: Data to write.
+        :type data: bytes-like object
+
+        :returns: int -- number of bytes written.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def tell(self):
+        """Return the number of uncompressed bytes written so far."""
+        return self._size + len(self._buffer)
+
+    def close(self):
+        """Write the remaining data and the gzip trailer. Does not close `fileobj`."""
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+            # Empty final deflate block, followed by the checksum and size of the data
+            final = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+            self.fileobj.write(final + struct.pack("<II", self._crc, self._size & 0xffffffff))
+        finally:
+            self._pool.shutdown()
+            self.closed = True
+
+
+class ArchiveWriter:
+    """
+    Writer for gzip-compressed tar archives.
+
+    In reproducible mode, the members are collected and written sorted by name when the
+    writer is closed. In-memory files are spilled to a temporary directory until then,
+    so that they are not held in memory. The modification time, owner and permissions
+    of all members as well as the timestamp in the gzip header are normalized, so that
+    identical content always gives an identical archive. If several members are added
+    with the same name, only the last one is kept.
+
+    Use as a context manager:
+
+    ::
+
+        with ArchiveWriter("submission.tar.gz") as writer:
+            writer.add_file("submission/submission.yaml")
+    """
+
+    def __init__(self, path, reproducible=False, compresslevel=DEFAULT_COMPRESSLEVEL,
+                 threads=None):
+        """
+        :param path: Path of the archive file.
+        :type path: str
+
+        :param reproducible: Write a reproducible archive.
+        :type reproducible: bool
+
+        :param compresslevel: Gzip compression level from 0 (no compression) to 9.
+        :type compresslevel: int
+
+        :param threads: If larger than one, compress with that many threads
+                        (see ParallelGzipFile).
+        :type threads: int
+        """
+        if not 0 <= compresslevel <= 9:
+            raise ValueError(f"Invalid compression level: {compresslevel}.")
+        self.path = path
+        self.reproducible = reproducible
+        self.closed = False
+        self._pending = {}
+        self._spill_dir = None
+        self._streams = []
+        mtime = reproducible_timestamp() if reproducible else None
+        # The streams are closed by close()
+        # pylint: disable=consider-using-with
+        if threads is not None and threads > 1:
+            raw = open(path, "wb")
+            compressed = ParallelGzipFile(raw, compresslevel=compresslevel, threads=threads,
+                                          mtime=mtime)
+            self._streams = [compressed, raw]
+            self._tar = tarfile.open(fileobj=compressed, mode="w")
+        elif reproducible:
+            raw = open(path, "wb")
+            compressed = gzip.GzipFile(filename="", mode="wb", fileobj=raw,
+                                       compresslevel=compresslevel, mtime=mtime)
+            self._streams = [compressed, raw]
+            self._tar = tarfile.open(fileobj=compressed, mode="w")
+        else:
+            self._tar = tarfile.open(path, "w:gz", compresslevel=compresslevel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _normalize(self, info):
+        """Normalize the meta data of a member of a reproducible archive."""
+        info.mtime = reproducible_timestamp()
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        info.mode = 0o755 if info.isdir() or info.mode & 0o100 else 0o644
+        return info
+
+    def add_bytes(self, arcname, data):
+        """
+        Add an in-memory file to the archive.
+
+        :param arcname: Name of the file in the archive.
+        :type arcname: str
+
+        :param data: Content of the file.
+        :type data: bytes
+        """
+        if self.reproducible:
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix="hepdata_lib_archive_")
+            handle, path = tempfile.mkstemp(dir=self._spill_dir)
+            with os.fdopen(handle, "wb") as spill_file:
+                spill_file.write(data)
+            self._pending[arcname] = path
+            return
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def add_text(self, arcname, text):
+        """
+        Add an in-memory text file to the archive using UTF-8 encoding.
+
+        :param arcname: Name of the file in the archive.
+        :type arcname: str
+
+        :param text: Content of the file.
+        :type text: str
+        """
+        self.add_bytes(arcname, text.encode("utf-8"))
+
+    def add_file(self, path, arcname=None):
+        """
+        Add a file on disk to the archive.
+
+        :param path: Path of the file.
+        :type path: str
+
+        :param arcname: Name of the file in the archive. Defaults to the base name of the path.
+        :type arcname: str
+        """
+        arcname = arcname if arcname else os.path.basename(path)
+        if self.reproducible:
+            self._pending[arcname] = path
+            return
+        self._tar.add(path, arcname=arcname)
+
+    def close(self):
+        """Write all pending members and close the archive."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            for arcname in sorted(self._pending):
+                self._tar.add(self._pending[arcname], arcname=arcname, filter=self._normalize)
+            self._pending = {}
+        finally:
+            self._tar.close()
+            for stream in self._streams:
+                stream.close()
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
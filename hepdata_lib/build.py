@@ -0,0 +1,521 @@
+"""Writing of the output files of a submission (see Submission.create_files)."""
+
+import io
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain, repeat
+import yaml
+
+# The representers of hepdata_lib are registered on this class by the package
+try:
+    from yaml import CSafeDumper as Dumper
+except ImportError:
+    from yaml import SafeDumper as Dumper
+
+from hepdata_validator.full_submission_validator import FullSubmissionValidator
+from hepdata_lib import archive, helpers, profiling, rasterizers
+
+#: Path of the tar ball written by a build.
+TARFILE_PATH = "submission.tar.gz"
+
+
+@contextmanager
+def _nullcontext(enter_result=None):
+    """Context that does nothing (contextlib.nullcontext requires Python 3.7)."""
+    yield enter_result
+
+
+class BuildOptions:
+    """
+    Options of a build, as passed to Submission.create_files.
+
+    :param workers: If larger than one, the tables are written concurrently by that many
+                    workers. The output is identical to the one obtained when writing serially.
+    :type workers: int
+
+    :param parallel_backend: Kind of worker pool, either "process" or "thread".
+    :type parallel_backend: string
+
+    :param streaming: Write the data files with the streaming YAML emitter
+                      (see Table.write_yaml).
+    :type streaming: bool
+
+    :param incremental: Only write the data files of the tables that changed since the last
+                        incremental build in the output directory (see Table.fingerprint).
+                        With `remove_old`, up-to-date data files and images are kept.
+    :type incremental: bool
+
+    :param archive_only: Write all files straight into the tar ball, without touching
+                         the output directory.
+    :type archive_only: bool
+
+    :param reproducible: Write a reproducible tar ball (see archive.ArchiveWriter).
+    :type reproducible: bool
+
+    :param compresslevel: Gzip compression level of the tar ball, from 0 to 9.
+    :type compresslevel: int
+
+    :param compression_threads: If larger than one, the tar ball is compressed by that
+                                many threads (see archive.ParallelGzipFile).
+    :type compression_threads: int
+
+    :param image_workers: If larger than one, the images of all tables are converted before
+                          the tables are written, with up to that many concurrent
+                          conversions. Defaults to `workers`.
+    :type image_workers: int
+
+    :param rasterizer: Backend converting the images, or its name
+                       (see rasterizers.get_rasterizer).
+    :type rasterizer: rasterizers.Rasterizer or str
+
+    :param image_staleness: How to decide whether existing images are up to date,
+                            "time" or "hash" (see Table.write_images).
+    :type image_staleness: str
+
+    :param profile: Measure the time spent in each stage of the build
+                    (see profiling.BuildProfile).
+    :type profile: bool
+
+    :param profile_memory: Also measure the memory use of each stage. Implies `profile`.
+    :type profile_memory: bool
+
+    :param build_cache: Cache of data files (see Submission.set_build_cache).
+    :type build_cache: cache.BuildCache
+
+    :param image_cache: Cache of converted images (see Submission.set_image_cache).
+    :type image_cache: cache.ImageCache
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, *, workers=None, parallel_backend="process", streaming=False,
+                 incremental=False, archive_only=False, reproducible=False,
+                 compresslevel=archive.DEFAULT_COMPRESSLEVEL, compression_threads=None,
+                 image_workers=None, rasterizer=None, image_staleness="time", profile=False,
+                 profile_memory=False, build_cache=None, image_cache=None):
+        # pylint: disable=too-many-arguments,too-many-locals
+        if parallel_backend not in ("process", "thread"):
+            raise ValueError(f"Unknown parallel backend: '{parallel_backend}'. "
+                             "Expected 'process' or 'thread'.")
+        if archive_only and incremental:
+            raise ValueError("Incremental builds are not possible without an output directory.")
+        if image_staleness not in ("time", "hash"):
+            raise ValueError(f"Unknown staleness mode: '{image_staleness}'. "
+                             "Expected 'time' or 'hash'.")
+        self.workers = workers
+        self.parallel_backend = parallel_backend
+        self.streaming = streaming
+        self.incremental = incremental
+        self.archive_only = archive_only
+        self.archive_options = {"reproducible": reproducible, "compresslevel": compresslevel,
+                                "threads": compression_threads}
+        self.image_workers = image_workers if image_workers is not None else workers
+        self.rasterizer = rasterizers.get_rasterizer(rasterizer)
+        self.image_staleness = image_staleness
+        self.profile = profile or profile_memory
+        self.profile_memory = profile_memory
+        self.build_cache = build_cache
+        self.image_cache = image_cache
+
+    @property
+    def parallel(self):
+        """Whether the tables are written by a pool of workers."""
+        return self.workers is not None and self.workers > 1
+
+    @property
+    def images_first(self):
+        """
+        Whether the images of all tables are converted before the tables are written.
+
+        Tables written concurrently may share images, whose conversions must not overlap.
+        """
+        return self.parallel or (self.image_workers is not None and self.image_workers > 1)
+
+
+def convert_image(conversion, rasterizer, cache=None, staleness="time"):
+    """
+    Convert an image to a full-size PNG file and a thumbnail, unless they are up to date.
+
+    :param conversion: Source image, PNG file and thumbnail (see Table.image_conversions).
+    :type conversion: tuple
+
+    The other arguments have the same meaning as for Table.write_images.
+    """
+    image_file, png_output_path, thumbnail_output_path = conversion
+    settings = rasterizer.fingerprint()
+
+    def is_outdated(path, source):
+        return helpers.file_is_outdated(path, source, staleness=staleness, settings=settings)
+
+    def record_sources(*outputs):
+        if staleness == "hash":
+            for path, source in outputs:
+                if os.path.exists(path):
+                    helpers.record_file_source(path, source, settings=settings)
+
+    # Convert to full-size PNG image and thumbnail in one pass
+    # Only executed if output is missing or out of date
+    if is_outdated(png_output_path, image_file):
+        key = cache.key(image_file, settings) if cache is not None else None
+        if key is None or not cache.fetch(key, png_output_path, thumbnail_output_path):
+            # The outputs may be hard links to the entries of an image cache, even if this
+            # build does not use it, which must not be overwritten
+            _remove_links(png_output_path, thumbnail_output_path)
+            rasterizer.convert(image_file, png_output_path, thumbnail_output_path)
+            if cache is not None and os.path.exists(png_output_path) \
+                    and os.path.exists(thumbnail_output_path):
+                cache.store(key, png_output_path, thumbnail_output_path)
+        record_sources((png_output_path, image_file), (thumbnail_output_path, png_output_path))
+        return
+    print(f"Full-size PNG file {png_output_path} is newer than its source file. \
+           Remove the thumbnail file or use create_files(remove_old=True)\
+               to force recreation.")
+
+    if is_outdated(thumbnail_output_path, png_output_path):
+        _remove_links(thumbnail_output_path)
+        rasterizer.make_thumbnail(png_output_path, thumbnail_output_path)
+        record_sources((thumbnail_output_path, png_output_path))
+    else:
+        print("Thumbnail PNG file {thumbnail_output_path} is newer than its source file. \
+               Remove the thumbnail file or use create_files(remove_old=True)\
+                   to force recreation.")
+
+
+def _remove_links(*paths):
+    """Remove the given files if they exist."""
+    for path in paths:
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+def _convert_images_in_order(conversions, options):
+    """Run conversions one after another (see Build.convert_images)."""
+    for conversion in conversions:
+        convert_image(conversion, options.rasterizer, options.image_cache,
+                      options.image_staleness)
+
+
+def _dump_table(table, streaming, cache):
+    """Return the content of the data file of a table, taken from the cache if possible."""
+    data = None
+    if cache is not None:
+        with profiling.stage("cache"):
+            key = table.fingerprint()
+            data = cache.get(key)
+    if data is None:
+        stream = io.StringIO()
+        table.dump_yaml(stream, streaming=streaming)
+        data = stream.getvalue()
+        if cache is not None:
+            with profiling.stage("cache"):
+                cache.put(key, data)
+    return data
+
+
+def write_table_files(table, outdir, options, recorded_fingerprint=None):
+    """
+    Write the images and the data file of a table, in a worker or in the calling process.
+
+    :returns: tuple -- submission file entry, additional resources, data file content
+              in archive-only builds, fingerprint in incremental builds and durations
+              and memory peaks of the stages if profiling.
+    """
+    peaks = {} if options.profile_memory else None
+    with profiling.tracking(top=0) if options.profile_memory else _nullcontext(), \
+         profiling.recording({} if options.profile else None, peaks) as timings:
+        if not options.images_first:
+            with profiling.stage("images"):
+                table.write_images(outdir, options.rasterizer, options.image_cache,
+                                   options.image_staleness)
+        data = None
+        fingerprint = None
+        # The variables of a deferred table are read once for the fingerprint and the data
+        with table.materialized():
+            if options.incremental:
+                with profiling.stage("fingerprint"):
+                    fingerprint = table.fingerprint()
+            if options.incremental and fingerprint == recorded_fingerprint:
+                pass
+            elif not options.archive_only and options.build_cache is None:
+                table.write_yaml(outdir, streaming=options.streaming)
+            else:
+                data = _dump_table(table, options.streaming, options.build_cache)
+                if not options.archive_only:
+                    with open(os.path.join(outdir, table.data_file_name), 'w',
+                              encoding='utf-8') as outfile:
+                        outfile.write(data)
+                    data = None
+    return table.make_submission_entry(), table.additional_resources, data, fingerprint, \
+        (timings, peaks) if options.profile else None
+
+
+def dump_submission_file(header, entries, stream):
+    """Write the central submission file: the general information and one entry per table."""
+    yaml.dump_all(
+        chain([header], entries),
+        stream,
+        Dumper=Dumper,
+        default_flow_style=False,
+        explicit_start=True)
+
+
+def pack_directory(outdir, tarfile_path, files_to_copy, archive_options):
+    """
+    Put the YAML and PNG files of the output directory and the copied
+    additional resource files into the tar ball.
+    """
+    files_to_add = []
+    files_to_add.extend(helpers.find_all_matching(outdir, "*.yaml"))
+    files_to_add.extend(helpers.find_all_matching(outdir, "*.png"))
+    files_to_add.extend(
+        [os.path.join(outdir, os.path.basename(x)) for x in files_to_copy]
+    )
+    with archive.ArchiveWriter(tarfile_path, **archive_options) as writer:
+        for filepath in files_to_add:
+            writer.add_file(filepath)
+
+
+def validate_archive(tarfile_path):
+    """Validate the tar ball with the hepdata-validator package."""
+    full_submission_validator = FullSubmissionValidator()
+    is_archive_valid = full_submission_validator.validate(archive=tarfile_path)
+    if not is_archive_valid:
+        for filename in full_submission_validator.get_messages():
+            full_submission_validator.print_errors(filename)
+    assert is_archive_valid, "The tar ball is not valid"
+
+
+class Build:
+    """Writing of the output files and the tar ball of a submission."""
+
+    def __init__(self, submission, outdir, options):
+        """
+        :param submission: Submission to write.
+        :type submission: Submission
+
+        :param outdir: Path to the output directory.
+        :type outdir: string
+
+        :param options: Options of the build.
+        :type options: BuildOptions
+        """
+        self.submission = submission
+        self.outdir = outdir
+        self.options = options
+        self.report = profiling.BuildProfile(memory=options.profile_memory) \
+            if options.profile else None
+        self.fingerprints = []
+
+    def run(self, remove_old=False, validate=True):
+        """
+        Write all output files and the tar ball, and validate it if requested.
+
+        :returns: profiling.BuildProfile -- report of the build if profiling, otherwise None.
+        """
+        header = self.submission.make_header_dict()
+        report = self.report
+        start = time.perf_counter()
+        with profiling.tracking() if self.options.profile_memory else _nullcontext() \
+                as tracker, \
+             profiling.recording(report.stages if report is not None else None,
+                                 report.memory if report is not None else None):
+            if self.options.archive_only:
+                self.write_archive(TARFILE_PATH, header)
+            else:
+                self.write_directory(TARFILE_PATH, header, remove_old)
+
+            if validate:
+                with profiling.stage("validation"):
+                    validate_archive(TARFILE_PATH)
+
+        if report is not None:
+            report.total = time.perf_counter() - start
+        if tracker is not None:
+            report.add_tracker(tracker)
+        return report
+
+    def prepare_output_directory(self, remove_old):
+        """
+        Create the output directory and, in incremental builds, read the fingerprints
+        recorded in its manifest for the existing data files.
+
+        :returns: list -- recorded fingerprint of the data file of each table, or None if
+                  it must be written. None instead of the list for non-incremental builds.
+        """
+        tables = self.submission.tables
+        outdir = self.outdir
+        recorded = None
+        if self.options.incremental:
+            manifest = helpers.read_manifest(outdir)
+            names = [table.data_file_name for table in tables]
+            # Data files shared by several tables are always written again
+            recorded = [
+                manifest.get(name) if names.count(name) == 1
+                and os.path.isfile(os.path.join(outdir, name)) else None
+                for name in names
+                ]
+
+        if remove_old and os.path.exists(outdir):
+            if self.options.incremental:
+                keep = {table.data_file_name for table, fingerprint in zip(tables, recorded)
+                        if fingerprint is not None}
+                keep.update(self._current_images())
+                helpers.clean_directory(outdir, keep=keep)
+            else:
+                shutil.rmtree(outdir)
+
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+
+        # The manifest is only valid for the data files written by an incremental build
+        manifest_path = os.path.join(outdir, helpers.MANIFEST_FILE_NAME)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return recorded
+
+    def _current_images(self):
+        """Return the names of the up-to-date images, thumbnails and their sidecar files."""
+        staleness = self.options.image_staleness
+        settings = self.options.rasterizer.fingerprint()
+        names = set()
+        for table in self.submission.tables:
+            for image_file, png_output_path, thumbnail_output_path in \
+                    table.image_conversions(self.outdir):
+                if helpers.file_is_outdated(png_output_path, image_file, staleness=staleness,
+                                            settings=settings) \
+                        or helpers.file_is_outdated(thumbnail_output_path, png_output_path,
+                                                    staleness=staleness, settings=settings):
+                    continue
+                for path in (png_output_path, thumbnail_output_path):
+                    names.add(os.path.basename(path))
+                    names.add(os.path.basename(helpers.source_record_path(path)))
+        return names
+
+    def convert_images(self, outdir):
+        """
+        Convert the images of all tables concurrently and add them to their resources.
+
+        Conversions writing the same files run one after another in table order, so the
+        output is the same as with Table.write_images.
+        """
+        tables = self.submission.tables
+        conversions = [table.image_conversions(outdir) for table in tables]
+        jobs = {}
+        for conversion in chain.from_iterable(conversions):
+            jobs.setdefault(conversion[1], []).append(conversion)
+
+        # Rasterizers that are not thread-safe run in worker processes
+        pool_class = ThreadPoolExecutor if self.options.rasterizer.thread_safe \
+            else ProcessPoolExecutor
+        with pool_class(max_workers=self.options.image_workers or 1) as pool:
+            for future in [pool.submit(_convert_images_in_order, job, self.options)
+                           for job in jobs.values()]:
+                future.result()
+        for table, table_conversions in zip(tables, conversions):
+            table.add_image_resources(table_conversions)
+
+    def write_tables(self, outdir, recorded=None, writer=None):
+        """
+        Write the files of all tables and yield their submission file entries in order.
+
+        In archive-only builds, the data files are added to the archive writer.
+        """
+        if self.options.images_first:
+            with profiling.stage("images"):
+                self.convert_images(outdir)
+        with self._pool() as pool:
+            for table, result in zip(self.submission.tables,
+                                     self._table_results(pool, outdir, recorded)):
+                yield self._finish_table(table, result, outdir, writer)
+
+    def _pool(self):
+        """Return the pool of workers writing the tables, or a null context if serial."""
+        if not self.options.parallel:
+            return _nullcontext()
+        pool_class = ProcessPoolExecutor if self.options.parallel_backend == "process" \
+            else ThreadPoolExecutor
+        return pool_class(max_workers=self.options.workers)
+
+    def _table_results(self, pool, outdir, recorded):
+        """Return the results of write_table_files for all tables, in order."""
+        ntables = len(self.submission.tables)
+        arguments = (self.submission.tables, repeat(outdir, ntables),
+                     repeat(self.options, ntables),
+                     recorded if recorded is not None else repeat(None, ntables))
+        return pool.map(write_table_files, *arguments) if pool is not None \
+            else map(write_table_files, *arguments)
+
+    def _finish_table(self, table, result, outdir, writer):
+        """Take over the result of write_table_files for a table and return its entry."""
+        entry, resources, data, fingerprint, stages = result
+        timings, peaks = stages if stages is not None else (None, None)
+        self.fingerprints.append(fingerprint)
+        table.additional_resources = resources
+        if writer is None:
+            with profiling.recording(timings, peaks), profiling.stage("copy_files"):
+                table.copy_files(outdir)
+        else:
+            writer.add_text(table.data_file_name, data)
+        if self.report is not None:
+            self.report.add_table(table.name, timings, peaks)
+        return entry
+
+    def _resource_files(self):
+        """
+        Return the additional resource files to be included in the tar ball, keyed by
+        their name in it. Of several files with the same name, the last one is used.
+        """
+        files = {}
+        for ifile in [f for table in self.submission.tables for f in table.files_to_copy] \
+                + self.submission.files_to_copy:
+            helpers.check_file_existence(ifile)
+            helpers.check_file_size(ifile, upper_limit=100)
+            files[os.path.basename(ifile)] = ifile
+        return files
+
+    def write_archive(self, tarfile_path, header):
+        """Write all files straight into the tar ball, with the images converted aside."""
+        with tempfile.TemporaryDirectory() as imagedir, \
+             archive.ArchiveWriter(tarfile_path, **self.options.archive_options) as writer:
+            table_entries = self.write_tables(imagedir, writer=writer)
+            with profiling.stage("tables"):
+                stream = io.StringIO()
+                dump_submission_file(header, table_entries, stream)
+                writer.add_text("submission.yaml", stream.getvalue())
+
+            with profiling.stage("archive"):
+                # Only the images, as in pack_directory, not their sidecar files
+                for path in sorted(helpers.find_all_matching(imagedir, "*.png")):
+                    writer.add_file(path)
+                for arcname, path in self._resource_files().items():
+                    writer.add_file(path, arcname)
+                writer.close()
+
+    def write_directory(self, tarfile_path, header, remove_old):
+        """Write all files into the output directory and pack them into the tar ball."""
+        outdir = self.outdir
+        recorded = self.prepare_output_directory(remove_old)
+
+        # Write general info and all the tables into the submission file in one pass
+        table_entries = self.write_tables(outdir, recorded)
+        with profiling.stage("tables"), \
+             open(os.path.join(outdir, 'submission.yaml'), 'w', encoding='utf-8') as outfile:
+            dump_submission_file(header, table_entries, outfile)
+
+        if self.options.incremental:
+            helpers.write_manifest(outdir, {
+                table.data_file_name: fingerprint
+                for table, fingerprint in zip(self.submission.tables, self.fingerprints)
+                })
+
+        # Copy additional resource files
+        with profiling.stage("copy_files"):
+            self.submission.copy_files(outdir)
+
+        with profiling.stage("archive"):
+            pack_directory(outdir, tarfile_path, self.submission.files_to_copy_nested(),
+                           self.options.archive_options)
@@ -0,0 +1,268 @@
+"""Persistent on-disk caches of table data files and converted images."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+#: Default upper limit of the total size of a build cache in bytes.
+DEFAULT_MAX_SIZE = 1 << 30
+
+# Size of the chunks in which source images are hashed
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+class _DirectoryCache:
+    """
+    Base class of caches of files with a common suffix, stored in a directory on disk.
+
+    The total size of the cache is bounded: when it is exceeded after adding an
+    entry, the least recently used entries are deleted. Each access updates the
+    modification time of the cache file, which is used to order the entries.
+    Entries are written atomically, so that several processes can use the same cache.
+    """
+
+    #: Suffix of the cache files.
+    suffix = None
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param path: Path of the cache directory. Will be created if it doesn't exist.
+                     A leading ~ is expanded to the home directory.
+        :type path: str
+
+        :param max_size: Upper limit of the total size of the cache files in bytes.
+        :type max_size: int
+        """
+        if max_size < 0:
+            raise ValueError(f"Invalid maximum cache size: {max_size}.")
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+
+    def _entry_path(self, key):
+        """Return the path of the cache file of an entry."""
+        return os.path.join(self.path, key + self.suffix)
+
+    def _write_entry(self, key, write):
+        """Atomically write the cache file of an entry with the given function."""
+        os.makedirs(self.path, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as temp_file:
+                write(temp_file)
+            os.replace(temp_path, self._entry_path(key))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def entries(self):
+        """
+        Return the entries of the cache, least recently used first.
+
+        :returns: list -- (path, size) of each cache file.
+        """
+        try:
+            files = [entry for entry in os.scandir(self.path)
+                     if entry.name.endswith(self.suffix) and entry.is_file()]
+        except OSError:
+            return []
+        stats = []
+        for entry in files:
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Evicted by another process in the meantime
+                continue
+            stats.append((stat.st_mtime_ns, entry.name, entry.path, stat.st_size))
+        return [(path, size) for _, _, path, size in sorted(stats)]
+
+    @property
+    def size(self):
+        """Total size of the cache files in bytes."""
+        return sum(size for _, size in self.entries())
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in its maximum size."""
+        entries = self.entries()
+        total = sum(size for _, size in entries)
+        for path, size in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Delete all entries of the cache."""
+        for path, _ in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class BuildCache(_DirectoryCache):
+    """
+    Cache of emitted table data files, stored in a directory on disk.
+
+    Entries are keyed by the fingerprint of a table (see Table.fingerprint),
+    which covers the content of the data file and the version of hepdata_lib,
+    so that the cache can be shared between sessions, submissions and CI runs.
+    The size of the cache is bounded and its entries are written atomically
+    (see _DirectoryCache).
+    """
+
+    suffix = ".yaml"
+
+    def get(self, key):
+        """
+        Return the cached data file for the given key.
+
+        :param key: Fingerprint of the table.
+        :type key: str
+
+        :returns: str -- content of the data file, or None if it is not cached.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                data = cache_file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data.decode("utf-8")
+
+    def put(self, key, text):
+        """
+        Store a data file in the cache and evict the least recently used entries
+        if the cache grows too large.
+
+        :param key: Fingerprint of the table.
+        :type key: str
+
+        :param text: Content of the data file.
+        :type text: str
+        """
+        data = text.encode("utf-8")
+        self._write_entry(key, lambda temp_file: temp_file.write(data))
+        self.evict()
+
+
+class ImageCache(_DirectoryCache):
+    """
+    Cache of converted images and thumbnails, stored in a directory on disk.
+
+    Entries are keyed by the hash of the source image and of the conversion
+    parameters (see key), so that the cache can be shared between submissions,
+    revisions and sessions which use the same figures.
+    Cached files are hard-linked to their targets if possible, and copied otherwise.
+    The size of the cache is bounded and its entries are written atomically
+    (see _DirectoryCache).
+    """
+
+    suffix = ".png"
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE, link=True):
+        """
+        :param path: Path of the cache directory. Will be created if it doesn't exist.
+                     A leading ~ is expanded to the home directory.
+        :type path: str
+
+        :param max_size: Upper limit of the total size of the cache files in bytes.
+        :type max_size: int
+
+        :param link: Hard-link cached files to their targets instead of copying them.
+                     Files are copied if they cannot be linked, e.g. across file systems.
+        :type link: bool
+        """
+        super().__init__(path, max_size)
+        self.link = link
+
+    @staticmethod
+    def key(source, parameters):
+        """
+        Return the key of the conversion of an image.
+
+        :param source: Path of the source image.
+        :type source: str
+
+        :param parameters: Description of the conversion, e.g. the fingerprint of
+                           the rasterizer (see rasterizers.Rasterizer.fingerprint).
+        :type parameters: str
+
+        :returns: str -- hexadecimal hash of the parameters and the content of the source.
+        """
+        digest = hashlib.sha256(parameters.encode("utf-8") + b"\0")
+        with open(source, "rb") as source_file:
+            for chunk in iter(lambda: source_file.read(_HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def fetch(self, key, *targets):
+        """
+        Write the cached files of an entry to the given targets.
+
+        An entry consists of one file per target, e.g. an image and its thumbnail,
+        which are written in order. Existing targets are replaced.
+
+        :param key: Key of the entry (see key).
+        :type key: str
+
+        :param targets: Paths of the output files.
+        :type targets: str
+
+        :returns: bool -- whether the entry was found. If not, no target is written.
+        """
+        paths = [self._entry_path(f"{key}-{index}") for index in range(len(targets))]
+        try:
+            for path in paths:
+                os.utime(path)
+        except OSError:
+            return False
+        written = []
+        try:
+            for path, target in zip(paths, targets):
+                if os.path.lexists(target):
+                    os.remove(target)
+                self._link_or_copy(path, target)
+                written.append(target)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            for target in written:
+                os.remove(target)
+            return False
+        return True
+
+    def _link_or_copy(self, path, target):
+        """Hard-link a cache file to the target if possible, and copy it otherwise."""
+        if self.link:
+            try:
+                os.link(path, target)
+                return
+            except FileNotFoundError:
+                raise
+            except OSError:
+                # E.g. different file systems or no support for hard links
+                pass
+        shutil.copyfile(path, target)
+
+    def store(self, key, *paths):
+        """
+        Copy files to the cache as one entry and evict the least recently used entries
+        if the cache grows too large.
+
+        :param key: Key of the entry (see key).
+        :type key: str
+
+        :param paths: Paths of the files, in the order of the targets of fetch.
+        :type paths: str
+        """
+        for index, path in enumerate(paths):
+            with open(path, "rb") as source_file:
+                self._write_entry(f"{key}-{index}",
+                                  lambda temp_file, source=source_file:
+                                  shutil.copyfileobj(source, temp_file))
+        self.evict()
@@ -0,0 +1,410 @@
+"""Columnar storage of Variable and Uncertainty values."""
+
+import mmap
+import numpy as np
+from hepdata_lib import helpers
+
+# Kinds of column entries
+KIND_FLOAT = 0
+KIND_INT = 1
+KIND_OTHER = 2
+
+# Largest integer magnitude that is exactly representable as float64
+_MAX_EXACT_INT = 2 ** 53
+
+# Number of rows of an array fed into a hash object at once
+_HASH_CHUNK_ROWS = 1 << 16
+
+
+def _file_mapping(array):
+    """
+    Return the arguments to map a memory-mapped array again, e.g. in another process.
+
+    :returns: tuple -- file name, offset, dtype and shape, or None if the array is not
+              a C-contiguous part of a memory-mapped file.
+    """
+    if not isinstance(array, np.memmap) or not array.flags.c_contiguous:
+        return None
+    root = array
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or not isinstance(root.base, mmap.mmap) \
+            or root.filename is None:
+        return None
+    offset = root.offset + array.ctypes.data - root.ctypes.data
+    return root.filename, offset, array.dtype.str, array.shape
+
+
+class ValueList(list):
+    """
+    List of the values of a Variable or an Uncertainty, as returned by their values property.
+
+    The list is a copy of the entries of the column holding the values (see Column.tolist).
+    Changes made to the list in place, e.g. by assigning an element or appending a value,
+    are written back to the owner by assigning the whole list to its values property,
+    which checks the values again and stores them in a new column.
+    Once the values of the owner have been replaced otherwise, changes to the list
+    no longer affect the owner.
+    """
+
+    def __init__(self, owner):
+        """
+        :param owner: Variable or Uncertainty whose values are listed.
+        """
+        super().__init__(owner.values_column.tolist())
+        self._owner = owner
+        self._column = owner.values_column
+
+    def _write_back(self):
+        """Assign the changed list to the values of the owner, unless they were replaced."""
+        if self._owner.values_column is self._column:
+            self._owner.values = list(self)
+            self._column = self._owner.values_column
+
+
+def _writing_back(name):
+    """Return a method of ValueList that calls the list method `name` and writes back."""
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._write_back()  # pylint: disable=protected-access
+        return result
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend",
+              "insert", "pop", "remove", "clear", "sort", "reverse"):
+    setattr(ValueList, _name, _writing_back(_name))
+
+
+class Column:
+    """
+    Columnar storage of sanitized values (see helpers.sanitize_value).
+
+    Numeric values are stored in a contiguous float64 array of shape (N,),
+    or (N, 2) for pairs of values such as bin edges or asymmetric uncertainties.
+    Integers are flagged so that they can be converted back to int.
+    Strings and all other non-numeric entries are dictionary-encoded, i.e. stored
+    once in a list of categories and referenced by an integer code.
+    None entries (e.g. one-sided uncertainties) are marked in a validity mask.
+
+    The arrays describing the kinds, codes and validity of the entries are only
+    allocated if needed, so that a column of floats only costs eight bytes per number.
+
+    Memory-mapped float64 arrays (numpy.memmap, e.g. from numpy.load with mmap_mode="r")
+    are used without copying them, so that their values are only read from disk
+    when needed. When a column is pickled, e.g. to send it to a worker process,
+    such arrays are mapped again from their file instead of being copied.
+    The file must not be changed while the column is in use.
+
+    Columns are immutable: all operations return new Column objects.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, numbers, kinds=None, codes=None, categories=None, valid=None):
+        self.numbers = numbers
+        self.kinds = kinds
+        self.codes = codes
+        self.categories = categories if categories is not None else []
+        self.valid = valid
+
+    @classmethod
+    def from_values(cls, values, pairs=False):
+        """
+        Create a column from a list or array of values.
+
+        The values are sanitized the same way as helpers.sanitize_value does.
+
+        :param values: Values to store. Columns are returned as they are.
+        :type values: list, numpy.ndarray, Column or other iterable
+
+        :param pairs: If True, each value must be a pair of values,
+                      e.g. (lower bin edge, upper bin edge).
+        :type pairs: bool
+        """
+        if isinstance(values, Column):
+            if values.pairs != pairs:
+                raise ValueError(f"Expected column of {'pairs' if pairs else 'single values'}.")
+            return values
+        if pairs and isinstance(values, np.ndarray) and len(values.dtype.names or ()) == 2:
+            # Structured array of pairs, e.g. bin edges from hist_utils.read_hist
+            fields = [values[name] for name in values.dtype.names]
+            if all(field.dtype.kind in "biuf" for field in fields):
+                values = np.stack(fields, axis=-1)
+        if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+            if not values.size:
+                values = values.reshape((0, 2) if pairs else (0,))
+            expected_ndim = 2 if pairs else 1
+            if values.ndim != expected_ndim or (pairs and values.shape[1] != 2):
+                raise ValueError(f"Expected array of shape {'(N, 2)' if pairs else '(N,)'}, "
+                                 f"instead got {values.shape}.")
+            if isinstance(values, np.memmap) and values.dtype == np.float64:
+                # Read-only view, the values stay on disk
+                numbers = values.view()
+                numbers.flags.writeable = False
+                return cls(numbers)
+            numbers = np.array(values, dtype=np.float64)
+            numbers.flags.writeable = False
+            return cls(numbers)
+
+        values = list(values)
+        if pairs:
+            for value in values:
+                if value is None or len(value) != 2:
+                    raise ValueError(f"Expected pair of values, instead got: {value}.")
+        return cls._from_list(values, pairs)
+
+    @classmethod
+    def _from_list(cls, values, pairs):
+        """Create a column from a list of values, one element at a time."""
+        shape = (len(values), 2) if pairs else (len(values),)
+        numbers = np.full(shape, np.nan)
+        kinds = np.full(shape, KIND_FLOAT, dtype=np.uint8)
+        codes = np.full(shape, -1, dtype=np.int32)
+        valid = np.ones(shape, dtype=bool)
+        categories = []
+        category_index = {}
+
+        def store(index, value):
+            # pylint: disable=unidiomatic-typecheck
+            if value is None:
+                valid[index] = False
+                return
+            if type(value) is float:
+                numbers[index] = value
+                return
+            if type(value) is int and abs(value) <= _MAX_EXACT_INT:
+                numbers[index] = value
+                kinds[index] = KIND_INT
+                return
+            value = helpers.sanitize_value(value)
+            if isinstance(value, float):
+                numbers[index] = value
+                return
+            if (type(value), value) not in category_index:
+                category_index[(type(value), value)] = len(categories)
+                categories.append(value)
+            kinds[index] = KIND_OTHER
+            codes[index] = category_index[(type(value), value)]
+
+        for i, value in enumerate(values):
+            if pairs:
+                store((i, 0), value[0])
+                store((i, 1), value[1])
+            else:
+                store(i, value)
+
+        column = cls(numbers,
+                     kinds if kinds.any() else None,
+                     codes if categories else None,
+                     categories,
+                     None if valid.all() else valid)
+        column.freeze()
+        return column
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        mapping = _file_mapping(self.numbers)
+        if mapping is not None:
+            state["numbers"] = mapping
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state["numbers"], tuple):
+            filename, offset, dtype, shape = state["numbers"]
+            state["numbers"] = np.memmap(filename, dtype=dtype, mode="r", offset=offset,
+                                         shape=shape)
+        self.__dict__.update(state)
+
+    def freeze(self):
+        """Make the arrays of this column read-only."""
+        for array in (self.numbers, self.kinds, self.codes, self.valid):
+            if array is not None and array.flags.writeable:
+                array.flags.writeable = False
+
+    @property
+    def pairs(self):
+        """True if each entry of the column is a pair of values."""
+        return self.numbers.ndim == 2
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the arrays of this column."""
+        return sum(array.nbytes for array in (self.numbers, self.kinds, self.codes, self.valid)
+                   if array is not None)
+
+    @property
+    def is_memory_mapped(self):
+        """True if the numbers of the column are read from a memory-mapped file."""
+        return isinstance(self.numbers, np.memmap)
+
+    @property
+    def is_float_only(self):
+        """True if all entries of the column are valid floats."""
+        return self.kinds is None and self.valid is None
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, index):
+        """Return the entries in the given range of rows as a new column."""
+        if not isinstance(index, slice):
+            raise TypeError("Columns can only be indexed with slices, use tolist() instead.")
+        return Column(self.numbers[index],
+                      None if self.kinds is None else self.kinds[index],
+                      None if self.codes is None else self.codes[index],
+                      self.categories,
+                      None if self.valid is None else self.valid[index])
+
+    def component(self, index):
+        """
+        Return one component of a column of pairs as a column of single values.
+
+        :param index: 0 for the first and 1 for the second element of each pair.
+        :type index: int
+        """
+        if not self.pairs:
+            raise ValueError("Components are only defined for columns of pairs.")
+        return Column(self.numbers[:, index],
+                      None if self.kinds is None else self.kinds[:, index],
+                      None if self.codes is None else self.codes[:, index],
+                      self.categories,
+                      None if self.valid is None else self.valid[:, index])
+
+    def update_hash(self, hasher):
+        """
+        Feed the content of the column into a hash object.
+
+        Columns created from the same values give the same hash updates.
+        The arrays are fed in chunks, so that memory-mapped arrays are not
+        read into memory at once.
+
+        :param hasher: Hash object, e.g. hashlib.sha256().
+        """
+        categories = [(type(value).__name__, value) for value in self.categories]
+        hasher.update(repr((self.numbers.shape, categories)).encode("utf-8"))
+        for array in (self.numbers, self.kinds, self.codes, self.valid):
+            if array is None:
+                hasher.update(b"none")
+                continue
+            for start in range(0, len(array), _HASH_CHUNK_ROWS):
+                chunk = array[start:start + _HASH_CHUNK_ROWS]
+                hasher.update(np.ascontiguousarray(chunk).tobytes())
+
+    def tolist(self):
+        """
+        Return the entries of the column as a list of Python objects.
+
+        :returns: list -- floats, integers, strings etc. or tuples of two of those for pairs.
+                  Invalid entries are None.
+        """
+        values = self.numbers.tolist()
+        if self.kinds is not None:
+            for index in zip(*np.nonzero(self.kinds)):
+                if self.kinds[index] == KIND_INT:
+                    value = int(self.numbers[index])
+                else:
+                    value = self.categories[self.codes[index]]
+                if self.pairs:
+                    values[index[0]][index[1]] = value
+                else:
+                    values[index[0]] = value
+        if self.valid is not None:
+            for index in zip(*np.nonzero(~self.valid)):
+                if self.pairs:
+                    values[index[0]][index[1]] = None
+                else:
+                    values[index[0]] = None
+        if self.pairs:
+            values = [tuple(pair) for pair in values]
+        return values
+
+    def scaled(self, factor):
+        """
+        Return a new column with each entry multiplied by a constant factor.
+
+        :param factor: Value to multiply by.
+        :type factor: float
+        """
+        if self.is_float_only and isinstance(factor, (int, float)):
+            numbers = self.numbers * factor
+            numbers.flags.writeable = False
+            return Column(numbers)
+        if self.pairs:
+            return Column.from_values([(factor * x[0], factor * x[1]) for x in self.tolist()],
+                                      pairs=True)
+        return Column.from_values([factor * x for x in self.tolist()])
+
+    def relative_round(self, relative_digits):
+        """
+        Apply helpers.relative_round to all entries of a column of single values.
+
+        Floats are rounded at once (see helpers.relative_round_array),
+        all other entries individually. Invalid entries are left alone.
+
+        :param relative_digits: number of significant digits to keep
+        :type relative_digits: integer
+
+        :returns: (numpy.ndarray, dict) -- rounded float entries (NaN elsewhere) and
+                  a dictionary mapping the index of each other entry to its rounded value.
+                  Use helpers.column_to_list to convert the result to a list.
+        """
+        numbers = helpers.relative_round_array(self.numbers, relative_digits)
+        others = {}
+        if self.kinds is not None:
+            for i in np.flatnonzero(self.kinds):
+                others[i] = helpers.relative_round(self.tolist_entry(i), relative_digits)
+        if self.valid is not None:
+            for i in np.flatnonzero(~self.valid):
+                others[i] = None
+        return numbers, others
+
+    def tolist_entry(self, index):
+        """Return a single entry of a column of single values as a Python object."""
+        if self.valid is not None and not self.valid[index]:
+            return None
+        kind = KIND_FLOAT if self.kinds is None else self.kinds[index]
+        if kind == KIND_INT:
+            return int(self.numbers[index])
+        if kind == KIND_OTHER:
+            return self.categories[self.codes[index]]
+        return float(self.numbers[index])
+
+    def numeric(self):
+        """
+        Return the entries as floats together with a mask of numeric entries.
+
+        :returns: (numpy.ndarray, numpy.ndarray) -- float array and boolean mask of
+                  numeric entries. Other entries are undefined in the float array.
+        """
+        if self.is_float_only:
+            return self.numbers, np.ones(self.numbers.shape, dtype=bool)
+        numeric = np.ones(self.numbers.shape, dtype=bool)
+        if self.kinds is not None:
+            numeric &= self.kinds != KIND_OTHER
+        if self.valid is not None:
+            numeric[~self.valid] = False
+        return self.numbers, numeric
+
+    def nonzero(self):
+        """
+        Return a mask of the nonzero rows of the column.
+
+        None entries, zeros and empty strings count as zero. Other strings are converted
+        to float. For pairs, a row is nonzero if any of the two values is nonzero.
+
+        :returns: numpy.ndarray -- boolean mask of nonzero rows
+        """
+        nonzero = self.numbers != 0
+        if self.kinds is not None:
+            for index in zip(*np.nonzero(self.kinds == KIND_OTHER)):
+                nonzero[index] = helpers.is_nonzero(self.categories[self.codes[index]])
+        if self.valid is not None:
+            nonzero &= self.valid
+        if self.pairs:
+            nonzero = nonzero.any(axis=1)
+        return nonzero
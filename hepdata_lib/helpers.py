@@ -1,6 +1,9 @@
 """hepdata_lib helper functions."""
 
 import os
+import hashlib
+import json
+import shutil
 import subprocess
 import fnmatch
 import math
@@ -52,7 +55,8 @@ def convert_pdf_to_png(source, target):
     """
     assert os.path.exists(source), f"Source file does not exist: {source}"
 
-    command = f"convert -flatten -density 300 -fuzz 1% -trim +repage {source} {target}"
+    command = ("convert -flatten -density 300 -fuzz 1% -trim +repage "
+               f"-define png:exclude-chunks=date,time {source} {target}")
     command_ok = execute_command(command)
     if not command_ok:
         print("ImageMagick does not seem to be installed \
@@ -69,7 +73,7 @@ def convert_png_to_thumbnail(source, target):
     :type target: str
     """
 
-    command = f"convert -thumbnail 240x179 {source} {target}"
+    command = f"convert -thumbnail 240x179 -define png:exclude-chunks=date,time {source} {target}"
     command_ok = execute_command(command)
 
     if not command_ok:
@@ -77,28 +81,129 @@ def convert_png_to_thumbnail(source, target):
                 or is not in the path - not adding any images.")
 
 
-def file_is_outdated(file_path, reference_file_path):
+def convert_pdf_to_png_and_thumbnail(source, target, thumbnail_target):
+    """
+    Wrapper for the ImageMagick convert utility producing a full-size PNG file
+    and its thumbnail in a single invocation.
+
+    The PDF is rasterized only once, and the thumbnail is made from the rasterized
+    image in memory instead of decoding the full-size PNG file again.
+    The thumbnail is written after the full-size PNG file.
+
+    :param source: Source file in PDF format.
+    :type source: str
+    :param target: Output file in PNG format.
+    :type target: str
+    :param thumbnail_target: Output thumbnail file in PNG format.
+    :type thumbnail_target: str
+    """
+    assert os.path.exists(source), f"Source file does not exist: {source}"
+
+    command = (f"convert -density 300 {source} -flatten -fuzz 1% -trim +repage "
+               f"-define png:exclude-chunks=date,time -write {target} "
+               f"-thumbnail 240x179 {thumbnail_target}")
+    command_ok = execute_command(command)
+    if not command_ok:
+        print("ImageMagick does not seem to be installed \
+                or is not in the path - not adding any images.")
+
+
+def file_is_outdated(file_path, reference_file_path, staleness="time", settings=""):
     """
     Check if the given file is outdated compared to the reference file.
 
-    Also returns true if the reference file does not exist.
+    Also returns true if the file does not exist.
+
+    With the "time" staleness mode, the file is outdated if it was modified or changed
+    before the reference file. With the "hash" mode, it is outdated unless the hashes
+    recorded by record_file_source match the current content of the reference file,
+    the settings and the current content of the file, regardless of file timestamps.
 
     :param file_path: Path to the file to check.
     :type file_path: str
     :param reference_file_path: Path to the reference file.
     :type reference_file_path: str
-    """
+    :param staleness: Staleness mode, either "time" or "hash".
+    :type staleness: str
+    :param settings: Settings used to make the file from the reference file,
+                     compared in "hash" mode.
+    :type settings: str
+    """
+    if staleness not in ("time", "hash"):
+        raise ValueError(f"Unknown staleness mode: '{staleness}'. Expected 'time' or 'hash'.")
     if not os.path.exists(reference_file_path):
         raise RuntimeError(f"Reference file does not exist: {reference_file_path}")
     if not os.path.exists(file_path):
         return True
 
+    if staleness == "hash":
+        try:
+            with open(source_record_path(file_path), encoding="utf-8") as record_file:
+                record = json.load(record_file)
+        except (OSError, ValueError):
+            return True
+        return not isinstance(record, dict) \
+            or record.get("source") != _source_hash(reference_file_path, settings) \
+            or record.get("hash") != file_hash(file_path)
+
     modification_outdated = os.path.getmtime(file_path) < os.path.getmtime(reference_file_path)
     change_outdated = os.path.getctime(file_path) < os.path.getctime(reference_file_path)
 
     return modification_outdated | change_outdated
 
 
+def file_hash(path):
+    """
+    Return the SHA-256 hash of the content of a file.
+
+    :param path: Path to the file.
+    :type path: str
+
+    :returns: str -- hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_hash(reference_file_path, settings):
+    """Return the hash of a reference file together with the settings applied to it."""
+    return hashlib.sha256(f"{settings}\0{file_hash(reference_file_path)}".encode()).hexdigest()
+
+
+def source_record_path(file_path):
+    """
+    Return the path of the sidecar file in which record_file_source
+    records the source of a file.
+
+    :param file_path: Path to the file.
+    :type file_path: str
+
+    :returns: str -- path of the hidden file ".<name>.source.json" next to the file.
+    """
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.source.json")
+
+
+def record_file_source(file_path, reference_file_path, settings=""):
+    """
+    Record the hashes of a file and of the reference file it was made from
+    in a sidecar file next to it, for the "hash" staleness mode of file_is_outdated.
+
+    :param file_path: Path to the file.
+    :type file_path: str
+    :param reference_file_path: Path to the reference file.
+    :type reference_file_path: str
+    :param settings: Settings used to make the file from the reference file.
+    :type settings: str
+    """
+    record = {"source": _source_hash(reference_file_path, settings), "hash": file_hash(file_path)}
+    with open(source_record_path(file_path), "w", encoding="utf-8") as record_file:
+        json.dump(record, record_file)
+
+
 def find_all_matching(path, pattern):
     """Utility function that works like 'find' in bash."""
     if not os.path.exists(path):
@@ -111,6 +216,63 @@ def find_all_matching(path, pattern):
     return result
 
 
+def clean_directory(path, keep=()):
+    """
+    Remove all files and subdirectories of a directory except the ones listed.
+
+    :param path: Path to the directory.
+    :type path: str
+    :param keep: Names of the entries of the directory to keep.
+    :type keep: collection of str
+    """
+    for name in os.listdir(path):
+        if name in keep:
+            continue
+        entry = os.path.join(path, name)
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            shutil.rmtree(entry)
+        else:
+            os.remove(entry)
+
+
+#: Name of the file storing the table fingerprints of an incremental build.
+MANIFEST_FILE_NAME = ".hepdata_lib_manifest.json"
+
+#: Size limit of a single data file in bytes, as enforced by hepdata-validator.
+DATA_FILE_SIZE_LIMIT = 10 * 1024 * 1024
+
+
+def read_manifest(path):
+    """
+    Read the table fingerprints stored in an output directory.
+
+    :param path: Path to the output directory.
+    :type path: str
+
+    :returns: dict -- fingerprint for each data file name.
+              Empty if there is no manifest or if it cannot be read.
+    """
+    try:
+        with open(os.path.join(path, MANIFEST_FILE_NAME), encoding="utf-8") as manifest:
+            fingerprints = json.load(manifest)["tables"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    return fingerprints if isinstance(fingerprints, dict) else {}
+
+
+def write_manifest(path, fingerprints):
+    """
+    Store the table fingerprints in an output directory.
+
+    :param path: Path to the output directory.
+    :type path: str
+    :param fingerprints: Fingerprint for each data file name.
+    :type fingerprints: dict
+    """
+    with open(os.path.join(path, MANIFEST_FILE_NAME), "w", encoding="utf-8") as manifest:
+        json.dump({"tables": fingerprints}, manifest, indent=1, sort_keys=True)
+
+
 def check_file_existence(path_to_file):
     """
     Check that the given file path exists.
@@ -291,6 +453,90 @@ def relative_round(value, relative_digits):
     return round(value, int(absolute_digits))
 
 
+# Kinds of uncertainty entries of a bin, see Variable.make_columns
+ERROR_NONE = 0
+ERROR_SYMMETRIC = 1
+ERROR_ASYMMETRIC = 2
+
+# Exactly representable powers of ten used for vectorized rounding
+_POW10 = np.array([float(10 ** k) for k in range(23)])
+
+
+def relative_round_array(values, relative_digits):
+    """
+    Vectorized version of relative_round for an array of floats.
+
+    The results are identical to applying relative_round to each element.
+    Elements for which the vectorized arithmetic could round differently
+    than Python's round (e.g. values close to a tie or to a power of ten)
+    are passed to relative_round individually.
+
+    :param values: values to round
+    :type  values: numpy.ndarray or iterable[float]
+
+    :param relative_digits: number of significant digits to keep
+    :type  relative_digits: integer
+
+    :returns: numpy.ndarray -- rounded values. Zero, NaN and infinite values are left alone.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = values.copy()
+    regular = np.isfinite(values) & (values != 0)
+    if not regular.any():
+        return result
+
+    regulars = values[regular]
+    logs = np.log10(np.abs(regulars))
+    absolute_digits = relative_digits - np.ceil(logs)
+    fallback = (np.abs(logs - np.rint(logs)) < 1e-9) | (np.abs(absolute_digits) >= len(_POW10))
+
+    absolute_digits = np.clip(absolute_digits, 1 - len(_POW10), len(_POW10) - 1).astype(int)
+    positive = absolute_digits >= 0
+    scale = _POW10[np.abs(absolute_digits)]
+    # Both branches of np.where are evaluated, so the discarded one may overflow
+    with np.errstate(over="ignore", invalid="ignore"):
+        scaled = np.where(positive, regulars * scale, regulars / scale)
+        rounded = np.rint(scaled)
+        distance_to_tie = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5)
+        fallback |= distance_to_tie <= 2.0 ** -50 * np.abs(scaled)
+        fallback |= np.abs(scaled) >= 2 ** 52
+        rounded = np.where(positive, rounded / scale, rounded * scale)
+
+    for i in np.flatnonzero(fallback):
+        rounded[i] = relative_round(float(regulars[i]), relative_digits)
+    result[regular] = rounded
+    return result
+
+
+def column_to_list(column):
+    """
+    Convert a column as returned by Column.relative_round to a list of Python objects.
+
+    :param column: float array and dictionary of other entries
+    :type  column: tuple
+
+    :returns: list -- values of the column
+    """
+    numbers, others = column
+    values = numbers.tolist()
+    for i, value in others.items():
+        values[i] = value
+    return values
+
+
+def is_nonzero(value):
+    """
+    Check if a single sanitized value is nonzero.
+
+    None and empty strings count as zero. Other strings are converted to float.
+
+    :param value: value to check
+
+    :returns: bool -- True if the value is nonzero
+    """
+    return not (value is None or str(value) == '') and float(value) != 0
+
+
 def round_multiple(uncs, sig_digits=2, no_round_to_zero=True):
     """
     Round a collection of values to the precision required for the given sd's to
@@ -530,22 +776,56 @@ def round_value_and_uncertainty_to_decimals(cont, val_key="y", unc_key="dy", dec
             cont[unc_key][i] = round(unc, decimals)
 
 
-def any_uncertainties_nonzero(uncertainties, size):
+def split_ranges(column, max_size):
+    """
+    Divide the rows of a column into contiguous ranges of limited size.
+
+    Consecutive rows with equal values are kept in the same range,
+    unless there are more than `max_size` of them.
+
+    :param column: Values of the rows.
+    :type column: columns.Column
+
+    :param max_size: Maximum number of rows per range.
+    :type max_size: int
+
+    :returns: list -- (start, stop) index pairs of the ranges.
+    """
+    nrows = len(column)
+    if column.is_float_only:
+        changed = column.numbers[1:] != column.numbers[:-1]
+        if changed.ndim == 2:
+            changed = changed.any(axis=1)
+    else:
+        values = column.tolist()
+        changed = np.array([a != b for a, b in zip(values[1:], values[:-1])], dtype=bool)
+    group_ends = (np.flatnonzero(changed) + 1).tolist() + [nrows]
+
+    ranges = []
+    start = previous = 0
+    for end in group_ends:
+        if end - start > max_size:
+            if previous > start:
+                ranges.append((start, previous))
+                start = previous
+            while end - start > max_size:
+                ranges.append((start, start + max_size))
+                start += max_size
+        previous = end
+    if start < nrows:
+        ranges.append((start, nrows))
+    return ranges
+
+
+def any_uncertainties_nonzero(uncertainties, size, start=0, stop=None):
     """
     Return a mask of bins where any of the uncertainties is nonzero.
+
+    If `start` and `stop` are given, only the bins in this range are considered.
     """
     nonzero = np.zeros(size, dtype=bool)
 
     for unc in uncertainties:
-
-        # Treat one-sided uncertainties as
-        tmp = 0 if unc.is_symmetric else (0,0)
-        values = np.array([tmp if v is None else v for v in unc.values])
-        values[values.astype(str)==''] = 0
-        values = values.astype(float)
-
-        if unc.is_symmetric:
-            nonzero = nonzero | (values != 0)
-        else:
-            nonzero = nonzero | np.any(values != 0,axis=1)
+        # One-sided uncertainties (None) are treated as zero
+        nonzero = nonzero | unc.values_column[start:stop].nonzero()
     return nonzero
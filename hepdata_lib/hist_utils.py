@@ -157,7 +157,7 @@ def hist_as_variable(
             is_symmetric = False  #
             assert len(unc_proc) == 2, "Asymmetric uncertainty can only have 2 entries"
             _lo, _up = _make_unc_array(unc_proc[0]), _make_unc_array(unc_proc[1])
-            arr = list(zip(_lo, _up))
+            arr = numpy.stack((_lo, _up), axis=-1)
         else:  # Assuming symmetric error
             is_symmetric = True
             arr = _make_unc_array(unc_proc)
@@ -204,7 +204,7 @@ def _make_poisson_unc_array(
         # Suppressing the NAN for zero-entry events
         _lo = numpy.nan_to_num(_lo, nan=0.0)
         _up = numpy.nan_to_num(_up, nan=0.0)
-        unc_arr = list(zip(_lo, _up))
+        unc_arr = numpy.stack((_lo, _up), axis=-1)
 
     return unc_arr
 
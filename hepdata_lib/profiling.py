@@ -0,0 +1,474 @@
+"""Timing and memory use of the stages of building a submission."""
+
+import mmap
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Dictionaries into which the durations and memory peaks of the stages run in a
+# thread are currently recorded, if any (see recording)
+_RECORDING = threading.local()
+
+# Memory tracker of this process while memory use is being tracked (see tracking)
+_TRACKER = None
+
+#: Interval between two samples of the resident set size in seconds.
+RSS_SAMPLING_INTERVAL = 0.01
+
+
+def current_rss():
+    """
+    Return the current resident set size of this process.
+
+    :returns: int -- size in bytes, or None if it is not available on this platform.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryTracker:
+    """
+    Tracker of the memory use of the stages run in this process.
+
+    For each stage, the peak of the memory allocated by Python on top of the memory
+    allocated when the stage started is measured with tracemalloc, and the peak resident
+    set size is sampled by a background thread. When a stage ends with more allocated
+    memory than any stage before, a tracemalloc snapshot is taken, from which the top
+    allocators are reported.
+
+    Tracemalloc traces all threads of the process. If stages run concurrently in several
+    threads, their peaks are not separated. Memory that was allocated before a stage and
+    is freed during the stage lowers its peak, so the peaks are slightly smaller than the
+    largest amount allocated by the stage if, e.g., garbage is collected meanwhile.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, top=10):
+        """
+        :param top: Number of top allocators to report. If zero, no snapshots are taken.
+        :type top: int
+        """
+        self.top = top
+        self.peak_traced = 0
+        self.peak_rss = None
+        self.top_allocators = []
+        self._active = []
+        self._local = threading.local()
+        self._snapshot = None
+        self._snapshot_size = 0
+        self._started = False
+        self.pid = os.getpid()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Start tracing allocations, if they are not traced yet, and sampling the RSS."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        self._enter_traced()
+        self._update_rss()
+        if self.peak_rss is not None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        """Stop sampling and tracing and summarize the top allocators."""
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        self._update_rss()
+        self.peak_traced = self._exit_traced()[1]
+        if self._snapshot is not None:
+            statistics = self._snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                ]).statistics("lineno")
+            self.top_allocators = [{
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size": stat.size,
+                "count": stat.count,
+                } for stat in statistics[:self.top]]
+            self._snapshot = None
+        if self._started:
+            tracemalloc.stop()
+
+    def _sample(self):
+        """Sample the RSS until the tracker is stopped."""
+        while not self._stop.wait(RSS_SAMPLING_INTERVAL):
+            self._update_rss()
+
+    def _update_rss(self):
+        """Update the RSS peaks of the tracker and of all active stages."""
+        rss = current_rss()
+        if rss is None:
+            return
+        if self.peak_rss is None or rss > self.peak_rss:
+            self.peak_rss = rss
+        for record in list(self._active):
+            if record["rss"] is None or rss > record["rss"]:
+                record["rss"] = rss
+
+    def _enter_traced(self):
+        """Start measuring the peak of the traced memory of a stage in this thread."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        stack.append([current, current])
+
+    def _exit_traced(self):
+        """
+        Stop measuring the traced memory of the innermost stage in this thread.
+
+        :returns: tuple -- traced memory at the start of the stage and peak during the stage.
+        """
+        stack = self._local.stack
+        current, peak = tracemalloc.get_traced_memory()
+        start, running_peak = stack.pop()
+        peak = max(peak, running_peak, current)
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        if self.top and current > self._snapshot_size:
+            self._snapshot_size = current
+            self._snapshot = tracemalloc.take_snapshot()
+        return start, peak
+
+    @contextmanager
+    def measure(self, record):
+        """
+        Measure the memory use of a stage.
+
+        :param record: Dictionary with the keys "traced" and "rss", which are updated
+                       with the peaks of the stage if they are larger.
+        :type record: dict
+        """
+        self._active.append(record)
+        self._update_rss()
+        # The traced memory is measured last on entry and first on exit, so that
+        # the bookkeeping of the tracker does not count towards the stage
+        self._enter_traced()
+        try:
+            yield
+        finally:
+            start, peak = self._exit_traced()
+            record["traced"] = max(record["traced"], peak - start)
+            self._update_rss()
+            # Records of different stages may compare equal, remove this one
+            for index, active in enumerate(self._active):
+                if active is record:
+                    del self._active[index]
+                    break
+
+
+def _active_tracker():
+    """Return the memory tracker of this process, if memory use is being tracked."""
+    # Worker processes forked while memory use is tracked inherit the tracker of the parent
+    if _TRACKER is not None and _TRACKER.pid == os.getpid():
+        return _TRACKER
+    return None
+
+
+@contextmanager
+def tracking(top=10):
+    """
+    Track the memory use of the stages run in this process (see MemoryTracker).
+
+    If memory use is already being tracked, the current tracker is used.
+
+    :param top: Number of top allocators to report. If zero, no snapshots are taken.
+    :type top: int
+
+    :returns: MemoryTracker -- tracker, whose results are available after the context.
+    """
+    global _TRACKER  # pylint: disable=global-statement
+    if _active_tracker() is not None:
+        yield _TRACKER
+        return
+    tracker = _TRACKER = MemoryTracker(top=top)
+    tracker.start()
+    try:
+        yield tracker
+    finally:
+        _TRACKER = None
+        tracker.stop()
+
+
+def _recorded():
+    """Return the dictionaries of durations and memory peaks recorded in this thread."""
+    return getattr(_RECORDING, "timings", None), getattr(_RECORDING, "peaks", None)
+
+
+@contextmanager
+def recording(timings, peaks=None):
+    """
+    Record the durations and memory use of all stages run in this context.
+
+    :param timings: Dictionary to add the duration of each stage to, in seconds.
+                    If None, no durations are recorded.
+    :type timings: dict
+
+    :param peaks: Dictionary to record the memory peaks of each stage in, in bytes
+                  (see BuildProfile). Requires that memory use is being tracked
+                  (see tracking). If None, no memory use is recorded.
+    :type peaks: dict
+    """
+    previous = _recorded()
+    _RECORDING.timings = timings
+    _RECORDING.peaks = peaks if _active_tracker() is not None else None
+    try:
+        yield timings
+    finally:
+        _RECORDING.timings, _RECORDING.peaks = previous
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the build, if durations are being recorded (see recording),
+    and measure its memory use, if memory use is being recorded.
+
+    The duration is added to the previous durations of stages with the same name.
+    The memory peaks are the largest ones of all stages with the same name.
+
+    :param name: Name of the stage.
+    :type name: str
+    """
+    timings, peaks = _recorded()
+    if peaks is not None:
+        with _TRACKER.measure(peaks.setdefault(name, {"traced": 0, "rss": None})):
+            with _timing(name, timings):
+                yield
+    else:
+        with _timing(name, timings):
+            yield
+
+
+@contextmanager
+def _timing(name, timings):
+    """Add the duration of the context to the durations of stage name, if not None."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+class BuildProfile:
+    """
+    Report of the time and memory spent in the stages of Submission.create_files.
+
+    All durations are wall-clock times in seconds.
+    Stages run for each table are recorded separately for each table:
+
+    * "images": conversion of images, if they are converted with their table.
+    * "make_dict": conversion of the variables to dictionaries.
+    * "yaml_emission": formatting of the data file, including writing it.
+    * "fingerprint": computation of the table fingerprint in incremental builds.
+    * "cache": lookups and updates of the build cache.
+    * "copy_files": copying of additional resource files.
+
+    Stages run once per build are recorded in `stages`:
+
+    * "tables": writing all tables and the central submission file, including the
+      stages of each table. With several workers, this is less than the sum over the tables.
+    * "images": conversion of the images of all tables before they are written
+      (see build.BuildOptions.images_first).
+    * "copy_files": copying of additional resource files of the submission.
+    * "archive": writing of the tar ball.
+    * "validation": validation of the tar ball.
+
+    If memory use was profiled, `memory` and `table_memory` contain the peaks of the
+    same stages in bytes: "traced" is the peak of the memory allocated by Python during
+    the stage on top of the memory allocated when it started, and "rss" is the peak
+    resident set size of the process during the stage (None if it is not available).
+    The RSS of tables written by worker processes is the one of the worker process.
+    `peak_traced` and `peak_rss` are the peaks of the whole build in the main process,
+    and `top_allocators` lists the source lines holding the most memory at the end of
+    the stage that ended with the most allocated memory.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, memory=False):
+        """
+        :param memory: Whether memory use is profiled.
+        :type memory: bool
+        """
+        self.stages = {}
+        self.tables = []
+        self.total = 0.0
+        self.memory = {} if memory else None
+        self.table_memory = [] if memory else None
+        self.peak_traced = None
+        self.peak_rss = None
+        self.top_allocators = []
+
+    def add_table(self, name, timings, peaks=None):
+        """
+        Add the durations and memory peaks of the stages of a table.
+
+        :param name: Name of the table.
+        :type name: str
+
+        :param timings: Duration of each stage.
+        :type timings: dict
+
+        :param peaks: Memory peaks of each stage, if memory use is profiled.
+        :type peaks: dict
+        """
+        self.tables.append((name, dict(timings)))
+        if self.table_memory is not None and peaks is not None:
+            self.table_memory.append((name, {key: dict(value) for key, value in peaks.items()}))
+
+    def add_tracker(self, tracker):
+        """
+        Add the results of the memory tracker of the build.
+
+        :param tracker: Tracker of the main process.
+        :type tracker: MemoryTracker
+        """
+        self.peak_traced = tracker.peak_traced
+        self.peak_rss = tracker.peak_rss
+        self.top_allocators = list(tracker.top_allocators)
+
+    def table_totals(self):
+        """
+        Return the durations of the stages of all tables, summed over the tables.
+
+        :returns: dict -- total duration of each stage.
+        """
+        totals = {}
+        for _, timings in self.tables:
+            for name, duration in timings.items():
+                totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+    def table_peaks(self):
+        """
+        Return the memory peaks of the stages of all tables, maximized over the tables.
+
+        :returns: dict -- largest "traced" and "rss" peak of each stage, or None if
+                  memory use was not profiled.
+        """
+        if self.table_memory is None:
+            return None
+        peaks = {}
+        for _, table_peaks in self.table_memory:
+            for name, record in table_peaks.items():
+                peak = peaks.setdefault(name, {"traced": 0, "rss": None})
+                peak["traced"] = max(peak["traced"], record["traced"])
+                if record["rss"] is not None:
+                    peak["rss"] = max(peak["rss"] or 0, record["rss"])
+        return peaks
+
+    def as_dict(self):
+        """
+        Return the report as a dictionary, e.g. to log it as JSON.
+
+        :returns: dict -- with the keys "total", "stages", "table_stages"
+                  (see table_totals) and "tables", a list with the name and the
+                  durations of the stages of each table. If memory use was profiled,
+                  also with the key "memory", containing the peaks of the stages
+                  ("stages" and "table_stages", see table_peaks), the peaks of the
+                  whole build and the top allocators, and with the memory peaks of
+                  each table under the key "memory" of its entry in "tables".
+        """
+        report = {
+            "total": self.total,
+            "stages": dict(self.stages),
+            "table_stages": self.table_totals(),
+            "tables": [{"name": name, "stages": timings} for name, timings in self.tables],
+        }
+        if self.memory is not None:
+            report["memory"] = {
+                "peak_traced": self.peak_traced,
+                "peak_rss": self.peak_rss,
+                "stages": {key: dict(value) for key, value in self.memory.items()},
+                "table_stages": self.table_peaks(),
+                "top_allocators": [dict(allocator) for allocator in self.top_allocators],
+            }
+            for entry, (_, peaks) in zip(report["tables"], self.table_memory):
+                entry["memory"] = peaks
+        return report
+
+    def summary(self, max_tables=10):
+        """
+        Return a human-readable summary of the report.
+
+        :param max_tables: Number of slowest tables and, if memory use was profiled,
+                           of tables with the largest memory peaks to list.
+        :type max_tables: int
+
+        :returns: str -- summary text.
+        """
+        lines = [f"Total: {self.total:.3f} s"]
+        for name, duration in self.stages.items():
+            lines.append(f"  {name}: {duration:.3f} s")
+        totals = self.table_totals()
+        if totals:
+            lines.append(f"Summed over {len(self.tables)} tables:")
+            for name, duration in totals.items():
+                lines.append(f"  {name}: {duration:.3f} s")
+            lines.append("Slowest tables:")
+            slowest = sorted(self.tables, key=lambda table: -sum(table[1].values()))
+            for name, timings in slowest[:max_tables]:
+                stages = ", ".join(f"{key} {value:.3f} s" for key, value in timings.items())
+                lines.append(f"  {name}: {sum(timings.values()):.3f} s ({stages})")
+        if self.memory is not None:
+            lines.extend(self._memory_summary(max_tables))
+        return "\n".join(lines)
+
+    def _memory_summary(self, max_tables):
+        """Return the lines of the summary of the memory use."""
+        lines = [f"Peak traced memory: {_format_size(self.peak_traced)}, "
+                 f"peak RSS: {_format_size(self.peak_rss)}"]
+        for name, record in self.memory.items():
+            lines.append(f"  {name}: {_format_peaks(record)}")
+        peaks = self.table_peaks()
+        if peaks:
+            lines.append(f"Largest peaks over {len(self.table_memory)} tables:")
+            for name, record in peaks.items():
+                lines.append(f"  {name}: {_format_peaks(record)}")
+            lines.append("Tables with the largest peaks:")
+            largest = sorted(self.table_memory, key=lambda table: -max(
+                record["traced"] for record in table[1].values()) if table[1] else 0)
+            for name, table_peaks in largest[:max_tables]:
+                stages = ", ".join(f"{key} {_format_size(record['traced'])}"
+                                   for key, record in table_peaks.items())
+                lines.append(f"  {name}: {stages}")
+        if self.top_allocators:
+            lines.append("Top allocators:")
+            for allocator in self.top_allocators:
+                lines.append(f"  {allocator['location']}: {_format_size(allocator['size'])} "
+                             f"in {allocator['count']} blocks")
+        return lines
+
+    def print_summary(self, max_tables=10):
+        """Print the summary of the report (see summary)."""
+        print(self.summary(max_tables=max_tables))
+
+
+def _format_size(size):
+    """Format a size in bytes for the summary of a report."""
+    if size is None:
+        return "n/a"
+    return f"{size / (1 << 20):.1f} MiB"
+
+
+def _format_peaks(record):
+    """Format the memory peaks of a stage for the summary of a report."""
+    return f"traced {_format_size(record['traced'])}, RSS {_format_size(record['rss'])}"
@@ -0,0 +1,239 @@
+"""Backends converting images to full-size PNG files and thumbnails."""
+
+import abc
+import inspect
+import shutil
+import threading
+from functools import reduce
+
+from hepdata_lib import helpers
+
+try:
+    import pymupdf
+except ImportError:  # pragma: no cover
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None  # pylint: disable=invalid-name
+try:
+    from PIL import Image, ImageChops, __version__ as pillow_version
+except ImportError:  # pragma: no cover
+    Image = ImageChops = pillow_version = None  # pylint: disable=invalid-name
+
+#: Resolution at which PDF files are rasterized, in dots per inch.
+DENSITY = 300
+
+#: Size of the box that thumbnails fit in, in pixels.
+THUMBNAIL_SIZE = (240, 179)
+
+#: Fraction of the colour range within which border pixels are trimmed.
+TRIM_FUZZ = 0.01
+
+# Rasterizer classes by name, in order of preference
+_RASTERIZERS = {}
+
+
+class Rasterizer(abc.ABC):
+    """
+    Interface of the backends converting images to PNG files and thumbnails.
+
+    A backend converts the source image to a full-size PNG file, flattened on a
+    white background and trimmed of uniform borders, and makes a thumbnail that
+    fits in 240x179 pixels.
+    """
+
+    #: Name under which the backend can be selected (see get_rasterizer).
+    name = None
+
+    #: Whether conversions can run in several threads of the same process.
+    #: Otherwise, concurrent conversions run in separate processes.
+    thread_safe = True
+
+    #: Whether the backend is only used if it is selected explicitly.
+    #: Otherwise, it is preferred over ImageMagick if it is available (see get_rasterizer).
+    opt_in = False
+
+    @classmethod
+    def is_available(cls):
+        """Return whether the dependencies of the backend are available."""
+        return True
+
+    def fingerprint(self):
+        """
+        Return a description of the conversion, which identifies its output
+        in caches of converted images (see cache.ImageCache).
+
+        :returns: str -- name of the backend and conversion parameters.
+        """
+        return (f"{self.name} density={DENSITY} fuzz={TRIM_FUZZ} "
+                f"thumbnail={THUMBNAIL_SIZE[0]}x{THUMBNAIL_SIZE[1]}")
+
+    @abc.abstractmethod
+    def convert(self, source, target, thumbnail_target):
+        """
+        Convert an image to a full-size PNG file and its thumbnail.
+
+        The thumbnail is written after the full-size PNG file.
+
+        :param source: Source image file, e.g. in PDF format.
+        :type source: str
+        :param target: Output file in PNG format.
+        :type target: str
+        :param thumbnail_target: Output thumbnail file in PNG format.
+        :type thumbnail_target: str
+        """
+
+    @abc.abstractmethod
+    def make_thumbnail(self, source, target):
+        """
+        Make the thumbnail of a full-size PNG file.
+
+        :param source: Source file in PNG format.
+        :type source: str
+        :param target: Output thumbnail file in PNG format.
+        :type target: str
+        """
+
+
+def register_rasterizer(rasterizer_class):
+    """
+    Register a backend, so that it can be selected by its name.
+
+    Registered backends are preferred over the ImageMagick fallback in the order
+    of their registration, unless they are opt-in. Can be used as a class decorator.
+
+    :param rasterizer_class: Subclass of Rasterizer with a name.
+    :type rasterizer_class: type
+
+    :returns: type -- the registered class.
+    """
+    if not rasterizer_class.name:
+        raise ValueError("Rasterizer backends need a name.")
+    if inspect.isabstract(rasterizer_class):
+        missing = ", ".join(sorted(rasterizer_class.__abstractmethods__))
+        raise TypeError(f"Rasterizer backend {rasterizer_class.name} does not implement {missing}.")
+    _RASTERIZERS[rasterizer_class.name] = rasterizer_class
+    return rasterizer_class
+
+
+@register_rasterizer
+class PyMuPDFRasterizer(Rasterizer):
+    """
+    In-process backend rendering PDF files with PyMuPDF and other images with Pillow.
+
+    Pillow trims and resizes the images and writes the PNG files.
+    Requires the PyMuPDF and Pillow packages.
+
+    PyMuPDF is distributed under the AGPL, unlike hepdata_lib, so the backend
+    is only used if it is selected explicitly by its name.
+    """
+
+    name = "pymupdf"
+    opt_in = True
+
+    # PyMuPDF does not support concurrent use from several threads
+    thread_safe = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def is_available(cls):
+        return pymupdf is not None and Image is not None
+
+    def fingerprint(self):
+        # The output depends on the versions of the renderer and of the resampling
+        pymupdf_version = getattr(pymupdf, "__version__", getattr(pymupdf, "VersionBind", ""))
+        return f"{super().fingerprint()} pymupdf={pymupdf_version} pillow={pillow_version}"
+
+    def _render(self, source):
+        """Render an image, flattened on a white background."""
+        with open(source, "rb") as source_file:
+            is_pdf = source_file.read(5) == b"%PDF-"
+        if not is_pdf:
+            with Image.open(source) as image:
+                pages = [image.convert("RGBA")]
+        else:
+            with self._lock, pymupdf.open(source) as document:
+                pages = []
+                for page in document:
+                    pixmap = page.get_pixmap(dpi=DENSITY, alpha=True)
+                    pages.append(Image.frombytes("RGBA", (pixmap.width, pixmap.height),
+                                                 pixmap.samples))
+        # Like ImageMagick's -flatten, all pages are merged onto the canvas of the first one
+        canvas = Image.new("RGBA", pages[0].size, (255, 255, 255, 255))
+        for page in pages:
+            canvas.alpha_composite(page.crop((0, 0) + canvas.size))
+        return canvas.convert("RGB")
+
+    @staticmethod
+    def _trim(image):
+        """Remove the borders with the colour of the top left pixel."""
+        background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+        difference = reduce(ImageChops.lighter, ImageChops.difference(image, background).split())
+        box = difference.point(lambda value: 255 if value > TRIM_FUZZ * 255 else 0).getbbox()
+        return image.crop(box) if box else image
+
+    @staticmethod
+    def _save_thumbnail(image, target):
+        """Resize an image to fit in the thumbnail size and save it."""
+        scale = min(THUMBNAIL_SIZE[0] / image.width, THUMBNAIL_SIZE[1] / image.height)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image.resize(size, Image.LANCZOS).save(target, format="PNG")
+
+    def convert(self, source, target, thumbnail_target):
+        image = self._trim(self._render(source))
+        image.save(target, format="PNG")
+        self._save_thumbnail(image, thumbnail_target)
+
+    def make_thumbnail(self, source, target):
+        with Image.open(source) as image:
+            self._save_thumbnail(image.convert("RGB"), target)
+
+
+@register_rasterizer
+class ImageMagickRasterizer(Rasterizer):
+    """
+    Backend running the ImageMagick convert utility in a separate process for each image.
+
+    Used by default, unless another registered backend is available and not opt-in.
+    """
+
+    name = "imagemagick"
+
+    @classmethod
+    def is_available(cls):
+        return shutil.which("convert") is not None
+
+    def convert(self, source, target, thumbnail_target):
+        helpers.convert_pdf_to_png_and_thumbnail(source, target, thumbnail_target)
+
+    def make_thumbnail(self, source, target):
+        helpers.convert_png_to_thumbnail(source, target)
+
+
+def get_rasterizer(rasterizer=None):
+    """
+    Return a rasterizer backend.
+
+    :param rasterizer: Backend instance, which is returned as it is, or name of a
+                       registered backend (see register_rasterizer). If None, the first
+                       available registered backend that is not opt-in is used, and
+                       ImageMagick otherwise. The PyMuPDF backend is opt-in.
+    :type rasterizer: Rasterizer or str
+
+    :returns: Rasterizer -- backend instance.
+    """
+    if isinstance(rasterizer, Rasterizer):
+        return rasterizer
+    if rasterizer is None:
+        for rasterizer_class in _RASTERIZERS.values():
+            if rasterizer_class is not ImageMagickRasterizer and not rasterizer_class.opt_in \
+                    and rasterizer_class.is_available():
+                return rasterizer_class()
+        return ImageMagickRasterizer()
+    if rasterizer not in _RASTERIZERS:
+        raise ValueError(f"Unknown rasterizer: '{rasterizer}'. "
+                         f"Expected one of: {', '.join(_RASTERIZERS)}.")
+    rasterizer_class = _RASTERIZERS[rasterizer]
+    if not rasterizer_class.is_available():
+        raise RuntimeError(f"The dependencies of the rasterizer '{rasterizer}' are not installed.")
+    return rasterizer_class()
@@ -0,0 +1,208 @@
+"""Streaming YAML emitter for hepdata_lib tables."""
+
+from operator import itemgetter
+import yaml
+from hepdata_lib.helpers import ERROR_SYMMETRIC, ERROR_ASYMMETRIC, column_to_list
+
+#: Number of bins that are formatted before being written to the output stream.
+DEFAULT_CHUNK_SIZE = 10000
+
+# Minimal documents placing a scalar at the same position (column and indentation)
+# as the corresponding key in a table data file.
+_SCALAR_CONTEXTS = {
+    "value": lambda x: [{"values": [{"value": x}]}],
+    "low": lambda x: [{"values": [{"low": x}]}],
+    "high": lambda x: [{"values": [{"high": x}]}],
+    "label": lambda x: [{"values": [{"errors": [{"label": x}]}]}],
+    "symerror": lambda x: [{"values": [{"errors": [{"symerror": x}]}]}],
+    "minus": lambda x: [{"values": [{"errors": [{"asymerror": {"minus": x}}]}]}],
+    "plus": lambda x: [{"values": [{"errors": [{"asymerror": {"plus": x}}]}]}],
+}
+
+# Line replaced by the values of each variable in the dump of the table meta data.
+_VALUES_PLACEHOLDER = "\n  values: []\n"
+
+_INF = float("inf")
+
+
+def format_float(value):
+    """
+    Format a float the same way as the YAML SafeRepresenter does.
+
+    :param value: Value to format.
+    :type value: float
+    """
+    if value != value: # pylint: disable=comparison-with-itself
+        return ".nan"
+    if value == _INF:
+        return ".inf"
+    if value == -_INF:
+        return "-.inf"
+    text = repr(value).lower()
+    if "." not in text and "e" in text:
+        text = text.replace("e", ".0e", 1)
+    return text
+
+
+class ScalarFormatter:
+    # pylint: disable=too-few-public-methods
+    """
+    Format scalars exactly like a YAML dumper does at a given position of a table data file.
+
+    Python floats and integers are formatted directly.
+    All other scalars (e.g. strings) are rendered by the dumper itself
+    at the same position as in the data file, and the result is cached.
+    """
+
+    def __init__(self, dumper):
+        self.dumper = dumper
+        self._prefixes = {}
+        self._cache = {}
+
+    def _render(self, context, value):
+        """Render a scalar in the given context using the YAML dumper."""
+        document = _SCALAR_CONTEXTS[context]
+        if context not in self._prefixes:
+            # Everything in front of a plain one-character scalar
+            placeholder = yaml.dump(document("x"), Dumper=self.dumper, default_flow_style=False)
+            self._prefixes[context] = placeholder[:-2]
+        prefix = self._prefixes[context]
+        text = yaml.dump(document(value), Dumper=self.dumper, default_flow_style=False)
+        if not text.startswith(prefix):
+            raise RuntimeError(f"Unexpected YAML output for scalar '{value}'.")
+        return text[len(prefix):-1]
+
+    def __call__(self, context, value):
+        """
+        Return the YAML representation of a scalar.
+
+        :param context: Key of the scalar in the data file, e.g. "value" or "label".
+        :type context: string
+
+        :param value: Scalar to format.
+        """
+        # pylint: disable=unidiomatic-typecheck
+        if type(value) is float:
+            return format_float(value)
+        if type(value) is int:
+            return str(value)
+        try:
+            key = (context, type(value), value)
+            if key not in self._cache:
+                self._cache[key] = self._render(context, value)
+            return self._cache[key]
+        except TypeError:
+            # Unhashable value
+            return self._render(context, value)
+
+
+def format_chunk(columns, fmt):
+    """
+    Format the "values" entries of a range of bins.
+
+    :param columns: Rounded values and uncertainties as returned by Variable.make_columns.
+    :type columns: dict
+
+    :param fmt: Scalar formatter.
+    :type fmt: ScalarFormatter
+    """
+    # Keys are sorted, i.e. "errors" come first and "high" before "low"
+    fields = [(key, column_to_list(column))
+              for key, column in sorted(columns["fields"], key=itemgetter(0))]
+    errors = [
+        (
+            fmt("label", error["label"]),
+            error["kinds"].tolist(),
+            column_to_list(error["symerror"]),
+            column_to_list(error["minus"]) if "minus" in error else None,
+            column_to_list(error["plus"]) if "plus" in error else None
+        ) for error in columns["errors"]
+        ]
+
+    lines = []
+    for i, nonzero in enumerate(columns["nonzero"].tolist()):
+        prefix = "  - "
+        if nonzero:
+            lines.append("  - errors:\n")
+            for label, kinds, symerror, minus, plus in errors:
+                if kinds[i] == ERROR_SYMMETRIC:
+                    lines.append(f"    - label: {label}\n"
+                                 f"      symerror: {fmt('symerror', symerror[i])}\n")
+                elif kinds[i] == ERROR_ASYMMETRIC:
+                    lines.append("    - asymerror:\n"
+                                 f"        minus: {fmt('minus', minus[i])}\n"
+                                 f"        plus: {fmt('plus', plus[i])}\n"
+                                 f"      label: {label}\n")
+            prefix = "    "
+        for key, column in fields:
+            lines.append(f"{prefix}{key}: {fmt(key, column[i])}\n")
+            prefix = "    "
+    return "".join(lines)
+
+
+def emit_values(variable, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write the "values" entry of a variable to a stream.
+
+    The rounded values and uncertainties are computed and written chunk by chunk.
+
+    :param variable: Variable to write.
+    :type variable: Variable
+
+    :param stream: Text stream to write to.
+
+    :param fmt: Scalar formatter.
+    :type fmt: ScalarFormatter
+
+    :param chunk_size: Number of bins formatted before writing to the stream.
+    :type chunk_size: int
+    """
+    nbins = len(variable.values_column)
+    if not nbins:
+        stream.write("  values: []\n")
+        return
+    stream.write("  values:\n")
+    for start in range(0, nbins, chunk_size):
+        stream.write(format_chunk(variable.make_columns(start, start + chunk_size), fmt))
+
+
+def emit_table(table, stream, dumper, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write the data file of a table to a stream.
+
+    The output is identical to dumping the table with the given YAML dumper
+    as done in Table.write_yaml, but the values are formatted directly from
+    the Variable and Uncertainty objects without building intermediate dictionaries.
+
+    :param table: Table to write.
+    :type table: Table
+
+    :param stream: Text stream to write to.
+
+    :param dumper: YAML dumper class used for the table meta data and non-numeric scalars.
+
+    :param chunk_size: Number of bins formatted before writing to the stream.
+    :type chunk_size: int
+    """
+    # Keys of the data file are sorted, i.e. dependent variables come first
+    dependent = [var for var in table.variables if not var.is_independent]
+    independent = [var for var in table.variables if var.is_independent]
+
+    # Dump the meta data of all variables in one go, so that anchors and aliases
+    # for shared objects are identical to the reference output
+    skeleton = {"dependent_variables": [], "independent_variables": []}
+    for key, variables in (("dependent_variables", dependent),
+                           ("independent_variables", independent)):
+        for var in variables:
+            header = var.make_header_dict()
+            header["values"] = []
+            skeleton[key].append(header)
+    parts = yaml.dump(skeleton, Dumper=dumper, default_flow_style=False).split(_VALUES_PLACEHOLDER)
+    if len(parts) != len(dependent) + len(independent) + 1:
+        raise RuntimeError(f"Failed to split the meta data of table '{table.name}'.")
+
+    fmt = ScalarFormatter(dumper)
+    for part, var in zip(parts, dependent + independent):
+        stream.write(part + "\n")
+        emit_values(var, stream, fmt, chunk_size)
+    stream.write(parts[-1])
@@ -43,6 +43,10 @@ setup(
     python_requires='>=3.6',
     install_requires=DEPS,
     extras_require={
+        'images': [
+            'PyMuPDF',
+            'Pillow',
+        ],
         'test': [
             'ipykernel',
             'papermill',
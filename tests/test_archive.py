@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Test the writing of archives."""
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest import TestCase
+from hepdata_lib.archive import ArchiveWriter, ParallelGzipFile
+
+
+class TestArchive(TestCase):
+    """Test ArchiveWriter and ParallelGzipFile."""
+
+    def test_parallel_gzip(self):
+        """Test that parallel compression gives valid gzip data independent of the threads."""
+        data = b"".join(f"{i}: {i * 0.37:.5f}\n".encode() for i in range(20000))
+        outputs = []
+        for threads in (1, 3):
+            for level in (0, 1, 9):
+                stream = io.BytesIO()
+                compressed = ParallelGzipFile(stream, compresslevel=level, threads=threads,
+                                              mtime=0, block_size=4096)
+                compressed.write(data[:1000])
+                compressed.write(data[1000:])
+                self.assertEqual(compressed.tell(), len(data))
+                compressed.close()
+                self.assertEqual(gzip.decompress(stream.getvalue()), data)
+                outputs.append(stream.getvalue())
+        self.assertEqual(outputs[:3], outputs[3:])
+
+        with self.assertRaises(ValueError):
+            ParallelGzipFile(io.BytesIO(), compresslevel=10)
+
+    def test_compression_options(self):
+        """Test that all compression options give the same archive content."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        contents = []
+        for i, options in enumerate(({}, {"compresslevel": 0}, {"threads": 2},
+                                     {"threads": 2, "reproducible": True})):
+            path = os.path.join(tmpdir, f"archive{i}.tar.gz")
+            with ArchiveWriter(path, **options) as writer:
+                writer.add_text("b.yaml", "b: 1\n" * 1000)
+                writer.add_text("a.yaml", "a: 2\n")
+            with tarfile.open(path, "r:gz") as tar:
+                contents.append({member.name: tar.extractfile(member).read()
+                                 for member in tar.getmembers()})
+        for content in contents[1:]:
+            self.assertEqual(content, contents[0])
+
+        with self.assertRaises(ValueError):
+            ArchiveWriter(os.path.join(tmpdir, "invalid.tar.gz"), compresslevel=-1)
+
+    def test_reproducible_spill(self):
+        """Test that in-memory files of reproducible archives are kept on disk until closing."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "archive.tar.gz")
+        with ArchiveWriter(path, reproducible=True) as writer:
+            writer.add_text("b.yaml", "b: 1\n")
+            writer.add_text("a.yaml", "a: 2\n")
+            writer.add_text("b.yaml", "b: 3\n")
+            spill_dir = writer._spill_dir  # pylint: disable=protected-access
+            self.assertEqual(len(os.listdir(spill_dir)), 3)
+        self.assertFalse(os.path.exists(spill_dir))
+        with tarfile.open(path, "r:gz") as tar:
+            members = tar.getmembers()
+            self.assertEqual([member.name for member in members], ["a.yaml", "b.yaml"])
+            self.assertEqual(tar.extractfile(members[1]).read(), b"b: 3\n")
+            self.assertEqual({(member.mode, member.uid, member.uname) for member in members},
+                             {(0o644, 0, "")})
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""Test BuildCache and ImageCache."""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from hepdata_lib import Submission, Table
+from hepdata_lib.cache import BuildCache, ImageCache
+from .test_rasterizers import CopyRasterizer
+
+
+class TestBuildCache(TestCase):
+    """Test the BuildCache class."""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "cache")
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+
+    def test_get_put(self):
+        """Test storing and retrieving entries."""
+        cache = BuildCache(self.path)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "values: [1, 2]\n")
+        self.assertEqual(cache.get("a"), "values: [1, 2]\n")
+        cache.put("a", "values: [μ]\n")
+        self.assertEqual(cache.get("a"), "values: [μ]\n")
+        self.assertEqual(cache.size, len("values: [μ]\n".encode("utf-8")))
+        self.assertEqual(os.listdir(self.path), ["a.yaml"])
+
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+        with self.assertRaises(ValueError):
+            BuildCache(self.path, max_size=-1)
+
+    def test_eviction(self):
+        """Test that the least recently used entries are evicted."""
+        cache = BuildCache(self.path, max_size=25)
+        for i, key in enumerate("abc"):
+            cache.put(key, "x" * 10)
+            os.utime(os.path.join(self.path, key + ".yaml"), (i, i))
+        # Adding the third entry evicted the first one
+        self.assertEqual(sorted(os.listdir(self.path)), ["b.yaml", "c.yaml"])
+
+        # Accessing an entry makes it the most recently used one
+        self.assertIsNotNone(cache.get("b"))
+        cache.put("d", "x" * 10)
+        self.assertEqual(sorted(os.listdir(self.path)), ["b.yaml", "d.yaml"])
+        self.assertLessEqual(cache.size, 25)
+
+
+class TestImageCache(TestCase):
+    """Test the ImageCache class."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "cache")
+        self.source = os.path.join(self.tmpdir, "figure.pdf")
+        with open(self.source, "wb") as source:
+            source.write(b"%PDF-1.4 figure")
+
+    def write(self, name, content):
+        """Write a file in the temporary directory and return its path."""
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as output:
+            output.write(content)
+        return path
+
+    def read(self, name):
+        """Return the content of a file in the temporary directory."""
+        with open(os.path.join(self.tmpdir, name), "rb") as output:
+            return output.read()
+
+    def test_key(self):
+        """Test that keys depend on the source content and the parameters."""
+        key = ImageCache.key(self.source, "density=300")
+        self.assertEqual(key, ImageCache.key(self.source, "density=300"))
+        self.assertNotEqual(key, ImageCache.key(self.source, "density=150"))
+        self.write("figure.pdf", b"%PDF-1.4 other figure")
+        self.assertNotEqual(key, ImageCache.key(self.source, "density=300"))
+
+    def test_fetch_store(self):
+        """Test storing entries and linking or copying them to their targets."""
+        for link in (True, False):
+            cache = ImageCache(self.path, link=link)
+            targets = [os.path.join(self.tmpdir, name) for name in ("out.png", "thumb.png")]
+            self.assertFalse(cache.fetch("a", *targets))
+            self.assertFalse(any(os.path.exists(target) for target in targets))
+
+            cache.store("a", self.write("png", b"image"), self.write("thumb", b"thumbnail"))
+            self.write("out.png", b"outdated")
+            self.assertTrue(cache.fetch("a", *targets))
+            self.assertEqual(self.read("out.png"), b"image")
+            self.assertEqual(self.read("thumb.png"), b"thumbnail")
+            self.assertEqual(os.path.samefile(targets[0], os.path.join(self.path, "a-0.png")),
+                             link)
+            self.assertLessEqual(os.path.getmtime(targets[0]), os.path.getmtime(targets[1]))
+
+            # Entries are only used if all their files are cached
+            os.remove(os.path.join(self.path, "a-1.png"))
+            self.assertFalse(cache.fetch("a", *targets))
+            cache.clear()
+            self.assertEqual(cache.size, 0)
+            for target in targets:
+                os.remove(target)
+
+    def test_create_files(self):
+        """Test that cached images are not converted again by later builds."""
+        rasterizer = CopyRasterizer()
+        for ibuild in range(3):
+            test_submission = Submission()
+            test_submission.set_image_cache(self.path)
+            table = Table("Some Table")
+            table.add_image(self.source)
+            test_submission.add_table(table)
+            outdir = os.path.join(self.tmpdir, "output")
+            test_submission.create_files(outdir, validate=False, remove_old=True,
+                                         rasterizer=rasterizer)
+            os.remove("submission.tar.gz")
+            self.assertEqual(sorted(os.listdir(outdir)),
+                             ["figure.png", "some_table.yaml", "submission.yaml",
+                              "thumb_figure.png"])
+            self.assertEqual(self.read("output/thumb_figure.png"), self.read("figure.pdf"))
+            self.assertEqual(len(rasterizer.calls), 1 if ibuild < 2 else 2)
+            # Changing the source gives a new entry
+            if ibuild == 1:
+                self.write("figure.pdf", b"%PDF-1.4 changed figure")
+        self.assertEqual(len(os.listdir(self.path)), 4)
+
+    def test_linked_outputs(self):
+        """Test that builds without the cache do not write through links to cache entries."""
+        rasterizer = CopyRasterizer()
+        key = ImageCache.key(self.source, rasterizer.fingerprint())
+        table = Table("Some Table")
+        table.add_image(self.source)
+        # Convert into a first directory, link the cached files into a second one,
+        # then convert a changed source into the second directory without the cache
+        for outdir, cache in (("out1", ImageCache(self.path)), ("out2", ImageCache(self.path)),
+                              ("out2", None)):
+            if cache is None:
+                self.write("figure.pdf", b"%PDF-1.4 changed figure")
+                later = os.path.getmtime(os.path.join(self.path, f"{key}-0.png")) + 100
+                os.utime(self.source, (later, later))
+            table.write_images(os.path.join(self.tmpdir, outdir), rasterizer=rasterizer,
+                               cache=cache)
+        self.assertEqual(len(rasterizer.calls), 2)
+        self.assertEqual(self.read("out2/figure.png"), b"%PDF-1.4 changed figure")
+        for name in (f"cache/{key}-0.png", f"cache/{key}-1.png", "out1/figure.png"):
+            self.assertEqual(self.read(name), b"%PDF-1.4 figure")
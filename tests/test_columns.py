@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""Test Column."""
+import hashlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+from hepdata_lib import Table, Variable, Uncertainty, helpers
+from hepdata_lib.columns import Column
+
+
+class TestColumn(TestCase):
+    """Test the Column class."""
+
+    def test_roundtrip(self):
+        """Test that values are returned as they were sanitized."""
+        values = [1.5, 2, "-", None, np.float32(0.25), True, 2 ** 60, "-", -0.0]
+        column = Column.from_values(values)
+        self.assertEqual(column.tolist(), [helpers.sanitize_value(x) for x in values])
+        self.assertEqual([type(x) for x in column.tolist()],
+                         [type(helpers.sanitize_value(x)) for x in values])
+        # Repeated strings are only stored once
+        self.assertEqual(column.categories.count("-"), 1)
+
+        pairs = [(0, 1.5), ("a", "b"), (None, 2.5), (np.int64(3), 4)]
+        column = Column.from_values(pairs, pairs=True)
+        self.assertEqual(column.tolist(), [(0, 1.5), ("a", "b"), (None, 2.5), (3.0, 4)])
+        self.assertEqual(column.component(0).tolist(), [0, "a", None, 3.0])
+        self.assertEqual(column.component(0).valid.tolist(), [True, True, False, True])
+
+    def test_float_only(self):
+        """Test that columns of floats do not allocate additional arrays."""
+        column = Column.from_values(np.arange(10, dtype=np.int32))
+        self.assertTrue(column.is_float_only)
+        self.assertEqual(column.nbytes, 80)
+        self.assertEqual(column.tolist(), [float(x) for x in range(10)])
+
+        column = Column.from_values([float(x) for x in range(10)])
+        self.assertTrue(column.is_float_only)
+        self.assertEqual(column.nbytes, 80)
+
+        edges = np.array([(0, 1), (1, 2)], dtype="f,f")
+        column = Column.from_values(edges, pairs=True)
+        self.assertTrue(column.is_float_only)
+        self.assertEqual(column.tolist(), [(0.0, 1.0), (1.0, 2.0)])
+
+    def test_immutable(self):
+        """Test that columns do not share memory with their input."""
+        values = np.array([1.0, 2.0])
+        column = Column.from_values(values)
+        values[0] = 5
+        self.assertEqual(column.tolist(), [1.0, 2.0])
+        with self.assertRaises(ValueError):
+            column.numbers[0] = 5
+
+    def test_slicing(self):
+        """Test slicing of columns."""
+        column = Column.from_values([1, "a", None, 2.5])
+        self.assertEqual(column[1:].tolist(), ["a", None, 2.5])
+        self.assertEqual(len(column[:2]), 2)
+        with self.assertRaises(TypeError):
+            _ = column[0]
+
+    def test_malformed(self):
+        """Test that malformed input raises an error."""
+        with self.assertRaises(ValueError):
+            Column.from_values([(1, 2, 3)], pairs=True)
+        with self.assertRaises(ValueError):
+            Column.from_values([None], pairs=True)
+        with self.assertRaises(ValueError):
+            Column.from_values(np.zeros((3, 3)), pairs=True)
+        with self.assertRaises(ValueError):
+            Column.from_values(np.zeros((3, 2)))
+        with self.assertRaises(TypeError):
+            Column.from_values([(1, 2)])
+
+    def test_scaled(self):
+        """Test that scaling gives the same results as scaling each value."""
+        for values in ([1.5, 2.5], [1, 2.5, -3], [(1, 2.5), (3.5, 4)]):
+            column = Column.from_values(values, pairs=isinstance(values[0], tuple))
+            for factor in (2, 0.1):
+                expected = [tuple(factor * y for y in x) if isinstance(x, tuple) else factor * x
+                            for x in values]
+                self.assertEqual(column.scaled(factor).tolist(), expected)
+
+    def test_relative_round(self):
+        """Test that rounding is identical to helpers.relative_round."""
+        values = [1.23456789, 12345678, "text", None, 0, 9.999999e-10, 12345.678]
+        rounded = helpers.column_to_list(Column.from_values(values).relative_round(3))
+        self.assertEqual(rounded, [1.23, 12300000, "text", None, 0, 1e-09, 12300.0])
+        self.assertEqual(rounded, [None if value is None else helpers.relative_round(value, 3)
+                                   for value in values])
+        self.assertEqual([type(x) for x in rounded], [float, int, str, type(None), int,
+                                                      float, float])
+
+    def test_nonzero(self):
+        """Test the detection of nonzero entries."""
+        column = Column.from_values([0, 0.0, "", "0", "1e-3", 2.5, None])
+        self.assertEqual(column.nonzero().tolist(),
+                         [False, False, False, False, True, True, False])
+        self.assertEqual(Column.from_values([-0.5, np.nan]).nonzero().tolist(), [True, True])
+        with self.assertRaises(ValueError):
+            Column.from_values(["not a number"]).nonzero()
+        column = Column.from_values([(0, 0), (0, 1), (None, 0), (None, 1)], pairs=True)
+        self.assertEqual(column.nonzero().tolist(), [False, True, False, True])
+
+    def test_variable_storage(self):
+        """Test that Variable stores its values in a column."""
+        var = Variable("x", is_binned=True, values=np.array([[0, 1], [1, 2]]))
+        self.assertIsInstance(var.values_column, Column)
+        self.assertEqual(var.values, [(0.0, 1.0), (1.0, 2.0)])
+        var = Variable("y", is_binned=False, values=np.array([]))
+        self.assertEqual(var.values, [])
+        with self.assertRaises(ValueError):
+            Variable("z", is_binned=True, values=np.array([1, 2]))
+
+    def test_uncertainty_storage(self):
+        """Test that Uncertainty stores its values in a column."""
+        unc = Uncertainty("sys", is_symmetric=False)
+        unc.values = np.array([[-1, 2], [-0.5, 0.5]])
+        self.assertIsInstance(unc.values_column, Column)
+        self.assertTrue(unc.values_column.is_float_only)
+        self.assertEqual(unc.values, [(-1.0, 2.0), (-0.5, 0.5)])
+        unc.scale_values(2)
+        self.assertEqual(unc.values, [(-2.0, 4.0), (-1.0, 1.0)])
+
+        unc.set_values_from_intervals(np.array([[0.5, 2.0]]), np.array([1.0]))
+        self.assertEqual(unc.values, [(-0.5, 1.0)])
+
+        unc = Uncertainty("stat")
+        unc.values = [0.1, None]
+        self.assertEqual(unc.values_column.valid.tolist(), [True, False])
+        self.assertEqual(unc.values, [0.1, None])
+
+    def map_array(self, array):
+        """Save an array to a temporary .npy file and map it into memory."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        np.save(os.path.join(tmpdir, "array.npy"), array)
+        return np.load(os.path.join(tmpdir, "array.npy"), mmap_mode="r")
+
+    def test_memory_mapped(self):
+        """Test that memory-mapped arrays are used without copying them."""
+        values = np.linspace(0, 1, 1000)
+        mapped_values = self.map_array(values)
+        column = Column.from_values(mapped_values)
+        self.assertTrue(column.is_memory_mapped)
+        self.assertTrue(np.shares_memory(column.numbers, mapped_values))
+        self.assertFalse(Column.from_values(values).is_memory_mapped)
+
+        # Pickled columns map the file again
+        mapped_edges = self.map_array(np.stack((values, values + 1), axis=-1))
+        for original in (column, column[100:200], Column.from_values(mapped_edges, pairs=True)):
+            pickled = pickle.dumps(original)
+            self.assertLess(len(pickled), 1000)
+            copy = pickle.loads(pickled)
+            self.assertTrue(copy.is_memory_mapped)
+            self.assertEqual(copy.tolist(), original.tolist())
+
+        hashes = []
+        for column in (Column.from_values(values), Column.from_values(mapped_values)):
+            hasher = hashlib.sha256()
+            column.update_hash(hasher)
+            hashes.append(hasher.hexdigest())
+        self.assertEqual(hashes[0], hashes[1])
+
+    def test_memory_mapped_table(self):
+        """Test that memory-mapped variables give the same data file."""
+        values = np.linspace(0, 1, 1000)
+        edges = np.stack((np.arange(1000.), np.arange(1., 1001.)), axis=-1)
+        outputs = []
+        for mapped in (False, True):
+            table = Table("Table")
+            table.add_variable(Variable("x", values=self.map_array(edges) if mapped else edges))
+            y_values = self.map_array(values) if mapped else values
+            y = Variable("y", is_independent=False, is_binned=False, values=y_values)
+            unc = Uncertainty("stat")
+            unc.values = y_values
+            y.add_uncertainty(unc)
+            table.add_variable(y)
+            self.assertEqual(y.is_memory_mapped, mapped)
+            for streaming in (False, True):
+                stream = io.StringIO()
+                table.dump_yaml(stream, streaming=streaming)
+                outputs.append(stream.getvalue())
+        self.assertEqual(len(set(outputs)), 1)
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 """Test helpers."""
+import os
+import shutil
+import tempfile
+import warnings
 from unittest import TestCase
 
 import numpy as np
 
 from hepdata_lib.helpers import relative_round
+from hepdata_lib.helpers import relative_round_array
 from hepdata_lib.helpers import round_multiple
 from hepdata_lib.helpers import get_number_precision
 from hepdata_lib.helpers import get_number_size
@@ -14,6 +19,9 @@ from hepdata_lib.helpers import round_value_and_uncertainty_arrs
 from hepdata_lib.helpers import round_value_and_multiple_uncertainties_arrs
 from hepdata_lib.helpers import round_value_and_uncertainty
 from hepdata_lib.helpers import file_is_outdated
+from hepdata_lib.helpers import record_file_source
+from hepdata_lib.helpers import split_ranges
+from hepdata_lib.columns import Column
 
 
 class TestHelpers(TestCase):
@@ -41,6 +49,44 @@ class TestHelpers(TestCase):
             self.assertTrue(rounded == result)
 
 
+    def test_relative_round_array(self):
+        '''Test that vectorized rounding is identical to relative_round'''
+        rng = np.random.default_rng(1)
+        values = np.concatenate([
+            rng.uniform(-1, 1, 10000) * 10.0 ** rng.integers(-30, 30, 10000),
+            np.round(rng.uniform(0, 100, 10000), 3),
+            np.arange(-100, 100) + 0.5,
+            10.0 ** np.arange(-30, 30),
+            [0.0, -0.0, 2.675, 1.005, 0.125, -2.5e-7, np.inf, -np.inf, np.nan]
+        ])
+        for digits in [1, 2, 5, 17]:
+            rounded = relative_round_array(values, digits)
+            for value, result in zip(values.tolist(), rounded.tolist()):
+                expected = relative_round(value, digits)
+                if np.isnan(expected):
+                    self.assertTrue(np.isnan(result))
+                else:
+                    self.assertEqual(result, expected)
+                    self.assertEqual(np.signbit(result), np.signbit(expected))
+
+    def test_relative_round_array_extremes(self):
+        '''Test that extreme values are rounded without floating point warnings'''
+        values = [1e300, 1.5, -1.7e308, 1e-300, 5e-324]
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            rounded = relative_round_array(values, 2)
+        self.assertEqual(rounded.tolist(), [relative_round(value, 2) for value in values])
+
+    def test_split_ranges(self):
+        '''Test division of rows into ranges'''
+        column = Column.from_values([1, 1, 1, 2, 2, 3, 4, 4, 4, 4, 4])
+        self.assertEqual(split_ranges(column, 5), [(0, 5), (5, 6), (6, 11)])
+        self.assertEqual(split_ranges(column, 4), [(0, 3), (3, 6), (6, 10), (10, 11)])
+        self.assertEqual(split_ranges(column, 20), [(0, 11)])
+        column = Column.from_values([(0, 1), (0, 1), (1, 2), ("a", 2), ("a", 2)], pairs=True)
+        self.assertEqual(split_ranges(column, 2), [(0, 2), (2, 3), (3, 5)])
+        self.assertEqual(split_ranges(Column.from_values([]), 2), [])
+
     def test_get_number_precision(self):
         '''Test behavior of get_number_precision function'''
 
@@ -250,3 +296,39 @@ class TestHelpers(TestCase):
         '''Test behavior of file_is_outdated function'''
         with self.assertRaises(RuntimeError):
             file_is_outdated(None, 'non_existing_file.png')
+
+    def test_file_is_outdated_hash(self):
+        '''Test the hash-based staleness mode of file_is_outdated'''
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        reference = os.path.join(tmpdir, "figure.pdf")
+        output = os.path.join(tmpdir, "figure.png")
+        for path in (reference, output):
+            with open(path, "w", encoding="utf-8") as outfile:
+                outfile.write(path)
+
+        # Without a record, the file is outdated
+        self.assertTrue(file_is_outdated(output, reference, staleness="hash"))
+        record_file_source(output, reference, settings="density=300")
+        self.assertTrue(os.path.exists(os.path.join(tmpdir, ".figure.png.source.json")))
+        self.assertFalse(file_is_outdated(output, reference, staleness="hash",
+                                          settings="density=300"))
+
+        # Timestamps are ignored
+        os.utime(reference, (os.path.getmtime(output) + 100,) * 2)
+        self.assertTrue(file_is_outdated(output, reference))
+        self.assertFalse(file_is_outdated(output, reference, staleness="hash",
+                                          settings="density=300"))
+
+        # Changes of the settings or of either file are detected
+        self.assertTrue(file_is_outdated(output, reference, staleness="hash",
+                                         settings="density=150"))
+        for path in (reference, output):
+            record_file_source(output, reference, settings="density=300")
+            with open(path, "a", encoding="utf-8") as outfile:
+                outfile.write("changed")
+            self.assertTrue(file_is_outdated(output, reference, staleness="hash",
+                                             settings="density=300"))
+
+        with self.assertRaises(ValueError):
+            file_is_outdated(output, reference, staleness="size")
@@ -4,8 +4,9 @@ from collections import defaultdict
 from unittest import TestCase
 import shutil
 import os
+import numpy as np
 import yaml
-from hepdata_lib import Submission, Table, Variable
+from hepdata_lib import Submission, Table, Variable, Uncertainty, register_representers
 from .test_utilities import tmp_directory_name
 
 class TestOutput(TestCase):
@@ -52,3 +53,38 @@ class TestOutput(TestCase):
         self.addCleanup(os.remove, "submission.tar.gz")
         self.addCleanup(shutil.rmtree, tmp_dir)
         self.doCleanups()
+
+    def test_emitters_identical(self):
+        """Test that the LibYAML and pure-Python emitters write identical bytes"""
+        if not yaml.__with_libyaml__:
+            self.skipTest("LibYAML bindings are not available.")
+
+        class CDumper(yaml.CSafeDumper):  # pylint: disable=too-many-ancestors
+            """LibYAML dumper with hepdata_lib representers."""
+        class PyDumper(yaml.SafeDumper):  # pylint: disable=too-many-ancestors
+            """Pure-Python dumper with hepdata_lib representers."""
+        register_representers(CDumper)
+        register_representers(PyDumper)
+
+        xvar = Variable("x \u00b5m", is_binned=True,
+                        values=[(i, i + 0.5) for i in range(20)])
+        yvar = Variable("y: 'quoted' " + "long name " * 10, is_independent=False,
+                        is_binned=False,
+                        values=[1.5e-12, -3, float("nan"), float("inf"), "-"] * 4)
+        yvar.add_qualifier("SQRT(S)", np.float64(13000.0), "GeV")
+        yvar.add_qualifier("N", np.int64(3))
+        yvar.add_qualifier("Flag", np.bool_(True))
+        yvar.add_qualifier("Label", np.str_("a string"))
+        unc = Uncertainty("sys, lumi", is_symmetric=False)
+        unc.values = [(-0.1 * i, 0.2 * i) for i in range(20)]
+        yvar.add_uncertainty(unc)
+        table = {
+            "independent_variables": [xvar.make_dict()],
+            "dependent_variables": [yvar.make_dict()],
+        }
+
+        c_output = yaml.dump(table, Dumper=CDumper, default_flow_style=False)
+        py_output = yaml.dump(table, Dumper=PyDumper, default_flow_style=False)
+        self.assertEqual(c_output.encode("utf-8"), py_output.encode("utf-8"))
+        self.assertIn("value: 13000.0", c_output)
+        self.assertIn("value: true", c_output)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Test the profiling of builds."""
+import json
+import os
+import shutil
+import threading
+import tracemalloc
+from unittest import TestCase
+from hepdata_lib import Submission, Table, Variable, profiling
+from .test_utilities import tmp_directory_name
+
+
+def make_variable(name, is_independent, nbins):
+    """Return a variable with the given number of bins."""
+    variable = Variable(name, is_independent=is_independent, is_binned=False)
+    variable.values = [0.1 * i for i in range(nbins)]
+    return variable
+
+
+class TestProfiling(TestCase):
+    """Test the recording of stages."""
+
+    def test_timing(self):
+        """Test that durations are only recorded while recording."""
+        with profiling.stage("ignored"):
+            pass
+        timings = {}
+        with profiling.recording(timings):
+            for _ in range(2):
+                with profiling.stage("stage"):
+                    pass
+        with profiling.stage("ignored"):
+            pass
+        self.assertEqual(list(timings), ["stage"])
+        self.assertGreaterEqual(timings["stage"], 0)
+
+    def test_timing_per_thread(self):
+        """Test that stages of other threads are not recorded."""
+        def run_stage():
+            with profiling.stage("other"):
+                pass
+        timings = {}
+        with profiling.recording(timings):
+            thread = threading.Thread(target=run_stage)
+            thread.start()
+            thread.join()
+            with profiling.stage("stage"):
+                pass
+        self.assertEqual(list(timings), ["stage"])
+
+    def test_memory_tracking(self):
+        """Test that the memory peaks of nested stages are measured."""
+        peaks = {}
+        size = 1 << 22
+        with profiling.tracking() as tracker, profiling.recording(None, peaks):
+            with profiling.stage("outer"):
+                with profiling.stage("inner"):
+                    data = bytearray(size)
+                    del data
+                with profiling.stage("after"):
+                    pass
+        # Memory freed during the stages, e.g. by coverage measurement, lowers the peaks
+        margin = 1 << 16
+        self.assertGreaterEqual(peaks["inner"]["traced"], size - margin)
+        self.assertGreaterEqual(peaks["outer"]["traced"], size - margin)
+        self.assertLess(peaks["after"]["traced"], margin)
+        self.assertGreaterEqual(tracker.peak_traced, size - margin)
+
+        # Without tracker, no memory use is recorded
+        peaks = {}
+        with profiling.recording(None, peaks), profiling.stage("stage"):
+            pass
+        self.assertEqual(peaks, {})
+
+    def test_create_files_profile_memory(self):
+        """Test the memory report of create_files."""
+        test_submission = Submission()
+        for itable in range(2):
+            table = Table(f"Table {itable}")
+            table.add_variable(make_variable("x", True, 1000))
+            table.add_variable(make_variable("y", False, 1000))
+            test_submission.add_table(table)
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        report = test_submission.create_files(testdir, validate=False, profile_memory=True)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(list(report.memory), ["tables", "copy_files", "archive"])
+        self.assertEqual([name for name, _ in report.table_memory], ["Table 0", "Table 1"])
+        for _, peaks in report.table_memory:
+            self.assertEqual(list(peaks), ["images", "make_dict", "yaml_emission",
+                                           "copy_files"])
+            self.assertGreater(peaks["make_dict"]["traced"], 0)
+            self.assertLessEqual(peaks["make_dict"]["traced"], report.memory["tables"]["traced"])
+        self.assertGreaterEqual(report.peak_traced, report.memory["tables"]["traced"])
+        self.assertTrue(report.top_allocators)
+        self.assertEqual(list(report.stages), ["tables", "copy_files", "archive"])
+
+        as_dict = json.loads(json.dumps(report.as_dict()))
+        self.assertEqual(as_dict["memory"]["table_stages"], report.table_peaks())
+        self.assertEqual(as_dict["tables"][1]["memory"], report.table_memory[1][1])
+        self.assertIn("Top allocators:", report.summary())
+        self.assertNotIn("memory", test_submission.create_files(
+            testdir, validate=False, remove_old=True, profile=True).as_dict())
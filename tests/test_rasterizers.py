@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Test the rasterizer backends."""
+import os
+import shutil
+import tarfile
+from unittest import TestCase
+from unittest.mock import patch
+from hepdata_lib import Submission, Table, rasterizers
+from hepdata_lib.rasterizers import (ImageMagickRasterizer, PyMuPDFRasterizer, Rasterizer,
+                                     get_rasterizer, register_rasterizer)
+from .test_utilities import tmp_directory_name
+
+
+class CopyRasterizer(Rasterizer):
+    """Backend copying the source files instead of converting them."""
+
+    name = "copy"
+
+    def __init__(self):
+        self.calls = []
+
+    def convert(self, source, target, thumbnail_target):
+        self.calls.append(("convert", source))
+        shutil.copyfile(source, target)
+        shutil.copyfile(source, thumbnail_target)
+
+    def make_thumbnail(self, source, target):
+        self.calls.append(("make_thumbnail", source))
+        shutil.copyfile(source, target)
+
+
+class TestRasterizers(TestCase):
+    """Test the selection and use of rasterizer backends."""
+
+    def test_get_rasterizer(self):
+        """Test the selection of backends."""
+        rasterizer = CopyRasterizer()
+        self.assertIs(get_rasterizer(rasterizer), rasterizer)
+        with self.assertRaises(ValueError):
+            get_rasterizer("unknown")
+
+        # PyMuPDF is only used if it is selected explicitly
+        with patch.object(PyMuPDFRasterizer, "is_available", return_value=False):
+            self.assertIsInstance(get_rasterizer(), ImageMagickRasterizer)
+            with self.assertRaises(RuntimeError):
+                get_rasterizer("pymupdf")
+        with patch.object(PyMuPDFRasterizer, "is_available", return_value=True):
+            self.assertIsInstance(get_rasterizer(), ImageMagickRasterizer)
+            self.assertIsInstance(get_rasterizer("pymupdf"), PyMuPDFRasterizer)
+        with patch("hepdata_lib.rasterizers.pymupdf", None):
+            self.assertFalse(PyMuPDFRasterizer.is_available())
+
+        with self.assertRaises(ValueError):
+            register_rasterizer(Rasterizer)
+
+        # Backends have to implement both conversions
+        class IncompleteRasterizer(Rasterizer):  # pylint: disable=abstract-method
+            """Backend without thumbnails."""
+            name = "incomplete"
+
+            def convert(self, source, target, thumbnail_target):
+                pass
+
+        with self.assertRaises(TypeError):
+            register_rasterizer(IncompleteRasterizer)
+        with self.assertRaises(TypeError):
+            IncompleteRasterizer()  # pylint: disable=abstract-class-instantiated
+        self.assertNotIn("incomplete", rasterizers._RASTERIZERS)  # pylint: disable=protected-access
+
+    def test_custom_rasterizer(self):
+        """Test that registered backends are used to write images."""
+        self.addCleanup(rasterizers._RASTERIZERS.pop, "copy")  # pylint: disable=protected-access
+        register_rasterizer(CopyRasterizer)
+        self.assertIsInstance(get_rasterizer("copy"), CopyRasterizer)
+        # Registered backends that are not opt-in are preferred over ImageMagick
+        self.assertIsInstance(get_rasterizer(), CopyRasterizer)
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        some_pdf = f"{os.path.dirname(__file__)}/minimal.pdf"
+        rasterizer = CopyRasterizer()
+        test_table = Table("Some Table")
+        test_table.add_image(some_pdf)
+        test_table.write_images(testdir, rasterizer=rasterizer)
+        self.assertEqual(sorted(os.listdir(testdir)), ["minimal.png", "thumb_minimal.png"])
+        os.remove(os.path.join(testdir, "thumb_minimal.png"))
+        test_table.write_images(testdir, rasterizer=rasterizer)
+        self.assertEqual(rasterizer.calls, [("convert", some_pdf), (
+            "make_thumbnail", os.path.join(testdir, "minimal.png"))])
+
+    def test_hash_staleness(self):
+        """Test that images are only converted again if their content changed."""
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        os.makedirs(testdir)
+        source = os.path.join(testdir, "figure.pdf")
+        with open(source, "w", encoding="utf-8") as image:
+            image.write("%PDF-1.4 figure")
+        outdir = os.path.join(testdir, "output")
+        rasterizer = CopyRasterizer()
+        test_table = Table("Some Table")
+        test_table.add_image(source)
+
+        test_table.write_images(outdir, rasterizer=rasterizer, staleness="hash")
+        self.assertEqual(len(rasterizer.calls), 1)
+        # Newer timestamps of the source do not trigger a conversion
+        later = os.path.getmtime(os.path.join(outdir, "figure.png")) + 100
+        os.utime(source, (later, later))
+        test_table.write_images(outdir, rasterizer=rasterizer, staleness="hash")
+        self.assertEqual(len(rasterizer.calls), 1)
+        # A missing thumbnail is made again
+        os.remove(os.path.join(outdir, "thumb_figure.png"))
+        test_table.write_images(outdir, rasterizer=rasterizer, staleness="hash")
+        self.assertEqual(rasterizer.calls[-1][0], "make_thumbnail")
+        # Changes of the content do
+        with open(source, "a", encoding="utf-8") as image:
+            image.write(" changed")
+        test_table.write_images(outdir, rasterizer=rasterizer, staleness="hash")
+        self.assertEqual([call[0] for call in rasterizer.calls],
+                         ["convert", "make_thumbnail", "convert"])
+
+        with self.assertRaises(ValueError):
+            Submission().create_files(outdir, image_staleness="size")
+
+    def test_incremental_images(self):
+        """Test that incremental builds keep the images that are up to date."""
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        some_pdf = f"{os.path.dirname(__file__)}/minimal.pdf"
+        test_table = Table("Some Table")
+        test_table.add_image(some_pdf)
+        test_submission = Submission()
+        test_submission.add_table(test_table)
+        for staleness in ("time", "hash"):
+            rasterizer = CopyRasterizer()
+            for _ in range(2):
+                test_table.additional_resources = []
+                test_submission.create_files(testdir, validate=False, remove_old=True,
+                                             incremental=True, rasterizer=rasterizer,
+                                             image_staleness=staleness)
+                self.assertIn("thumb_minimal.png", os.listdir(testdir))
+            # Without sidecar files, the images of the "time" build are converted once more
+            self.assertEqual(len(rasterizer.calls), 1)
+
+    def test_hash_staleness_archive(self):
+        """Test that the sidecar files of the "hash" staleness mode are not archived."""
+        self.addCleanup(os.remove, "submission.tar.gz")
+        test_table = Table("Some Table")
+        test_table.add_image(f"{os.path.dirname(__file__)}/minimal.pdf")
+        test_submission = Submission()
+        test_submission.add_table(test_table)
+        for options in ({"archive_only": True}, {}):
+            testdir = tmp_directory_name()
+            self.addCleanup(shutil.rmtree, testdir, ignore_errors=True)
+            test_table.additional_resources = []
+            test_submission.create_files(testdir, validate=False, rasterizer=CopyRasterizer(),
+                                         image_staleness="hash", **options)
+            with tarfile.open("submission.tar.gz", "r:gz") as tar:
+                self.assertEqual(sorted(tar.getnames()),
+                                 ["minimal.png", "some_table.yaml", "submission.yaml",
+                                  "thumb_minimal.png"])
+
+    def test_pymupdf(self):
+        """Test the conversion with PyMuPDF and Pillow."""
+        if not PyMuPDFRasterizer.is_available():
+            self.skipTest("PyMuPDF or Pillow are not available.")
+        some_pdf = f"{os.path.dirname(__file__)}/minimal.pdf"
+        testdir = tmp_directory_name()
+        os.makedirs(testdir)
+        self.addCleanup(shutil.rmtree, testdir)
+        png_file = os.path.join(testdir, "minimal.png")
+        thumbnail_file = os.path.join(testdir, "thumb_minimal.png")
+        get_rasterizer("pymupdf").convert(some_pdf, png_file, thumbnail_file)
+
+        with rasterizers.Image.open(png_file) as image, \
+             rasterizers.Image.open(thumbnail_file) as thumbnail:
+            self.assertEqual(image.format, "PNG")
+            self.assertLessEqual(thumbnail.width, rasterizers.THUMBNAIL_SIZE[0])
+            self.assertLessEqual(thumbnail.height, rasterizers.THUMBNAIL_SIZE[1])
+            self.assertTrue(thumbnail.width == rasterizers.THUMBNAIL_SIZE[0]
+                            or thumbnail.height == rasterizers.THUMBNAIL_SIZE[1])
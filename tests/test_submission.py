@@ -1,13 +1,28 @@
 # !/usr/bin/env python
 """Test Submission."""
+import json
 import os
 import shutil
 import string
+import threading
+import time
+import weakref
 from unittest import TestCase
+from unittest.mock import patch
 import tarfile
-from hepdata_lib import Submission, Table, Variable, Uncertainty
+from hepdata_lib import Submission, SubmissionWriter, Table, Variable, Uncertainty, DeferredTable
+from hepdata_lib.rasterizers import ImageMagickRasterizer
 from .test_utilities import tmp_directory_name
 
+def make_variables(nbins, scale=1.0):
+    """Loader of the variables of deferred tables."""
+    make_variables.calls += 1
+    x = Variable("x", values=[(i, i + 1) for i in range(nbins)])
+    y = Variable("y", is_independent=False, is_binned=False,
+                 values=[scale * i for i in range(nbins)])
+    return [x, y]
+make_variables.calls = 0
+
 class TestSubmission(TestCase):
     """Test the Submission class."""
     def test_add_table_typechecks(self):
@@ -124,6 +139,414 @@ class TestSubmission(TestCase):
         self.assertFalse(os.path.isfile(testfile))
 
 
+    def test_create_files_parallel(self):
+        """Test that parallel writing gives the same output as serial writing."""
+        test_submission = Submission()
+        for itable in range(5):
+            table = Table(f"Table {itable}")
+            table.description = f"Description of table {itable}"
+            table.keywords["observables"] = ["SIG"]
+            xvar = Variable("x", is_independent=True, is_binned=True,
+                            values=[(i, i + 1) for i in range(10)])
+            yvar = Variable("y", is_independent=False, is_binned=False,
+                            values=[0.1 * i * itable for i in range(10)])
+            unc = Uncertainty("stat", is_symmetric=True)
+            unc.values = [0.01 * i for i in range(10)]
+            yvar.add_uncertainty(unc)
+            table.add_variable(xvar)
+            table.add_variable(yvar)
+            test_submission.add_table(table)
+
+        serial_dir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, serial_dir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        test_submission.create_files(serial_dir, validate=False)
+
+        for backend in ["thread", "process"]:
+            parallel_dir = tmp_directory_name()
+            self.addCleanup(shutil.rmtree, parallel_dir)
+            test_submission.create_files(parallel_dir, validate=False,
+                                         workers=2, parallel_backend=backend)
+            self.assertEqual(sorted(os.listdir(serial_dir)), sorted(os.listdir(parallel_dir)))
+            for filename in os.listdir(serial_dir):
+                with open(os.path.join(serial_dir, filename), "rb") as serial_file, \
+                     open(os.path.join(parallel_dir, filename), "rb") as parallel_file:
+                    self.assertEqual(serial_file.read(), parallel_file.read())
+
+        with self.assertRaises(ValueError):
+            test_submission.create_files(serial_dir, workers=2, parallel_backend="gpu")
+        with self.assertRaises(TypeError):
+            test_submission.create_files(serial_dir, worker=2)
+
+    def test_create_files_incremental(self):
+        """Test that incremental builds only write the data files of changed tables."""
+        test_submission = Submission()
+        for itable in range(3):
+            table = Table(f"Table {itable}")
+            xvar = Variable("x", is_independent=True, is_binned=False,
+                            values=[float(i) for i in range(10)])
+            yvar = Variable("y", is_independent=False, is_binned=False,
+                            values=[0.1 * i * itable for i in range(10)])
+            table.add_variable(xvar)
+            table.add_variable(yvar)
+            test_submission.add_table(table)
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        test_submission.create_files(testdir, validate=False, remove_old=True, incremental=True)
+        first_build = os.listdir(testdir)
+        self.assertIn(".hepdata_lib_manifest.json", first_build)
+        for name in first_build:
+            os.utime(os.path.join(testdir, name), (0, 0))
+
+        # Leftover files are removed, unchanged data files are kept
+        with open(os.path.join(testdir, "leftover.yaml"), "w", encoding="utf-8") as leftover:
+            leftover.write("test")
+        test_submission.tables[1].variables[1].values = [1.0] * 10
+        test_submission.tables[2].variables[1].add_qualifier("SQRT(S)", 13000, "GeV")
+        test_submission.create_files(testdir, validate=False, remove_old=True, incremental=True)
+        self.assertEqual(sorted(os.listdir(testdir)), sorted(first_build))
+        for name, changed in [("table_0.yaml", False), ("table_1.yaml", True),
+                              ("table_2.yaml", True), ("submission.yaml", True)]:
+            mtime = os.stat(os.path.join(testdir, name)).st_mtime
+            self.assertEqual(mtime != 0, changed)
+
+        # The output is identical to a full build
+        fulldir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, fulldir)
+        test_submission.create_files(fulldir, validate=False)
+        self.assertNotIn(".hepdata_lib_manifest.json", os.listdir(fulldir))
+        for name in os.listdir(fulldir):
+            with open(os.path.join(testdir, name), "rb") as incremental_file, \
+                 open(os.path.join(fulldir, name), "rb") as full_file:
+                self.assertEqual(incremental_file.read(), full_file.read())
+
+        # A non-incremental build invalidates the manifest
+        test_submission.create_files(testdir, validate=False)
+        self.assertNotIn(".hepdata_lib_manifest.json", os.listdir(testdir))
+
+    def test_create_files_archive_only(self):
+        """Test that the direct-to-archive mode gives the same tar ball content."""
+        testfile = "testfile.txt"
+        with open(testfile, "w", encoding="utf-8") as f:
+            f.write("test")
+        self.addCleanup(os.remove, testfile)
+
+        test_submission = Submission()
+        test_submission.add_additional_resource("a_resource", testfile, copy_file=True)
+        for itable in range(3):
+            table = Table(f"Table {itable}")
+            yvar = Variable("y", is_independent=False, is_binned=False,
+                            values=[0.1 * i * itable for i in range(10)])
+            unc = Uncertainty("stat", is_symmetric=True)
+            unc.values = [0.01 * i for i in range(10)]
+            yvar.add_uncertainty(unc)
+            table.add_variable(Variable("x", values=[(i, i + 1) for i in range(10)]))
+            table.add_variable(yvar)
+            test_submission.add_table(table)
+
+        def read_archive():
+            with tarfile.open("submission.tar.gz", "r:gz") as tar:
+                return {member.name: tar.extractfile(member).read() for member in tar}
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        test_submission.create_files(testdir)
+        expected = read_archive()
+
+        for workers in [None, 2]:
+            archive_dir = tmp_directory_name()
+            test_submission.create_files(archive_dir, archive_only=True, workers=workers)
+            self.assertFalse(os.path.exists(archive_dir))
+            self.assertEqual(read_archive(), expected)
+
+        with self.assertRaises(ValueError):
+            test_submission.create_files(testdir, archive_only=True, incremental=True)
+
+    def test_create_files_reproducible(self):
+        """Test that reproducible tar balls do not depend on the build."""
+        test_submission = Submission()
+        for itable in range(3):
+            table = Table(f"Table {itable}")
+            table.add_variable(Variable("x", values=[(i, i + 1) for i in range(10)]))
+            table.add_variable(Variable("y", is_independent=False, is_binned=False,
+                                        values=[float(i) for i in range(10)]))
+            test_submission.add_table(table)
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        test_submission.create_files(testdir, reproducible=True)
+        with open("submission.tar.gz", "rb") as archive:
+            first_build = archive.read()
+
+        # The gzip header does not contain a timestamp or a file name
+        self.assertEqual(first_build[4:8], b"\0\0\0\0")
+        with tarfile.open("submission.tar.gz", "r:gz") as tar:
+            names = tar.getnames()
+            self.assertEqual(names, sorted(names))
+            for member in tar:
+                self.assertEqual((member.mtime, member.uid, member.gid, member.uname),
+                                 (0, 0, 0, ""))
+
+        # Touched output files and the direct-to-archive mode give the same bytes
+        for name in os.listdir(testdir):
+            os.utime(os.path.join(testdir, name), (12345, 12345))
+        test_submission.create_files(testdir, archive_only=True, reproducible=True)
+        with open("submission.tar.gz", "rb") as archive:
+            self.assertEqual(archive.read(), first_build)
+
+    def test_create_files_compression(self):
+        """Test the compression options of the tar ball."""
+        test_submission = Submission()
+        table = Table("Table")
+        table.add_variable(Variable("x", values=[(i, i + 1) for i in range(10)]))
+        table.add_variable(Variable("y", is_independent=False, is_binned=False,
+                                    values=[float(i) for i in range(10)]))
+        test_submission.add_table(table)
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        contents = []
+        for options in ({}, {"compresslevel": 0}, {"compression_threads": 2}):
+            test_submission.create_files(testdir, remove_old=True, **options)
+            with tarfile.open("submission.tar.gz", "r:gz") as tar:
+                contents.append({member.name: tar.extractfile(member).read()
+                                 for member in tar.getmembers() if member.isfile()})
+        self.assertEqual(contents[1], contents[0])
+        self.assertEqual(contents[2], contents[0])
+
+        with self.assertRaises(ValueError):
+            test_submission.create_files(testdir, remove_old=True, compresslevel=10)
+
+    def test_create_files_build_cache(self):
+        """Test that cached data files are used instead of emitting them again."""
+        test_submission = Submission()
+        table = Table("Table")
+        table.add_variable(Variable("x", values=[(i, i + 1) for i in range(10)]))
+        table.add_variable(Variable("y", is_independent=False, is_binned=False,
+                                    values=[float(i) for i in range(10)]))
+        test_submission.add_table(table)
+
+        testdir = tmp_directory_name()
+        cachedir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(shutil.rmtree, cachedir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        test_submission.create_files(testdir, validate=False)
+        with open(os.path.join(testdir, "table.yaml"), encoding="utf-8") as data_file:
+            expected = data_file.read()
+
+        test_submission.set_build_cache(cachedir)
+        for ibuild, archive_only in enumerate((False, True, False)):
+            with patch.object(Table, "dump_yaml", wraps=table.dump_yaml) as dump_yaml:
+                test_submission.create_files(testdir, remove_old=True,
+                                             archive_only=archive_only)
+            # The data file is only emitted by the first build
+            self.assertEqual(dump_yaml.call_count, 0 if ibuild else 1)
+            with tarfile.open("submission.tar.gz", "r:gz") as tar:
+                self.assertEqual(tar.extractfile("table.yaml").read().decode("utf-8"),
+                                 expected)
+
+        # Changed tables are emitted again
+        table.variables[1].values = [float(i) for i in range(1, 11)]
+        with patch.object(Table, "dump_yaml", wraps=table.dump_yaml) as dump_yaml:
+            test_submission.create_files(testdir, remove_old=True, validate=False)
+        self.assertEqual(dump_yaml.call_count, 1)
+
+        test_submission.set_build_cache(None)
+        self.assertIsNone(test_submission.build_cache)
+
+    def test_submission_writer(self):
+        """Test that tables written one by one give the same output as create_files."""
+        def make_table(itable):
+            table = Table(f"Table {itable}")
+            table.add_variable(Variable("x", values=[(i, i + 1) for i in range(10)]))
+            table.add_variable(Variable("y", is_independent=False, is_binned=False,
+                                        values=[float(i * itable) for i in range(10)]))
+            return table
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+
+        test_submission = Submission()
+        test_submission.comment = "A comment"
+        for itable in range(3):
+            test_submission.add_table(make_table(itable))
+        test_submission.create_files(testdir, remove_old=True, reproducible=True)
+        with open("submission.tar.gz", "rb") as archive:
+            expected = archive.read()
+
+        test_submission.tables = test_submission.tables[:1]
+        with SubmissionWriter(test_submission, testdir, remove_old=True,
+                              reproducible=True) as writer:
+            for itable in range(1, 3):
+                table = make_table(itable)
+                reference = weakref.ref(table)
+                writer.write_table(table)
+                del table
+                # The writer does not keep the table alive
+                self.assertIsNone(reference())
+        with open("submission.tar.gz", "rb") as archive:
+            self.assertEqual(archive.read(), expected)
+
+        with self.assertRaises(RuntimeError):
+            writer.write_table(make_table(3))
+        with self.assertRaises(TypeError):
+            SubmissionWriter(None, testdir)
+
+        # Nothing is packed if an error occurs while writing
+        with self.assertRaises(TypeError):
+            with SubmissionWriter(test_submission, testdir) as writer:
+                writer.write_table(None)
+        with open("submission.tar.gz", "rb") as archive:
+            self.assertEqual(archive.read(), expected)
+
+    def test_deferred_table(self):
+        """Test that deferred tables give the same output as regular tables."""
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+
+        eager_submission = Submission()
+        deferred_submission = Submission()
+        for itable in range(3):
+            table = Table(f"Table {itable}")
+            for variable in make_variables(10, scale=itable):
+                table.add_variable(variable)
+            eager_submission.add_table(table)
+            deferred_submission.add_table(
+                DeferredTable(f"Table {itable}", make_variables, 10, scale=itable))
+
+        eager_submission.create_files(testdir, remove_old=True, reproducible=True)
+        with open("submission.tar.gz", "rb") as archive:
+            expected = archive.read()
+
+        for options in ({}, {"streaming": True}, {"archive_only": True},
+                        {"workers": 2, "parallel_backend": "thread"},
+                        {"incremental": True}, {"incremental": True}):
+            make_variables.calls = 0
+            deferred_submission.create_files(testdir, remove_old=True, reproducible=True,
+                                             **options)
+            with open("submission.tar.gz", "rb") as archive:
+                self.assertEqual(archive.read(), expected)
+            # The variables are read once per table and released afterwards,
+            # also if they are only needed for the fingerprint of an incremental build
+            self.assertEqual(make_variables.calls, 3)
+            for table in deferred_submission.tables:
+                self.assertEqual(table.variables, [])
+
+        table = deferred_submission.tables[0]
+        with table.materialized():
+            self.assertEqual(len(table.variables), 2)
+            self.assertEqual(table.fingerprint(), eager_submission.tables[0].fingerprint())
+        self.assertEqual(table.variables, [])
+        with self.assertRaises(RuntimeError):
+            table.add_variable(Variable("z"))
+        with self.assertRaises(TypeError):
+            DeferredTable("Table", lambda: [None]).make_dict()
+
+    def test_split_oversized_tables(self):
+        """Test that oversized tables are replaced by valid parts."""
+        test_submission = Submission()
+        for nbins in (10, 1000):
+            table = Table(f"Table {nbins}")
+            for variable in make_variables(nbins):
+                table.add_variable(variable)
+            test_submission.add_table(table)
+
+        max_size = test_submission.tables[1].estimate_size() // 2
+        test_submission.split_oversized_tables(max_size)
+        self.assertEqual([table.name for table in test_submission.tables],
+                         ["Table 10", "Table 1000 part 1 of 3", "Table 1000 part 2 of 3",
+                          "Table 1000 part 3 of 3"])
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        test_submission.create_files(testdir)
+        for table in test_submission.tables:
+            self.assertLessEqual(
+                os.path.getsize(os.path.join(testdir, table.data_file_name)), max_size)
+
+    def test_stats(self):
+        """Test the size report of a submission."""
+        test_submission = Submission()
+        for nbins in (10, 20):
+            table = Table(f"Table {nbins}")
+            x, y = make_variables(nbins)
+            unc = Uncertainty("stat", is_symmetric=False)
+            unc.values = [(-0.1, 0.1)] * nbins
+            y.add_uncertainty(unc)
+            table.add_variable(x)
+            table.add_variable(y)
+            test_submission.add_table(table)
+        test_submission.tables[1].add_image(f"{os.path.dirname(__file__)}/minimal.pdf")
+
+        # No values are formatted
+        with patch.object(Variable, "make_columns") as make_columns:
+            report = test_submission.stats()
+        make_columns.assert_not_called()
+        # The report can be logged as JSON
+        self.assertEqual(json.loads(json.dumps(report)), report)
+
+        self.assertEqual(report["tables"], 2)
+        self.assertEqual(report["bins"], 30)
+        self.assertEqual(report["uncertainty_entries"], 30)
+        self.assertEqual(report["images"], 1)
+        self.assertEqual(report["oversized_tables"], [])
+        table_report = report["table_stats"][1]
+        self.assertEqual(table_report["name"], "Table 20")
+        self.assertEqual(table_report["data_file"], "table_20.yaml")
+        self.assertEqual(table_report["estimated_size"],
+                         test_submission.tables[1].estimate_size())
+        self.assertEqual(report["estimated_size"],
+                         sum(table.estimate_size() for table in test_submission.tables))
+        # Per bin, integer bin edges of x: 2 x (8 + 1) bytes,
+        # y: 8 bytes, asymmetric uncertainty: 2 x 8 bytes
+        self.assertEqual(table_report["nbytes"], 20 * 42)
+        self.assertEqual(report["nbytes"], 30 * 42)
+        self.assertEqual([var["name"] for var in table_report["variables"]], ["x", "y"])
+        self.assertEqual(table_report["variables"][1]["uncertainties"], 1)
+
+    def test_create_files_profile(self):
+        """Test the timing report of create_files."""
+        test_submission = Submission()
+        for itable in range(2):
+            table = Table(f"Table {itable}")
+            for variable in make_variables(10):
+                table.add_variable(variable)
+            test_submission.add_table(table)
+
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        self.addCleanup(os.remove, "submission.tar.gz")
+        self.assertIsNone(test_submission.create_files(testdir, validate=False))
+
+        for table in test_submission.tables:
+            table.variables[1].scale_values(2)
+        report = test_submission.create_files(testdir, remove_old=True, profile=True)
+        self.assertEqual(list(report.stages), ["tables", "copy_files", "archive", "validation"])
+        self.assertEqual([name for name, _ in report.tables], ["Table 0", "Table 1"])
+        for _, timings in report.tables:
+            self.assertEqual(list(timings), ["images", "make_dict", "yaml_emission",
+                                             "copy_files"])
+        self.assertGreaterEqual(report.total, sum(report.stages.values()))
+        self.assertEqual(json.loads(json.dumps(report.as_dict()))["tables"][0]["name"],
+                         "Table 0")
+        self.assertIn("Table 1", report.summary())
+
+        # Cached data files are not emitted again
+        report = test_submission.create_files(testdir, remove_old=True, profile=True,
+                                              streaming=True, archive_only=True,
+                                              validate=False)
+        self.assertEqual(list(report.stages), ["tables", "archive"])
+        self.assertEqual(list(report.table_totals()), ["images"])
+
     def test_read_abstract(self):
         """Test read_abstract function."""
         some_string = string.ascii_lowercase
@@ -225,3 +648,96 @@ class TestSubmission(TestCase):
                 tab.add_data_license(*test["data_license"])
                 assert tab.data_license["name"] == test["data_license"][0]
                 assert tab.data_license["url"] == test["data_license"][1]
+
+
+class TestImageConversion(TestCase):
+    """Test the concurrent conversion of images."""
+
+    def setUp(self):
+        self.active = 0
+        self.max_active = 0
+        self.converting = set()
+        self.overlaps = 0
+        self.lock = threading.Lock()
+
+    def fake_convert(self, source, *targets):
+        """
+        Copy the source instead of converting it and count the concurrent conversions,
+        and the conversions overlapping with another one into the same file.
+        """
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.overlaps += targets[0] in self.converting
+            self.converting.add(targets[0])
+        time.sleep(0.05)
+        for target in targets:
+            shutil.copyfile(source, target)
+        with self.lock:
+            self.active -= 1
+            self.converting.discard(targets[0])
+
+    def test_image_workers(self):
+        """Test that concurrent conversion gives the same files and resources as serial."""
+        imagedir = tmp_directory_name()
+        os.makedirs(imagedir)
+        self.addCleanup(shutil.rmtree, imagedir)
+        for name in "abcde":
+            with open(os.path.join(imagedir, f"{name}.pdf"), "w", encoding="utf-8") as image:
+                image.write(name)
+
+        outputs = []
+        with patch("hepdata_lib.helpers.convert_pdf_to_png_and_thumbnail", self.fake_convert):
+            for image_workers in (None, 3):
+                test_submission = Submission()
+                for names in ("ab", "bcd", "e"):
+                    table = Table(names)
+                    for name in names:
+                        table.add_image(os.path.join(imagedir, f"{name}.pdf"))
+                    table.add_additional_resource("Link", "https://www.hepdata.net")
+                    test_submission.add_table(table)
+                testdir = tmp_directory_name()
+                self.addCleanup(shutil.rmtree, testdir)
+                self.max_active = 0
+                test_submission.create_files(testdir, validate=False,
+                                             image_workers=image_workers,
+                                             rasterizer=ImageMagickRasterizer())
+                os.remove("submission.tar.gz")
+                outputs.append((
+                    [table.additional_resources for table in test_submission.tables],
+                    sorted(os.listdir(testdir))))
+                with open(os.path.join(testdir, "submission.yaml"), encoding="utf-8") as stream:
+                    outputs[-1] += (stream.read(),)
+                self.assertLessEqual(self.max_active, image_workers or 1)
+        self.assertGreater(self.max_active, 1)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("thumb_e.png", outputs[1][1])
+
+    def test_shared_image_workers(self):
+        """Test that tables written concurrently do not convert a shared image concurrently."""
+        imagedir = tmp_directory_name()
+        os.makedirs(imagedir)
+        self.addCleanup(shutil.rmtree, imagedir)
+        some_pdf = os.path.join(imagedir, "shared.pdf")
+        with open(some_pdf, "w", encoding="utf-8") as image:
+            image.write("shared")
+
+        test_submission = Submission()
+        for name in ("first", "second"):
+            table = Table(name)
+            table.add_image(some_pdf)
+            test_submission.add_table(table)
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        with patch("hepdata_lib.helpers.convert_pdf_to_png_and_thumbnail", self.fake_convert):
+            test_submission.create_files(testdir, validate=False, workers=2,
+                                         parallel_backend="thread",
+                                         rasterizer=ImageMagickRasterizer())
+        os.remove("submission.tar.gz")
+        self.assertEqual(self.overlaps, 0)
+        self.assertEqual(sorted(os.listdir(testdir)),
+                         ["first.yaml", "second.yaml", "shared.png", "submission.yaml",
+                          "thumb_shared.png"])
+        for table in test_submission.tables:
+            self.assertEqual([resource["location"] for resource in table.additional_resources],
+                             ["shared.png", "thumb_shared.png"])
@@ -1,10 +1,15 @@
 # !/usr/bin/env python
 """Test Table."""
 import os
+import io
+import pickle
 import shutil
 from unittest import TestCase
+from unittest.mock import patch
 
+import numpy as np
 from hepdata_lib import Table, Variable, Uncertainty, helpers
+from hepdata_lib.rasterizers import ImageMagickRasterizer
 from .test_utilities import tmp_directory_name
 
 class TestTable(TestCase):
@@ -70,13 +75,151 @@ class TestTable(TestCase):
         testdir = tmp_directory_name()
         self.addCleanup(shutil.rmtree, testdir)
         try:
-            test_table.write_yaml(testdir)
+            entry = test_table.write_yaml(testdir)
         except TypeError:
             self.fail("Table.write_yaml raised an unexpected TypeError.")
+
+        # The table entry is returned instead of being appended to the submission file
+        self.assertEqual(entry["name"], "Some Table")
+        self.assertEqual(entry["data_file"], "some_table.yaml")
+        self.assertEqual(entry["related_to_table_dois"], ["10.17182/hepdata.1.v1/t1"])
+        self.assertTrue(os.path.exists(os.path.join(testdir, "some_table.yaml")))
+        self.assertFalse(os.path.exists(os.path.join(testdir, "submission.yaml")))
         with self.assertRaises(TypeError):
             test_table.write_yaml(None)
         self.doCleanups()
 
+    def test_dump_yaml_memoization(self):
+        """Test that the data file is only emitted again after the variables changed."""
+        test_table = Table("Some Table")
+        x = Variable("x", values=[(0, 1), (1, 2)])
+        y = Variable("y", is_independent=False, is_binned=False, values=[1.0, 2.0])
+        unc = Uncertainty("stat")
+        unc.values = [0.1, 0.2]
+        y.add_uncertainty(unc)
+        sys_unc = Uncertainty("sys")
+        sys_unc.values = [0.5, 0.5]
+        test_table.add_variable(x)
+        test_table.add_variable(y)
+
+        def dump(streaming=False):
+            stream = io.StringIO()
+            test_table.dump_yaml(stream, streaming=streaming)
+            return stream.getvalue()
+
+        def emitted(modify):
+            modify()
+            with patch.object(Table, "make_dict", wraps=test_table.make_dict) as make_dict:
+                output = dump()
+            self.assertEqual(output, dump(streaming=True))
+            return make_dict.call_count == 1
+
+        self.assertTrue(emitted(lambda: None))
+        self.assertFalse(emitted(lambda: None))
+        # Meta data of the table are not part of the data file
+        self.assertFalse(emitted(lambda: setattr(test_table, "description", "changed")))
+        fingerprint = test_table.fingerprint()
+
+        modifications = [
+            lambda: setattr(y, "values", [3.0, 4.0]),
+            lambda: setattr(y, "units", "GeV"),
+            lambda: setattr(unc, "values", [0.3, 0.4]),
+            lambda: y.scale_values(2),
+            lambda: y.add_qualifier("SQRT(S)", 13000, "GeV"),
+            lambda: y.qualifiers[0].update({"value": 8000}),
+            lambda: y.add_uncertainty(sys_unc),
+            y.uncertainties.pop,
+            lambda: test_table.variables.append(Variable("z", is_independent=False,
+                                                         is_binned=False, values=[5, 6])),
+            ]
+        for modify in modifications:
+            self.assertTrue(emitted(modify))
+            self.assertFalse(emitted(lambda: None))
+            self.assertNotEqual(test_table.fingerprint(), fingerprint)
+            fingerprint = test_table.fingerprint()
+
+        # The memoized data file is not pickled, e.g. for worker processes
+        copied = pickle.loads(pickle.dumps(test_table))
+        self.assertIsNone(copied._data_memo)  # pylint: disable=protected-access
+        # Data files larger than the limit are not kept
+        test_table.data_memo_limit = 100
+        self.assertTrue(emitted(lambda: y.scale_values(2)))
+        self.assertTrue(emitted(lambda: None))
+
+    def test_estimate_size(self):
+        """Test that the size estimate is close to the actual size of the data file."""
+        test_table = Table("Some Table")
+        nbins = 1000
+        test_table.add_variable(Variable("x", values=[(i, i + 1) for i in range(nbins)]))
+        y = Variable("y", is_independent=False, is_binned=False,
+                     values=np.linspace(1, 1000, nbins))
+        for label, symmetric in (("stat", True), ("sys", False)):
+            unc = Uncertainty(label, is_symmetric=symmetric)
+            unc.values = np.full(nbins, 0.123) if symmetric else np.full((nbins, 2), (-0.1, 0.2))
+            y.add_uncertainty(unc)
+        test_table.add_variable(y)
+
+        stream = io.StringIO()
+        test_table.dump_yaml(stream)
+        size = len(stream.getvalue())
+        self.assertGreaterEqual(test_table.estimate_size(), size)
+        self.assertLess(test_table.estimate_size(), 1.5 * size)
+
+    def test_split(self):
+        """Test splitting a table into parts of limited size."""
+        test_table = Table("Map")
+        test_table.description = "A map."
+        test_table.keywords["observables"] = ["SIG"]
+        x = Variable("x", units="GeV", values=[(i // 10, i // 10 + 1) for i in range(100)])
+        y = Variable("y", is_binned=False, values=[i % 10 for i in range(100)])
+        z = Variable("z", is_independent=False, is_binned=False, values=list(range(100)))
+        unc = Uncertainty("stat")
+        unc.values = [0.5] * 100
+        z.add_uncertainty(unc)
+        z.add_qualifier("SQRT(S)", 13000, "GeV")
+        for var in (x, y, z):
+            test_table.add_variable(var)
+
+        self.assertEqual(test_table.split(test_table.estimate_size()), [test_table])
+        max_size = test_table.estimate_size() // 3
+        parts = test_table.split(max_size)
+        self.assertEqual(len(parts), 4)
+        self.assertEqual([part.name for part in parts],
+                         [f"Map part {i} of 4" for i in range(1, 5)])
+        for part in parts:
+            self.assertLessEqual(part.estimate_size(), max_size)
+            self.assertEqual(part.keywords, test_table.keywords)
+            self.assertEqual(part.variables[2].qualifiers, z.qualifiers)
+            # Bins with the same x value are in the same part
+            self.assertEqual(len(part.variables[0].values) % 10, 0)
+        self.assertTrue(
+            parts[0].description.startswith("A map.\n\nPart 1 of 4: x from 0 to 3 GeV."))
+        self.assertIn("'Map part 2 of 4'", parts[0].description)
+        for index, var in enumerate((x, y, z)):
+            self.assertEqual(sum((part.variables[index].values for part in parts), []),
+                             var.values)
+        self.assertEqual(sum((part.variables[2].uncertainties[0].values for part in parts), []),
+                         unc.values)
+
+        # Split along y, which changes with every bin
+        parts = test_table.split(max_size, along="y")
+        self.assertIn(f"Part 1 of {len(parts)}: y from 0 to", parts[0].description)
+        self.assertEqual(sum(len(part.variables[0].values) for part in parts), 100)
+        # Long names are shortened so that the names of the parts fit into the limit
+        test_table.name = "A" * 58
+        parts = test_table.split(max_size // 4, along="y")
+        self.assertGreaterEqual(len(parts), 10)
+        for part in parts:
+            self.assertLessEqual(len(part.name), 64)
+            self.assertTrue(part.name.startswith("AAAA"))
+        self.assertEqual(parts[-1].name, "A" * (64 - len(f" part {len(parts)} of {len(parts)}"))
+                         + f" part {len(parts)} of {len(parts)}")
+        self.assertEqual(len({part.data_file_name for part in parts}), len(parts))
+        with self.assertRaises(ValueError):
+            test_table.split(max_size, along="z")
+        with self.assertRaises(ValueError):
+            test_table.split(100)
+
     def test_add_image(self):
         """Get test PDF"""
         # Get test PDF
@@ -179,6 +322,35 @@ class TestTable(TestCase):
         self.assertTrue(modified_time_main < os.path.getmtime(expected_main_file))
         self.assertTrue(modified_time_thumbnail < os.path.getmtime(expected_thumbnail_file))
 
+    def test_write_images_single_pass(self):
+        """Test that the PNG file and the thumbnail are made by a single conversion."""
+        test_table = Table("Some Table")
+        some_pdf = f"{os.path.dirname(__file__)}/minimal.pdf"
+        test_table.add_image(some_pdf)
+        testdir = tmp_directory_name()
+        self.addCleanup(shutil.rmtree, testdir)
+        png_file = os.path.join(testdir, "minimal.png")
+        thumbnail_file = os.path.join(testdir, "thumb_minimal.png")
+
+        with patch("hepdata_lib.helpers.execute_command", return_value=True) as execute:
+            test_table.write_images(testdir, rasterizer=ImageMagickRasterizer())
+            self.assertEqual(execute.call_count, 1)
+            command = execute.call_args[0][0]
+            self.assertLess(command.index(some_pdf), command.index(f"-write {png_file}"))
+            self.assertLess(command.index(png_file), command.index(thumbnail_file))
+
+            # Only the missing thumbnail is made from an up-to-date PNG file
+            with open(png_file, "w", encoding="utf-8"):
+                pass
+            test_table.write_images(testdir, rasterizer=ImageMagickRasterizer())
+            self.assertEqual(execute.call_count, 2)
+            command = execute.call_args[0][0]
+            self.assertNotIn(some_pdf, command)
+            self.assertIn(f"{png_file} {thumbnail_file}", command)
+
+        self.assertEqual([resource["location"] for resource in test_table.additional_resources],
+                         ["minimal.png", "thumb_minimal.png"] * 2)
+
     def test_add_additional_resource(self):
         """Test the add_additional_resource function."""
         test_table = Table("Some Table")
@@ -130,3 +130,14 @@ class TestUncertainty(TestCase):
         self.assertTrue(len([ errs['label'] for i in [0,1,2] \
                                             for errs in dictionary['values'][i]['errors'] \
                                             if errs['label'] == 'errorA'])==2)
+
+    def test_values_in_place(self):
+        """Test that changes to the list of values are written back to the Uncertainty."""
+        unc = Uncertainty("testunc", is_symmetric=False)
+        unc.values = [(-1, 1), (-2, 2)]
+        revision = unc.revision
+        unc.values[1] = (-3, 3)
+        del unc.values[0]
+        self.assertEqual(unc.values, [(-3, 3)])
+        self.assertNotEqual(unc.revision, revision)
+        self.assertEqual(unc.values_column.tolist(), [(-3, 3)])
@@ -134,6 +134,31 @@ class TestVariable(TestCase):
         var.add_qualifier("testqualifier2", 1, units="")
         var.make_dict()
 
+    def test_make_dict_values(self):
+        """Test the values and uncertainties written by the make_dict function."""
+        var = Variable("testvar", is_independent=False, is_binned=False,
+                       values=[1.234567, 2, "-", 4.0], zero_uncertainties_warning=False)
+        var.digits = 3
+        sym = Uncertainty("sym", is_symmetric=True)
+        sym.values = [0.11111, None, 0, 0]
+        asym = Uncertainty("asym", is_symmetric=False)
+        asym.values = [(-0.5, 0.5), (-0.1, 0.22222), (0, 0), (0, 0)]
+        var.add_uncertainty(sym)
+        var.add_uncertainty(asym)
+
+        values = var.make_dict()["values"]
+        self.assertEqual(values[0], {
+            "value": 1.23,
+            "errors": [{"symerror": 0.111, "label": "sym"},
+                       {"symerror": 0.5, "label": "asym"}]
+        })
+        self.assertEqual(values[1], {
+            "value": 2,
+            "errors": [{"asymerror": {"minus": -0.1, "plus": 0.222}, "label": "asym"}]
+        })
+        self.assertEqual(values[2], {"value": "-"})
+        self.assertEqual(values[3], {"value": 4.0})
+
     def test_constructor(self):
         """Test the constructor of the Variable class."""
 
@@ -165,3 +190,30 @@ class TestVariable(TestCase):
         # Tuples, but wrong length
         with self.assertRaises(ValueError):
             _var = Variable("testvar", is_binned=False, values=binned_values_wrong_length)
+
+    def test_values_in_place(self):
+        """Test that changes to the list of values are written back to the Variable."""
+        var = Variable("testvar", is_binned=False, values=[1.0, 2.0])
+        revision = var.revision
+        var.values[0] = 5.0
+        var.values.append(3.0)
+        self.assertEqual(var.values, [5.0, 2.0, 3.0])
+        self.assertNotEqual(var.revision, revision)
+        self.assertEqual(var.make_dict()["values"][0], {"value": 5.0})
+
+        values = var.values
+        values.sort()
+        self.assertEqual(var.values, [2.0, 3.0, 5.0])
+
+        # Lists of values that were replaced no longer affect the Variable
+        var.values = [1.0]
+        values.append(6.0)
+        self.assertEqual(var.values, [1.0])
+
+        # Changes are checked like new values
+        binned = Variable("testvar", is_binned=True, values=[(1, 2)])
+        binned.values[0] = (2, 3)
+        self.assertEqual(binned.values, [(2, 3)])
+        with self.assertRaises(ValueError):
+            binned.values.append(3)
+        self.assertEqual(binned.values, [(2, 3)])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Test the streaming YAML emitter."""
+import io
+import random
+from unittest import TestCase
+
+import yaml
+from hepdata_lib import Table, Variable, Uncertainty, Dumper
+from hepdata_lib.yaml_emitter import emit_table, format_float
+
+
+def reference_output(table):
+    """Dump the table the same way as Table.write_yaml does."""
+    return yaml.dump(table.make_dict(), Dumper=Dumper, default_flow_style=False)
+
+
+def streaming_output(table, chunk_size=3):
+    """Write the table with the streaming emitter."""
+    stream = io.StringIO()
+    emit_table(table, stream, Dumper, chunk_size=chunk_size)
+    return stream.getvalue()
+
+
+def random_number():
+    """Return a random int or float spanning many orders of magnitude."""
+    if random.random() < 0.2:
+        return random.randint(-1000000, 1000000)
+    return random.uniform(-1, 1) * 10 ** random.randint(-20, 20)
+
+
+class TestYamlEmitter(TestCase):
+    """Test the streaming YAML emitter."""
+
+    def test_format_float(self):
+        """Test that floats are formatted like the YAML representer does."""
+        values = [0.0, -0.0, 1.0, 1e17, 1.5e-12, -3.25, float("nan"), float("inf"),
+                  -float("inf"), 123456789.123]
+        for value in values:
+            expected = yaml.dump(value, Dumper=Dumper).split("\n", maxsplit=1)[0]
+            self.assertEqual(format_float(value), expected)
+
+    def test_random_tables(self):
+        """Test that random tables are written identically to the reference path."""
+        random.seed(42)
+        labels = ["stat", "sys, lumi", "'quoted'", "a: b", "-", "", "x" * 120,
+                  "long label " * 12, "µ unicode"]
+        for itable in range(20):
+            table = Table(f"Table {itable}")
+            nbins = random.randint(0, 30)
+            xvar = Variable("x", is_binned=random.random() < 0.5)
+            if xvar.is_binned:
+                xvar.values = [(i, i + random_number()) for i in range(nbins)]
+            else:
+                xvar.values = [random_number() for _ in range(nbins)]
+            table.add_variable(xvar)
+
+            for ivar in range(random.randint(0, 3)):
+                yvar = Variable(random.choice(labels) or f"y{ivar}", is_independent=False,
+                                is_binned=False, units=random.choice(["", "GeV", "pb: x"]),
+                                zero_uncertainties_warning=False)
+                yvar.values = [random.choice([random_number(), "-", 0])
+                               for _ in range(nbins)]
+                yvar.add_qualifier("SQRT(S)", 13000, "GeV")
+                yvar.add_qualifier(random.choice(labels), random.choice(labels + [1.5]))
+                for _ in range(random.randint(0, 3)):
+                    unc = Uncertainty(random.choice(labels), is_symmetric=random.random() < 0.5)
+                    if unc.is_symmetric:
+                        unc.values = [random.choice([random_number(), 0, None])
+                                      for _ in range(nbins)]
+                    else:
+                        unc.values = [random.choice([(-random_number(), random_number()),
+                                                     (-0.5, 0.5), (0, 0)])
+                                      for _ in range(nbins)]
+                    yvar.add_uncertainty(unc)
+                table.add_variable(yvar)
+
+            for chunk_size in [1, 7, 10000]:
+                self.assertEqual(streaming_output(table, chunk_size), reference_output(table))
+
+    def test_shared_qualifiers(self):
+        """Test that objects shared between variables give the same anchors and aliases."""
+        table = Table("Table")
+        yvar1 = Variable("y1", is_independent=False, is_binned=False, values=[1, 2])
+        yvar2 = Variable("y2", is_independent=False, is_binned=False, values=[3, 4])
+        yvar1.add_qualifier("SQRT(S)", 13000, "GeV")
+        yvar2.qualifiers = yvar1.qualifiers
+        table.add_variable(yvar1)
+        table.add_variable(yvar2)
+
+        output = streaming_output(table)
+        self.assertIn("&id001", output)
+        self.assertEqual(output, reference_output(table))
+
+    def test_empty_table(self):
+        """Test tables without variables or values."""
+        table = Table("Table")
+        self.assertEqual(streaming_output(table), reference_output(table))
+        table.add_variable(Variable("x"))
+        table.add_variable(Variable("y", is_independent=False, is_binned=False))
+        self.assertEqual(streaming_output(table), reference_output(table))